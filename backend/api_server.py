@@ -2,15 +2,28 @@
 # TODO: Consider some kind of authentication for the API, even if it's just a token in the header saved in the frontend code for now
 import os
 import sys
-from fastapi import FastAPI, Request, Depends
-from fastapi.responses import HTMLResponse
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import FastAPI, Request, Response, Depends
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import uvicorn
-from db_interface import DBInterface
+from db_interface import DBInterface, parse_date, select_price_fields, MARKET_INDICES
+from downsample import lttb_indices
+from async_db_interface import AsyncDBInterface
+from capm_model import CAPMModel, MODEL_FACTORS, RISK_FREE_SERIES
+from response_cache import response_cache, InvalidationListener, UNIVERSE
+from response_formats import (CompressionMiddleware, FORMAT_MEDIA_TYPES, TABLE_FORMATS, BATCH_FORMATS, DOCUMENT_FORMATS, format_available,
+                              negotiate_format, encode_data, price_arrow_schema, stream_arrow_batches, stream_msgpack_rows)
 import json
+import datetime
+import threading
+import pandas as pd
+from dateutil.relativedelta import relativedelta
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from authlib.integrations.starlette_client import OAuth, OAuthError
 
 load_dotenv()
@@ -41,52 +54,367 @@ app.add_middleware(
 app.add_middleware(
     SessionMiddleware, secret_key=os.getenv('AUTH_SECRET_KEY')
 )
+# brotli / gzip for JSON, NDJSON and MessagePack responses larger than COMPRESSION_MINIMUM_SIZE bytes
+app.add_middleware(
+    CompressionMiddleware, minimum_size=int(os.getenv('COMPRESSION_MINIMUM_SIZE', 1024))
+)
 
 db_interface = DBInterface() # Consider a different name for this object as it is the same as the file name
+# KOCOON_DB_MODE selects the data path used by the routes
+# 'async' (default) runs queries natively on an asyncpg pool, 'sync' runs the psycopg2 DBInterface on the threadpool
+db_mode = os.getenv('KOCOON_DB_MODE', 'async')
+async_db_interface = AsyncDBInterface() if db_mode == 'async' else None
+# Seconds browsers may reuse a data response before revalidating it with its ETag
+http_cache_max_age = int(os.getenv('HTTP_CACHE_MAX_AGE', 60))
+# Largest number of tickers accepted by the /api/batch routes
+max_batch_tickers = int(os.getenv('MAX_BATCH_TICKERS', 200))
+# Keeps the statement / model response cache consistent with writes made by the ingest scripts and model runs
+cache_listener = InvalidationListener(
+    response_cache,
+    host=os.getenv('DATABASE_HOST'),
+    database='financials',
+    user=os.getenv('DATABASE_USER'),
+    password=os.getenv('DATABASE_PASSWORD')
+)
 
-@app.get("/api/balance_sheet/{period_type}/{ticker}")
-def get_balance_sheet(period_type: str, ticker: str):
+@app.on_event("startup")
+async def open_async_db_interface():
+    if async_db_interface is not None:
+        await async_db_interface.open()
+    if response_cache.enabled:
+        cache_listener.start()
+
+@app.on_event("shutdown")
+async def close_async_db_interface():
+    cache_listener.stop()
+    if async_db_interface is not None:
+        await async_db_interface.close()
+
+async def db_call(method: str, *args, **kwargs):
+    # Awaits the AsyncDBInterface version of a DBInterface method when running in async mode
+    # Otherwise (or when there is no async version) the blocking call is run on the threadpool so it never stalls the event loop
+    if async_db_interface is not None and hasattr(async_db_interface, method):
+        return await getattr(async_db_interface, method)(*args, **kwargs)
+    return await run_in_threadpool(getattr(db_interface, method), *args, **kwargs)
+
+async def dependency_versions(dependencies: list) -> list:
+    # Data versions ({'version', 'updated_at'}, {} when never versioned) of the (scope, ticker) pairs a response is computed from
+    versions = []
+    for scope, ticker in dependencies:
+        scope_versions: dict = await db_call('get_data_versions', scope, [ticker])
+        versions.append(scope_versions[ticker])
+    return versions
+
+async def conditional_headers(request: Request, scope: str, tickers: list, fmt: str = 'json', dependencies: list = ()):
+    # Builds ETag / Last-Modified / Cache-Control headers from the tickers' data versions and checks the request's validators
+    # dependencies are further (scope, ticker) pairs the response is computed from, e.g. ('factor_returns', UNIVERSE), their versions are part of the tag
+    # Returns (headers, not_modified), only Vary is set when any ticker's data has never been versioned by an ingest script
+    headers = {'Vary': 'Accept'}
+    ticker_versions: dict = await db_call('get_data_versions', scope, tickers)
+    versions = [ticker_versions[ticker] for ticker in tickers] + await dependency_versions(dependencies)
+    if not all(versions):
+        return headers, False
+    # The same data is served in different shapes (period, fields, format, ...) so the path, query and format are part of the tag
+    variant = f"{request.url.path}?{request.url.query}|{fmt}|" + ','.join(f"{version['version']}:{version['updated_at']}" for version in versions)
+    etag = '"' + hashlib.sha1(variant.encode()).hexdigest() + '"'
+    updated_at = max(version['updated_at'] for version in versions)
+    headers.update({
+        'ETag': etag,
+        'Last-Modified': formatdate(updated_at, usegmt=True),
+        'Cache-Control': f'public, max-age={http_cache_max_age}, must-revalidate',
+    })
+    # If-None-Match takes precedence over If-Modified-Since when both are sent
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return headers, etag in tags or '*' in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return headers, parsedate_to_datetime(if_modified_since).timestamp() >= updated_at
+        except (TypeError, ValueError):
+            pass
+    return headers, False
+
+def not_acceptable(formats: list):
+    return JSONResponse({"error": "Not acceptable", "formats": [fmt for fmt in formats if format_available(fmt)]}, status_code=406)
+
+async def format_response(data, fmt: str, headers: dict):
+    # JSON is serialized by FastAPI (with the headers already set on the route's response), other formats are encoded here
+    if fmt == 'json':
+        return data
+    content = await run_in_threadpool(encode_data, data, fmt)
+    return Response(content=content, media_type=FORMAT_MEDIA_TYPES[fmt], headers=headers)
+
+async def get_statement(request: Request, response: Response, period_type: str, ticker: str, report_type: str, format: str = None):
     if db_interface.verify_query_input(period_type, ticker) == False:
         return {"error": "Invalid input"}
-    data: list = db_interface.query(ticker=ticker.upper(), period_type=period_type, report_type='balance_sheet')
-    data = [data for data in data if data['periodType'] != 'TTM']
-    return data
+    fmt = negotiate_format(format, request.headers.get('accept'), TABLE_FORMATS)
+    if fmt is None:
+        return not_acceptable(TABLE_FORMATS)
+    ticker = ticker.upper()
+    headers, not_modified = await conditional_headers(request, 'fundamentals', [ticker], fmt)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    data: list = await db_call('query', ticker=ticker, period_type=period_type, report_type=report_type, exclude_ttm=True)
+    return await format_response(data, fmt, headers)
+
+# The data routes pick their format from ?format= (json, ndjson, msgpack or arrow) or else the Accept header, see response_formats.py
+@app.get("/api/balance_sheet/{period_type}/{ticker}")
+async def get_balance_sheet(period_type: str, ticker: str, request: Request, response: Response, format: str = None):
+    return await get_statement(request, response, period_type, ticker, 'balance_sheet', format)
 
 @app.get("/api/income/{period_type}/{ticker}")
-def get_income_statement(period_type: str, ticker: str):
-    if db_interface.verify_query_input(period_type, ticker) == False:
-        return {"error": "Invalid input"}
-    data: list = db_interface.query(ticker=ticker.upper(), period_type=period_type, report_type='income')
-    data = [data for data in data if data['periodType'] != 'TTM']
-    return data
+async def get_income_statement(period_type: str, ticker: str, request: Request, response: Response, format: str = None):
+    return await get_statement(request, response, period_type, ticker, 'income', format)
 
 @app.get("/api/cash_flow/{period_type}/{ticker}")
-def get_cash_flow(period_type: str, ticker: str):
-    if db_interface.verify_query_input(period_type, ticker) == False:
-        return {"error": "Invalid input"}
-    data: list = db_interface.query(ticker=ticker.upper(), period_type=period_type, report_type='cash_flow')
-    data = [data for data in data if data['periodType'] != 'TTM']
-    return data
+async def get_cash_flow(period_type: str, ticker: str, request: Request, response: Response, format: str = None):
+    return await get_statement(request, response, period_type, ticker, 'cash_flow', format)
+
+async def db_stream(method: str, *args, **kwargs):
+    # Streaming counterpart of db_call for DBInterface generator methods that yield chunks of rows
+    if async_db_interface is not None and hasattr(async_db_interface, method):
+        async for chunk in getattr(async_db_interface, method)(*args, **kwargs):
+            yield chunk
+    else:
+        async for chunk in iterate_in_threadpool(getattr(db_interface, method)(*args, **kwargs)):
+            yield chunk
+
+async def stream_json_rows(chunks, ndjson=False):
+    # Serializes chunks of row dicts as they arrive, either as one JSON array or as newline-delimited JSON
+    # dates are the only non-JSON type in price rows and are written as 'YYYY-MM-DD'
+    first = True
+    if not ndjson:
+        yield '['
+    async for chunk in chunks:
+        if ndjson:
+            yield ''.join(json.dumps(row, default=str) + '\n' for row in chunk)
+        else:
+            body = ','.join(json.dumps(row, default=str) for row in chunk)
+            yield body if first else ',' + body
+            first = False
+    if not ndjson:
+        yield ']'
+
+def downsample_rows(frame, points, fields):
+    # Reduces a date-indexed price frame to `points` rows with LTTB on the close (or first requested field)
+    y_field = 'close' if 'close' in fields else fields[0]
+    frame = frame[frame[y_field].notna()]
+    x = frame.index.values.astype('datetime64[D]').astype(float)
+    selected = frame.iloc[lttb_indices(x, frame[y_field].to_numpy(), points)][fields]
+    rows = selected.to_dict(orient='records')
+    for row, date in zip(rows, selected.index):
+        row['date'] = date.strftime('%Y-%m-%d')
+    return [{'date': row.pop('date'), **row} for row in rows]
 
 @app.get("/api/price_history/{period}/{ticker}")
-def get_price_history(period: str, ticker: str):
+async def get_price_history(period: str, ticker: str, request: Request, response: Response, format: str = None, start: str = None,
+                            end: str = None, fields: str = None, resample: str = None, points: int = None):
+    # start / end ('YYYY-MM-DD') limit the date range and fields is a comma separated subset of the price columns
+    # resample=weekly|monthly aggregates the daily bars in SQL, points=N downsamples the result to N points with LTTB
+    # Without resample / points the history is streamed from a server-side cursor so memory per request stays flat
+    # format=ndjson returns one JSON object per line instead of a JSON array, arrow streams one record batch per chunk
     if db_interface.verify_price_history_input(period, ticker) == False:
         return {"error": "Invalid input"}
-    data: list = db_interface.query_stock_history(ticker=ticker.upper(), period_type=period, start_date='1900-01-01')
-    return data
+    if resample not in [None, 'weekly', 'monthly'] or (points is not None and points < 3):
+        return {"error": "Invalid input"}
+    try:
+        start_date = parse_date(start) if start else '1900-01-01'
+        end_date = parse_date(end) if end else None
+        field_list = select_price_fields(fields.split(',') if fields else None)
+    except ValueError:
+        return {"error": "Invalid input"}
+    fmt = negotiate_format(format, request.headers.get('accept'), TABLE_FORMATS)
+    if fmt is None:
+        return not_acceptable(TABLE_FORMATS)
+    ticker = ticker.upper()
+    headers, not_modified = await conditional_headers(request, 'price_history', [ticker], fmt)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+
+    if resample is None and points is None:
+        chunks = db_stream('stream_stock_history', ticker=ticker, period_type=period, start_date=start_date, end_date=end_date, fields=field_list)
+        if fmt == 'arrow':
+            body = stream_arrow_batches(chunks, price_arrow_schema(field_list))
+        elif fmt == 'msgpack':
+            body = stream_msgpack_rows(chunks)
+        else:
+            body = stream_json_rows(chunks, ndjson=fmt == 'ndjson')
+        return StreamingResponse(body, media_type=FORMAT_MEDIA_TYPES[fmt], headers=headers)
+
+    response.headers.update(headers)
+
+    if resample is not None:
+        interval = 'week' if resample == 'weekly' else 'month'
+        data: list = await db_call('query_resampled_stock_history', ticker=ticker, interval=interval, period_type=period,
+                                   start_date=start_date, end_date=end_date, fields=field_list)
+        if points is None or points >= len(data):
+            return await format_response(data, fmt, headers)
+        frame = pd.DataFrame(data, columns=['date'] + field_list).set_index('date')
+        frame.index = pd.to_datetime(frame.index)
+    else:
+        frame = await db_call('query_stock_history_arrays', ticker=ticker, period_type=period, start_date=start_date, end_date=end_date)
+    data = await run_in_threadpool(downsample_rows, frame, points, field_list)
+    return await format_response(data, fmt, headers)
+
+def parse_batch_tickers(tickers: str):
+    # Splits the comma separated tickers parameter of the batch routes, dropping duplicates but keeping the request order
+    # Returns None if the list is empty, too long, or contains an unknown ticker
+    ticker_list = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers.split(',') if ticker.strip()))
+    if not ticker_list or len(ticker_list) > max_batch_tickers:
+        return None
+    if any(ticker not in db_interface.all_tickers for ticker in ticker_list):
+        return None
+    return ticker_list
+
+# The price route is registered before the statement route so 'price_history' is not taken as a report type
+@app.get("/api/batch/price_history/{period}")
+async def get_batch_price_history(period: str, tickers: str, request: Request, response: Response, start: str = None,
+                                  end: str = None, fields: str = None, format: str = None):
+    # Price histories for up to MAX_BATCH_TICKERS comma separated tickers read with a single query
+    # Returns {ticker: [rows]} with the same row shape, start / end and fields as /api/price_history
+    ticker_list = parse_batch_tickers(tickers)
+    if ticker_list is None or period not in ['1d']:
+        return {"error": "Invalid input"}
+    try:
+        start_date = parse_date(start) if start else None
+        end_date = parse_date(end) if end else None
+        field_list = select_price_fields(fields.split(',') if fields else None)
+    except ValueError:
+        return {"error": "Invalid input"}
+    # Arrow responses are a single table with a leading ticker column
+    fmt = negotiate_format(format, request.headers.get('accept'), BATCH_FORMATS)
+    if fmt is None:
+        return not_acceptable(BATCH_FORMATS)
+    headers, not_modified = await conditional_headers(request, 'price_history', ticker_list, fmt)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    data: dict = await db_call('query_price_histories', ticker_list, period_type=period, start_date=start_date, end_date=end_date, fields=field_list)
+    return await format_response(data, fmt, headers)
+
+@app.get("/api/batch/{report_type}/{period_type}")
+async def get_batch_statements(report_type: str, period_type: str, tickers: str, request: Request, response: Response, format: str = None):
+    # Statements for up to MAX_BATCH_TICKERS comma separated tickers, e.g. /api/batch/income/q?tickers=AAPL,MSFT
+    # Returns {ticker: [statements]} where each list matches the single ticker route, tickers already cached are not queried again
+    ticker_list = parse_batch_tickers(tickers)
+    if ticker_list is None or report_type not in ['balance_sheet', 'income', 'cash_flow'] or period_type not in ['q', 'a']:
+        return {"error": "Invalid input"}
+    fmt = negotiate_format(format, request.headers.get('accept'), BATCH_FORMATS)
+    if fmt is None:
+        return not_acceptable(BATCH_FORMATS)
+    headers, not_modified = await conditional_headers(request, 'fundamentals', ticker_list, fmt)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    data: dict = await db_call('query_statements', ticker_list, period_type=period_type, report_type=report_type, exclude_ttm=True)
+    return await format_response(data, fmt, headers)
 
 @app.get("/api/multifactor_model/{years}y/{ticker}/{num_factors}")
-def get_multifactor_model(years: int, ticker: str, num_factors: int):
+async def get_multifactor_model(years: int, ticker: str, num_factors: int, request: Request, response: Response, format: str = None):
     # if db_interface.verify_multifactor_model_input(ticker, years, num_factors) == False:
     #     return {"error": "Invalid input"}
     # TODO: Implement input verification for multifactor model
     # for now it just returns an empty dict if the input is invalid
-    data: list = db_interface.query_multifactor_model(ticker=ticker.upper(), years=years, num_factors=num_factors)
-    return data
+    fmt = negotiate_format(format, request.headers.get('accept'), DOCUMENT_FORMATS)
+    if fmt is None:
+        return not_acceptable(DOCUMENT_FORMATS)
+    ticker = ticker.upper()
+    headers, not_modified = await conditional_headers(request, 'multifactor_model', [ticker], fmt)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    data: list = await db_call('query_multifactor_model', ticker=ticker, years=years, num_factors=num_factors)
+    return await format_response(data, fmt, headers)
+
+# Model names accepted by the rolling betas route
+ROLLING_BETA_MODELS = {
+    'capm': 'CAPM',
+    'three_factor': 'Fama-French Three-Factor',
+    'four_factor': 'Carhart Four-Factor',
+    'five_factor': 'Fama-French Five-Factor',
+    'six_factor': 'Fama-French Six-Factor',
+}
+
+# Models of the rolling betas requests by the data versions of the series they load (the market index, factor returns and
+# risk-free rates), so those are loaded once per window and versions. A model is never cleared while requests use it, newer
+# versions get a new model and only the ROLLING_BETA_MODELS_KEPT most recently used ones are kept
+ROLLING_BETA_MODELS_KEPT = 4
+rolling_beta_models = {}
+rolling_beta_models_lock = threading.Lock()
+
+def rolling_beta_model(versions) -> CAPMModel:
+    # The model of the versions, created when there is none
+    with rolling_beta_models_lock:
+        model = rolling_beta_models.pop(versions, None)
+        if model is None:
+            model = CAPMModel(fred_api_key=os.getenv('FRED_API_KEY'), db_interface=db_interface)
+        # Most recently used last
+        rolling_beta_models[versions] = model
+        while len(rolling_beta_models) > ROLLING_BETA_MODELS_KEPT:
+            del rolling_beta_models[next(iter(rolling_beta_models))]
+        return model
+
+def compute_rolling_betas(ticker, market_index, years, model_name, window, halflife, versions) -> list:
+    # Rows of {date, const, <factor betas>} for the dates with enough history
+    # versions are the data versions of the series behind the betas besides the ticker's prices
+    model = rolling_beta_model(versions)
+    end_date = datetime.datetime.now()
+    start_date = end_date - relativedelta(years=years)
+    betas = model.rolling_betas(ticker, market_index, start_date, end_date, model_name=model_name, window=window, halflife=halflife).dropna()
+    rows = betas.to_dict(orient='records')
+    return [{'date': date.strftime('%Y-%m-%d'), **row} for row, date in zip(rows, betas.index)]
+
+@app.get("/api/rolling_betas/{ticker}")
+async def get_rolling_betas(ticker: str, request: Request, response: Response, model: str = 'capm', window: int = 252, halflife: int = None,
+                            years: int = 5, market_index: str = '^GSPC', format: str = None):
+    # Daily betas of the ticker on the model's factors, each from the trailing `window` trading days of returns,
+    # or exponentially weighted over all earlier days when halflife (in trading days) is given
+    # model is one of ROLLING_BETA_MODELS, the series covers the last `years` years
+    if model not in ROLLING_BETA_MODELS or window < 10 or (halflife is not None and halflife < 1) or not 1 <= years <= 30:
+        return {"error": "Invalid input"}
+    ticker = ticker.upper()
+    market_index = market_index.upper()
+    if ticker not in db_interface.all_tickers or market_index not in MARKET_INDICES:
+        return {"error": "Invalid input"}
+    fmt = negotiate_format(format, request.headers.get('accept'), TABLE_FORMATS)
+    if fmt is None:
+        return not_acceptable(TABLE_FORMATS)
+    # Besides the ticker's prices the betas depend on the index prices, the risk-free rates and the factor returns
+    dependencies = [('price_history', market_index), ('risk_free_rates', RISK_FREE_SERIES)]
+    if len(MODEL_FACTORS[ROLLING_BETA_MODELS[model]]) > 1:
+        dependencies.append(('factor_returns', UNIVERSE))
+    headers, not_modified = await conditional_headers(request, 'price_history', [ticker], fmt, dependencies)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    # Cached under the ticker's price history so new prices invalidate it, the versions of the other series are part of the key
+    # so an entry computed from older index prices, rates or factors is never served
+    versions = tuple(version.get('version') for version in await dependency_versions(dependencies))
+    key = ('price_history', ticker, 'rolling_betas', model, window, halflife, years, market_index, versions)
+    try:
+        data: list = await response_cache.get_or_load_async(key, lambda: run_in_threadpool(
+            compute_rolling_betas, ticker, market_index, years, ROLLING_BETA_MODELS[model], window, halflife, versions))
+    except Exception as e:
+        print(f"Error computing rolling betas for {ticker}: {e}")
+        return {"error": "Could not compute betas"}
+    response.headers.update(headers)
+    return await format_response(data, fmt, headers)
 
 @app.get("/api/tickers")
 async def get_all_tickers() -> list:
-    return db_interface.get_all_tickers()
+    return await db_call('get_all_tickers')
+
+@app.get("/api/stats/db_pool")
+async def get_db_pool_stats() -> dict:
+    # Connection pool size and checkout wait metrics, useful for sizing DATABASE_POOL_MAX
+    return await db_call('get_pool_stats')
+
+@app.get("/api/stats/cache")
+async def get_cache_stats() -> dict:
+    # Response cache hit / miss / eviction counters and current size, useful for sizing RESPONSE_CACHE_MAX_BYTES
+    return await db_call('get_cache_stats')
 
 @app.get('/api/github_login')
 async def github_login(request: Request):
@@ -110,7 +438,7 @@ async def github_auth(request: Request):
     email = user_data['email']
 
     # save or update user in the database
-    db_interface.push_github_user(github_id, username, email)
+    await db_call('push_github_user', github_id, username, email)
     
     # redirect to the home page after login
     response = RedirectResponse(url='/')
@@ -120,8 +448,8 @@ async def github_auth(request: Request):
     return response
 
 @app.get('/api/user/{user_id}')
-def get_user(user_id: int):
-    return db_interface.get_github_user(user_id)
+async def get_user(user_id: int):
+    return await db_call('get_github_user', user_id)
 
 # period types are 'q' for quarterly and 'a' for annual
 # report types are 'balance_sheet', 'income', 'cash_flow'
@@ -0,0 +1,257 @@
+import os
+import re
+import json
+import time
+from contextlib import asynccontextmanager
+import asyncpg
+from db_interface import (check_env_vars, parse_date, statement_query, statement_cache_key, statement_to_dict,
+                          PRICE_HISTORY_TABLES, select_price_fields)
+from response_cache import response_cache
+
+def numbered_placeholders(sql_string):
+    # Rewrites the %s placeholders of a query shared with DBInterface into asyncpg's $1, $2, ...
+    counter = iter(range(1, sql_string.count('%s') + 1))
+    return re.sub(r'%s', lambda match: f'${next(counter)}', sql_string)
+
+# asyncio counterpart of DBInterface backed by an asyncpg connection pool
+# Only the methods used on the API request path are implemented here, they return the same shapes as their DBInterface equivalents
+class AsyncDBInterface:
+    def __init__(self, min_size=None, max_size=None, pool_timeout=None):
+        vars_present = check_env_vars()
+        if vars_present == False:
+            raise Exception("Database environment variables not set")
+
+        # Pool sizes default to the ASYNC_DATABASE_POOL_MIN / ASYNC_DATABASE_POOL_MAX environment variables
+        # asyncpg connections are cheap to multiplex so the default maximum is higher than the threaded pool's
+        self.min_size = min_size if min_size is not None else int(os.getenv('ASYNC_DATABASE_POOL_MIN', 2))
+        self.max_size = max_size if max_size is not None else int(os.getenv('ASYNC_DATABASE_POOL_MAX', 50))
+        self.pool_timeout = pool_timeout if pool_timeout is not None else float(os.getenv('DATABASE_POOL_TIMEOUT', 30))
+        self.pool = None
+        self.all_tickers = []
+        self._stats = {
+            'checkouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+        }
+
+    async def open(self):
+        # The pool has to be created from inside the running event loop, so this is called from the app's startup hook
+        self.pool = await asyncpg.create_pool(
+            host=os.getenv('DATABASE_HOST'),
+            database='financials',
+            user=os.getenv('DATABASE_USER'),
+            password=os.getenv('DATABASE_PASSWORD'),
+            min_size=self.min_size,
+            max_size=self.max_size,
+            init=self._init_connection
+        )
+        await self.set_all_tickers()
+        return self
+
+    async def _init_connection(self, conn):
+        # Decode JSONB into Python objects like psycopg2 does
+        await conn.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        start = time.monotonic()
+        try:
+            conn = await self.pool.acquire(timeout=self.pool_timeout)
+        except TimeoutError:
+            self._stats['timeouts'] += 1
+            raise
+        wait_time = time.monotonic() - start
+        self._stats['checkouts'] += 1
+        self._stats['wait_time_total'] += wait_time
+        self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def get_pool_stats(self) -> dict:
+        stats = dict(self._stats)
+        stats['size'] = self.pool.get_size()
+        stats['idle'] = self.pool.get_idle_size()
+        stats['in_use'] = stats['size'] - stats['idle']
+        stats['minconn'] = self.pool.get_min_size()
+        stats['maxconn'] = self.pool.get_max_size()
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    async def get_cache_stats(self) -> dict:
+        return response_cache.stats()
+
+    async def set_all_tickers(self):
+        self.all_tickers = await self.get_all_tickers()
+
+    async def get_data_versions(self, scope, tickers) -> dict:
+        # Shares DBInterface's cached data versions
+        versions = await response_cache.get_many_or_load_async([(scope, ticker, 'version') for ticker in tickers],
+                                                               lambda keys: self._get_data_versions(scope, keys))
+        return {key[1]: version for key, version in versions.items()}
+
+    async def _get_data_versions(self, scope, keys) -> dict:
+        try:
+            async with self.connection() as conn:
+                rows = await conn.fetch("SELECT ticker, version, extract(epoch FROM updated_at) FROM data_versions WHERE scope = $1 AND ticker = ANY($2::text[])",
+                                        scope, [key[1] for key in keys])
+        except asyncpg.exceptions.UndefinedTableError:
+            rows = []
+        versions = {row[0]: {'version': row[1], 'updated_at': float(row[2])} for row in rows}
+        return {key: versions.get(key[1], {}) for key in keys}
+
+    async def query(self, ticker='AAPL', period_type='q', report_type='balance_sheet', as_of_date=None, exclude_ttm=False, latest=None, columns=None) -> list:
+        # Same filters and response cache entries as DBInterface.query
+        filters = dict(as_of_date=as_of_date, exclude_ttm=exclude_ttm, latest=latest, columns=columns)
+        return await response_cache.get_or_load_async(statement_cache_key(ticker, period_type, report_type, **filters),
+                                                      lambda: self._query(ticker, period_type, report_type, **filters))
+
+    async def _query(self, ticker, period_type, report_type, **filters) -> list:
+        sql_string, params = statement_query(ticker, period_type, report_type, **filters)
+        async with self.connection() as conn:
+            financial_data = await conn.fetch(numbered_placeholders(sql_string), *params)
+        return [statement_to_dict(ticker, *row) for row in financial_data]
+
+    async def query_statements(self, tickers, period_type='q', report_type='balance_sheet', exclude_ttm=False) -> dict:
+        # Batch version of query returning {ticker: statements}, shares DBInterface's cache entries
+        keys = [statement_cache_key(ticker, period_type, report_type, exclude_ttm=exclude_ttm) for ticker in tickers]
+        statements = await response_cache.get_many_or_load_async(keys, lambda keys: self._query_statements(keys, period_type, report_type, exclude_ttm))
+        return {key[1]: data for key, data in statements.items()}
+
+    async def _query_statements(self, keys, period_type, report_type, exclude_ttm) -> dict:
+        sql_string = f"""
+            SELECT ticker, as_of_date, period_code, max(currency_code), jsonb_object_agg(line_item, value)
+            FROM fundamentals
+            WHERE ticker = ANY($1::text[]) AND report_type = $2 AND period_type = $3 {"AND period_code <> 'TTM'" if exclude_ttm else ''}
+            GROUP BY ticker, as_of_date, period_code
+            ORDER BY ticker, as_of_date, period_code
+        """
+        async with self.connection() as conn:
+            financial_data = await conn.fetch(sql_string, [key[1] for key in keys], report_type, period_type)
+        statements = {key[1]: [] for key in keys}
+        for row in financial_data:
+            statements[row[0]].append(statement_to_dict(*row))
+        return {key: statements[key[1]] for key in keys}
+
+    async def query_stock_history(self, ticker='AAPL', period_type='1d', start_date=None, end_date=None, fields=None):
+        if period_type not in PRICE_HISTORY_TABLES:
+            print(f"No price history table for period {period_type}.")
+            return []
+        conditions = ['ticker = $1']
+        params = [ticker]
+
+        # dates can be of type str, datetime, or date
+        if start_date is not None:
+            params.append(parse_date(start_date))
+            conditions.append(f'date >= ${len(params)}')
+        if end_date is not None:
+            params.append(parse_date(end_date))
+            conditions.append(f'date <= ${len(params)}')
+
+        sql_string = f'SELECT date, {", ".join(select_price_fields(fields))} FROM {PRICE_HISTORY_TABLES[period_type]} WHERE ' + ' AND '.join(conditions)
+        sql_string += ' ORDER BY date'
+
+        try:
+            async with self.connection() as conn:
+                price_data = await conn.fetch(sql_string, *params)
+            data_dict_list = [dict(row) for row in price_data]
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            data_dict_list = []
+        return data_dict_list
+
+    async def query_price_histories(self, tickers, period_type='1d', start_date=None, end_date=None, fields=None) -> dict:
+        # Batch version of query_stock_history returning {ticker: rows} from one query
+        if period_type not in PRICE_HISTORY_TABLES:
+            print(f"No price history table for period {period_type}.")
+            return {}
+        conditions = ['ticker = ANY($1::text[])']
+        params = [list(tickers)]
+        if start_date is not None:
+            params.append(parse_date(start_date))
+            conditions.append(f'date >= ${len(params)}')
+        if end_date is not None:
+            params.append(parse_date(end_date))
+            conditions.append(f'date <= ${len(params)}')
+        field_list = select_price_fields(fields)
+        sql_string = f'SELECT ticker, date, {", ".join(field_list)} FROM {PRICE_HISTORY_TABLES[period_type]} WHERE ' + ' AND '.join(conditions) + ' ORDER BY ticker, date'
+        histories = {ticker: [] for ticker in tickers}
+        async with self.connection() as conn:
+            for row in await conn.fetch(sql_string, *params):
+                histories[row['ticker']].append({name: row[name] for name in ['date'] + field_list})
+        return histories
+
+    async def stream_stock_history(self, ticker='AAPL', period_type='1d', start_date=None, end_date=None, chunk_size=2000, fields=None):
+        # Async generator version of query_stock_history that yields lists of at most chunk_size row dicts from a server-side cursor
+        conditions = ['ticker = $1']
+        params = [ticker]
+        if start_date is not None:
+            params.append(parse_date(start_date))
+            conditions.append(f'date >= ${len(params)}')
+        if end_date is not None:
+            params.append(parse_date(end_date))
+            conditions.append(f'date <= ${len(params)}')
+        sql_string = f'SELECT date, {", ".join(select_price_fields(fields))} FROM {PRICE_HISTORY_TABLES[period_type]} WHERE ' + ' AND '.join(conditions) + ' ORDER BY date'
+        async with self.connection() as conn:
+            # asyncpg cursors only exist inside a transaction
+            async with conn.transaction():
+                cursor = await conn.cursor(sql_string, *params)
+                while True:
+                    rows = await cursor.fetch(chunk_size)
+                    if not rows:
+                        break
+                    yield [dict(row) for row in rows]
+
+    async def query_multifactor_model(self, ticker='AAPL', years=10, num_factors=5):
+        # Returns the JSON object stored in the database
+        return await response_cache.get_or_load_async(('multifactor_model', ticker, years, num_factors),
+                                                      lambda: self._query_multifactor_model(ticker, years, num_factors))
+
+    async def _query_multifactor_model(self, ticker, years, num_factors):
+        table_name = f"{ticker}_{years}y_{num_factors}_factor_model_summary"
+        sql_string = f'SELECT data FROM "{table_name}" ORDER BY id DESC LIMIT 1'
+        try:
+            async with self.connection() as conn:
+                model_data = await conn.fetchval(sql_string)
+        except asyncpg.exceptions.UndefinedTableError:
+            print(f"Table {table_name} does not exist.")
+            model_data = None
+        return model_data if model_data is not None else {}
+
+    async def get_all_tickers(self) -> list:
+        async with self.connection() as conn:
+            tickers = await conn.fetch("SELECT DISTINCT ticker FROM financial_master;")
+        return [ticker[0] for ticker in tickers]
+
+    async def get_github_user(self, github_id):
+        async with self.connection() as conn:
+            user = await conn.fetchrow("SELECT * FROM github_users WHERE github_id = $1", github_id)
+        # remove email from user data
+        if user:
+            user = tuple(user)[:-1]
+        return user
+
+    async def push_github_user(self, github_id, username, email):
+        async with self.connection() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS github_users (
+                    github_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    email TEXT
+                )
+            """)
+            try:
+                await conn.execute("""
+                    INSERT INTO github_users (github_id, username, email)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (github_id) DO UPDATE
+                    SET username = EXCLUDED.username, email = EXCLUDED.email;""", github_id, username, email)
+            except Exception as e:
+                print(f"An error occurred: {e}")
@@ -0,0 +1,135 @@
+# Batched OLS for regressing many assets on the same factors
+# Every ticker shares the factor design matrix, so instead of one statsmodels fit per ticker the regressions are solved
+# together: tickers observed on every date share a single QR factorization, tickers with missing days are solved
+# from masked normal equations built for all of them with one matrix product and a stacked solve
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+def solve_normal_equations(gram, moments):
+    # Solves a stack of normal equations gram[i] @ b[i] = moments[i] (n x k x k and n x k)
+    # Returns (coefficients, inverses, solvable), a singular or numerically collinear system is not solved (NaN coefficients)
+    gram = np.array(gram, dtype=float)
+    num_params = gram.shape[-1]
+    sign, logdet = np.linalg.slogdet(gram)
+    # Compare the determinant with the product of the diagonal so the check doesn't depend on the scale of the regressors
+    scale = np.log(np.maximum(np.abs(np.diagonal(gram, axis1=-2, axis2=-1)), np.finfo(float).tiny)).sum(axis=-1)
+    solvable = (sign > 0) & (logdet - scale > np.log(np.finfo(float).eps) * 2)
+    gram[~solvable] = np.eye(num_params)
+    inverse = np.linalg.inv(gram)
+    coefficients = np.einsum('nab,nb->na', inverse, moments)
+    coefficients[~solvable] = np.nan
+    inverse[~solvable] = np.nan
+    return coefficients, inverse, solvable
+
+def batch_ols(X, Y, add_constant=True) -> dict:
+    # Fits Y[ticker] = const + X @ b for every column of Y (dates x tickers) against the regressors X (dates x factors)
+    # Each ticker uses the dates where its value and every regressor are present, which is what
+    # OLS(y, add_constant(X)).fit() on the ticker's dropna'd data does, so the estimates match statsmodels
+    # Returns params, bse, tvalues and pvalues as (tickers x regressors) DataFrames and nobs / df_resid as Series,
+    # a ticker with no more observations than regressors (or collinear regressors on its dates) gets NaN estimates
+    Y = Y.reindex(X.index)
+    regressors = (['const'] if add_constant else []) + list(X.columns)
+    x = X.to_numpy(dtype=float)
+    if add_constant:
+        x = np.column_stack([np.ones(len(x)), x])
+    y = Y.to_numpy(dtype=float)
+    num_params = x.shape[1]
+    rows = ~np.isnan(x).any(axis=1)
+    valid = ~np.isnan(y) & rows[:, None]
+    nobs = valid.sum(axis=0)
+    params = np.full((y.shape[1], num_params), np.nan)
+    bse = np.full((y.shape[1], num_params), np.nan)
+    x = x[rows]
+    y = y[rows]
+    valid = valid[rows]
+    num_rows = len(x)
+
+    # Tickers with every date share one QR factorization of the design matrix
+    full = np.flatnonzero(valid.all(axis=0))
+    if len(full) and num_rows > num_params:
+        q, r = np.linalg.qr(x)
+        diagonal = np.abs(np.diag(r))
+        if diagonal.min() > np.finfo(float).eps * num_rows * diagonal.max():
+            coefficients = np.linalg.solve(r, q.T @ y[:, full])
+            residuals = y[:, full] - x @ coefficients
+            sigma2 = (residuals ** 2).sum(axis=0) / (num_rows - num_params)
+            # diag((X'X)^-1) = diag(R^-1 R^-T), the row sums of squares of R^-1
+            r_inverse = np.linalg.solve(r, np.eye(num_params))
+            params[full] = coefficients.T
+            bse[full] = np.sqrt(np.outer(sigma2, (r_inverse ** 2).sum(axis=1)))
+
+    # The others get X'MX and X'My with M masking out their missing days
+    partial = np.flatnonzero(~valid.all(axis=0) & (nobs > num_params))
+    if len(partial):
+        mask = valid[:, partial].astype(float)
+        y_masked = np.where(valid[:, partial], y[:, partial], 0.0)
+        gram = (mask.T @ (x[:, :, None] * x[:, None, :]).reshape(num_rows, -1)).reshape(len(partial), num_params, num_params)
+        moments = y_masked.T @ x
+        # Collinear regressors on a ticker's dates leave its Gram matrix singular, those tickers keep NaN estimates
+        coefficients, inverse, solvable = solve_normal_equations(gram, moments)
+        residuals = (y_masked - x @ coefficients.T) * mask
+        sigma2 = (residuals ** 2).sum(axis=0) / (nobs[partial] - num_params)
+        partial_bse = np.sqrt(sigma2[:, None] * np.diagonal(inverse, axis1=1, axis2=2))
+        params[partial[solvable]] = coefficients[solvable]
+        bse[partial[solvable]] = partial_bse[solvable]
+
+    df_resid = nobs - num_params
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tvalues = params / bse
+        pvalues = 2 * stats.t.sf(np.abs(tvalues), np.where(df_resid > 0, df_resid, np.nan)[:, None])
+    tickers = Y.columns
+    return {
+        'params': pd.DataFrame(params, index=tickers, columns=regressors),
+        'bse': pd.DataFrame(bse, index=tickers, columns=regressors),
+        'tvalues': pd.DataFrame(tvalues, index=tickers, columns=regressors),
+        'pvalues': pd.DataFrame(pvalues, index=tickers, columns=regressors),
+        'nobs': pd.Series(nobs, index=tickers),
+        'df_resid': pd.Series(df_resid, index=tickers),
+    }
+
+def regression_statistics(X, Y, add_constant=True) -> dict:
+    # Sufficient statistics of the regressions batch_ols would fit: X'X, X'y and y'y over each ticker's valid dates and their count
+    # They are additive over dates, so the statistics of a window can be updated by adding new days and subtracting expired ones
+    # Returns regressors, gram (tickers x k x k), moments (tickers x k), yy and nobs (tickers) as arrays in the order of Y's columns
+    Y = Y.reindex(X.index)
+    regressors = (['const'] if add_constant else []) + list(X.columns)
+    x = X.to_numpy(dtype=float)
+    if add_constant:
+        x = np.column_stack([np.ones(len(x)), x])
+    y = Y.to_numpy(dtype=float)
+    valid = ~np.isnan(y) & ~np.isnan(x).any(axis=1)[:, None]
+    x = np.where(valid.any(axis=1)[:, None], x, 0.0)
+    mask = valid.astype(float)
+    y = np.where(valid, y, 0.0)
+    num_params = x.shape[1]
+    return {
+        'regressors': regressors,
+        'gram': (mask.T @ (x[:, :, None] * x[:, None, :]).reshape(len(x), -1)).reshape(y.shape[1], num_params, num_params),
+        'moments': y.T @ x,
+        'yy': (y ** 2).sum(axis=0),
+        'nobs': valid.sum(axis=0),
+    }
+
+def ols_from_statistics(gram, moments, yy, nobs) -> dict:
+    # OLS estimates from stacked sufficient statistics (see regression_statistics), the residual sum of squares is y'y - b'X'y
+    # Returns params, bse, tvalues and pvalues as (n x k) arrays and df_resid, systems that can't be solved get NaN estimates
+    nobs = np.asarray(nobs)
+    num_params = gram.shape[-1]
+    df_resid = nobs - num_params
+    coefficients, inverse, solvable = solve_normal_equations(gram, moments)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma2 = np.maximum(yy - (coefficients * moments).sum(axis=1), 0.0) / np.where(df_resid > 0, df_resid, np.nan)
+        bse = np.sqrt(sigma2[:, None] * np.diagonal(inverse, axis1=1, axis2=2))
+        tvalues = coefficients / bse
+        pvalues = 2 * stats.t.sf(np.abs(tvalues), np.where(df_resid > 0, df_resid, np.nan)[:, None])
+    coefficients[df_resid <= 0] = np.nan
+    return {'params': coefficients, 'bse': bse, 'tvalues': tvalues, 'pvalues': pvalues, 'df_resid': df_resid}
+
+def masked_means(X, Y) -> pd.DataFrame:
+    # (tickers x regressors) means of each regressor over the dates each ticker's regression used
+    Y = Y.reindex(X.index)
+    valid = (Y.notna() & X.notna().all(axis=1).to_numpy()[:, None]).to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (valid.T @ X.fillna(0).to_numpy(dtype=float)) / valid.sum(axis=0)[:, None]
+    return pd.DataFrame(means, index=Y.columns, columns=X.columns)
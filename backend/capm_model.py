@@ -1,24 +1,54 @@
 # This file contains an implementation of the CAPM model, the Fama-French Three-Factor model, Carhart Four-Factor model, Fam-French Five-Factor model, and Fama-French Six-Factor model
 
 import os
+import hashlib
 import pandas as pd
-import yfinance as yf
-from fredapi import Fred
 import datetime
 import numpy as np
 from statsmodels.api import OLS, add_constant
-from db_interface import DBInterface
+from db_interface import DBInterface, parse_date
 from dateutil.relativedelta import relativedelta
+from characteristics import load_characteristics
+from batch_regression import batch_ols, masked_means, regression_statistics, ols_from_statistics
+from rolling_regression import rolling_betas, ewm_betas
+from factor_engine import (FACTORS, MOMENTUM_LOOKBACK_DAYS, VALUE_GROUPS, PROFITABILITY_GROUPS, INVESTMENT_GROUPS, form_sort_portfolios,
+                           smb_hml_factors, rmw_factor, cma_factor, momentum_factor)
+
+# Regressors of each multifactor model, in the order the models report their betas
+MODEL_FACTORS = {
+    'CAPM': ['Market_Excess'],
+    'Fama-French Three-Factor': ['Market_Excess', 'SMB', 'HML'],
+    'Carhart Four-Factor': ['Market_Excess', 'SMB', 'HML', 'MOM'],
+    'Fama-French Five-Factor': ['Market_Excess', 'SMB', 'HML', 'RMW', 'CMA'],
+    'Fama-French Six-Factor': ['Market_Excess', 'SMB', 'HML', 'RMW', 'CMA', 'MOM'],
+}
+
+# Stored factor returns may start or end this far inside a requested range (weekends, holidays, today's missing close)
+FACTOR_COVERAGE_SLACK = pd.Timedelta(days=7)
+# Prices loaded before a range of days so the return of its first day is measured from the previous close
+STATISTICS_LOOKBACK = pd.Timedelta(days=10)
+# FRED series of the risk-free rate (3-month Treasury bill, monthly, annual percent), stored in risk_free_rates
+RISK_FREE_SERIES = 'TB3MS'
+# The latest stored observation may be this far before a requested date, the monthly rate is published early the next month
+RISK_FREE_STALENESS = pd.Timedelta(days=75)
+# Only days at least this old are folded into the stored statistics: generate_factor_returns.py rewrites the last month of
+# factor returns every day and a month's risk-free rate is published early the next month, so younger days may still change
+# and are recomputed by every run instead
+STATISTICS_SETTLE_DAYS = pd.Timedelta(days=75)
+# Sufficient statistics that are added and subtracted when a model's window moves
+ADDITIVE_STATISTICS = ['gram', 'moments', 'yy', 'nobs', 'market_sum']
 
 class CAPMModel:
     def __init__(self, fred_api_key, db_interface: DBInterface):
         self.db_interface = db_interface
         self.fred_api_key = fred_api_key
-        self.fred = Fred(api_key=fred_api_key)
         # Initialize data storage
         self.asset_prices = None
         self.market_prices = None
+        self.market_price_cache = {}
         self.risk_free_rates = None
+        self.risk_free_calendars = {}
+        self.risk_free_warnings = set()
         self.asset_returns = None
         self.market_returns = None
         self.excess_returns_data = None
@@ -34,59 +64,112 @@ class CAPMModel:
         self.bm_ratios = None
         self.profitability = None
         self.investment = None
+        self.characteristics = {}
+        self.factor_returns = {}
+
+    def clear_cached_data(self):
+        # Drops the market prices, factor returns and risk-free rates loaded so far, e.g. after the stored series were updated
+        self.market_price_cache = {}
+        self.factor_returns = {}
+        self.risk_free_calendars = {}
+        self.risk_free_warnings = set()
 
     def fetch_financial_data(self, ticker, date, report_type='balance_sheet', period_type='q'):
         ticker = ticker.strip().upper()
-        financial_data = self.db_interface.query(ticker=ticker, period_type=period_type, report_type=report_type)
-        # Filter data up to the given date
-        time_format = '%Y-%m-%d'
-        financial_data = [item for item in financial_data if datetime.datetime.strptime(item['asOfDate'], time_format) <= date]
-        # drop rows where periodType == 'TTM'
-        financial_data = [item for item in financial_data if item['periodType'] != 'TTM']
+        # The latest non-TTM statement on or before the date, picked in SQL with one index probe
+        financial_data = self.db_interface.query(ticker=ticker, period_type=period_type, report_type=report_type,
+                                                 as_of_date=date, exclude_ttm=True, latest=1)
         if financial_data:
-            return financial_data[-1]  # Return the latest data before the date
+            return financial_data[-1]
         else:
             return None
     
+    def load_characteristics(self, dates):
+        # Computes size, B/M, profitability and investment for every ticker at each formation date in one pass
+        # and keeps a (ticker x characteristic) frame per date for the compute_* methods
+        dates = [pd.Timestamp(date).normalize() for date in dates]
+        missing = [date for date in dates if date not in self.characteristics]
+        if missing:
+            characteristics = load_characteristics(self.db_interface, missing, tickers=self.db_interface.all_tickers)
+            for date in missing:
+                if date in characteristics.index.get_level_values('date'):
+                    self.characteristics[date] = characteristics.xs(date, level='date')
+                else:
+                    self.characteristics[date] = characteristics.iloc[:0].droplevel('date')
+        return {date: self.characteristics[date] for date in dates}
+
+    def fetch_characteristics(self, date) -> pd.DataFrame:
+        date = pd.Timestamp(date).normalize()
+        return self.load_characteristics([date])[date]
+
     def fetch_asset_market_data(self, ticker, market_index, start_date, end_date):
             # if self.asset_prices is not None and self.market_prices is not None and self.start_date == start_date and self.end_date == end_date:
                 # Data already fetched
                 # return self.asset_prices, self.market_prices
             self.start_date = start_date
             self.end_date = end_date
-            y_market_index = yf.Ticker(market_index)
-            asset_prices = self.db_interface.query_stock_history(ticker=ticker, start_date=start_date, end_date=end_date)
-            market_prices = y_market_index.history(start=start_date, end=end_date)['Close']
-            # Make a Series of the asset prices using date and close price
-            asset_prices = pd.Series([float(item['close']) for item in asset_prices], index=[pd.to_datetime(item['date']) for item in asset_prices])
-            asset_prices.rename('Close', inplace=True)
-            # Make the data tz-naive
-            asset_prices.index = asset_prices.index.tz_localize(None)
-            market_prices.index = market_prices.index.tz_localize(None)
+            asset_prices = self.load_asset_prices(ticker, start_date, end_date)
+            market_prices = self.fetch_market_prices(market_index, start_date, end_date)
             self.asset_prices = asset_prices
             self.market_prices = market_prices
 
             return asset_prices, market_prices
 
-    def fetch_risk_free_rate(self, asset_prices, start_date, end_date):
-        if self.risk_free_rates is not None:
-            return self.risk_free_rates
-        # Fetch the TB3MS data
-        start_date = asset_prices.index.min()
-        end_date = asset_prices.index.max()
-        tb3ms = self.fred.get_series('TB3MS', observation_start=start_date, observation_end=end_date)
-        tb3ms = tb3ms.ffill()
-        # Reindex to match asset_prices dates
-        tb3ms = tb3ms.reindex(asset_prices.index, method='ffill')
+    def load_asset_prices(self, ticker, start_date, end_date) -> pd.Series:
+        # A ticker's tz-naive closes, start and end dates included, without storing them on the model
+        asset_prices = self.db_interface.query_stock_history_arrays(ticker=ticker, start_date=start_date, end_date=end_date)['close']
+        asset_prices.rename('Close', inplace=True)
+        # Make the data tz-naive
+        asset_prices.index = asset_prices.index.tz_localize(None)
+        return asset_prices
+
+    def fetch_market_prices(self, market_index, start_date, end_date) -> pd.Series:
+        # Index closes from the local price store, start and end dates included like the asset prices
+        # Every (index, window) is read once per model object, the models of thousands of tickers over the same window share it
+        # The caches are read into locals once, a model used by several threads may have them cleared in between
+        key = (market_index, parse_date(start_date), parse_date(end_date))
+        market_prices = self.market_price_cache.get(key)
+        if market_prices is None:
+            market_prices = self.db_interface.query_market_index(market_index, start_date=key[1], end_date=key[2]).rename('Close')
+            self.market_price_cache[key] = market_prices
+        return market_prices.copy()
+
+    def risk_free_calendar(self, series=RISK_FREE_SERIES) -> pd.Series:
+        # Daily decimal rates of a risk-free series on every calendar day from its first to its last observation, each day
+        # carrying the latest annual rate published for it, loaded once from the risk_free_rates table
+        calendar = self.risk_free_calendars.get(series)
+        if calendar is None:
+            calendar = self.to_risk_free_calendar(self.db_interface.query_risk_free_rates(series))
+            self.risk_free_calendars[series] = calendar
+        return calendar
+
+    def to_risk_free_calendar(self, observations) -> pd.Series:
+        if observations.empty:
+            return observations.astype(float)
         # Convert annual percentage rates to daily decimal rates
-        tb3ms_daily = tb3ms / 100 / 252
-        self.risk_free_rates = tb3ms_daily
-        return tb3ms_daily
+        return observations.sort_index().resample('D').ffill() / 100 / 252
+
+    def fetch_risk_free_rate(self, asset_prices, start_date, end_date):
+        # Daily risk-free rates on the dates of asset_prices, sliced from the series stored by scripts/update_risk_free_rates.py
+        risk_free_rates = self.risk_free_rates_on(asset_prices.index)
+        self.risk_free_rates = risk_free_rates
+        return risk_free_rates
+
+    def risk_free_rates_on(self, dates) -> pd.Series:
+        # fetch_risk_free_rate without storing the rates on the model
+        # Nothing is fetched from FRED here, dates the stored series doesn't cover are logged (once per model object) and
+        # dates after its last observation keep that rate
+        calendar = self.risk_free_calendar()
+        if len(dates) and (calendar.empty or dates.min() < calendar.index.min() or dates.max() - calendar.index.max() > RISK_FREE_STALENESS):
+            last_date = calendar.index.max().date() if not calendar.empty else None
+            if last_date not in self.risk_free_warnings:
+                self.risk_free_warnings.add(last_date)
+                print(f"Warning: stored {RISK_FREE_SERIES} rates (last observation {last_date}) don't cover {dates.min().date()} to "
+                      f"{dates.max().date()}, run scripts/update_risk_free_rates.py")
+        return calendar.reindex(dates, method='ffill') if not calendar.empty else pd.Series(np.nan, index=dates)
 
     def calculate_excess_returns(self, asset_prices, market_prices, risk_free_rates):
         # This function calculates excess returns for the asset and market
-        if self.excess_returns_data is not None:
-            return self.excess_returns_data
         asset_returns = asset_prices.pct_change(fill_method=None).dropna()
         market_returns = market_prices.pct_change(fill_method=None).dropna()
         # Align dates
@@ -112,31 +195,17 @@ class CAPMModel:
         # This function computes market capitalization and B/M (book to market) ratio for all tickers
         if self.market_caps is not None and self.bm_ratios is not None:
             return self.market_caps, self.bm_ratios
-        self.market_caps = {}
-        self.bm_ratios = {}
-        for ticker in self.db_interface.all_tickers:
-            financial_data = self.fetch_financial_data(ticker, date)
-            if financial_data is None:
-                continue
-            shares_outstanding = float(financial_data.get('ShareIssued'))
-            total_equity = float(financial_data.get('StockholdersEquity'))
-            if shares_outstanding is None or total_equity is None:
-                continue
-            # Get stock price as of date
-            try:
-                price_data = self.db_interface.query_stock_history(ticker=ticker, end_date=date)
-                stock_price = float(price_data[-1]['close'])
-            except Exception:
-                continue
-            if stock_price is None or shares_outstanding == 0:
-                continue # Skip if no price or shares outstanding
-            # Calculate market cap and B/M ratio
-            market_cap = shares_outstanding * stock_price
-            book_value_per_share = total_equity / shares_outstanding
-            bm_ratio = book_value_per_share / stock_price
-            self.market_caps[ticker] = market_cap
-            self.bm_ratios[ticker] = bm_ratio
+        characteristics = self.fetch_characteristics(date)
+        # Tickers without shares outstanding, equity or a price are left out
+        self.market_caps = self.to_ticker_dict(characteristics['market_cap'])
+        self.bm_ratios = self.to_ticker_dict(characteristics['bm_ratio'])
         return self.market_caps, self.bm_ratios
+
+    def to_ticker_dict(self, values: pd.Series) -> dict:
+        # Characteristics are handed to the portfolio sorts as {ticker: value} in all_tickers order, without missing values
+        values = values.dropna()
+        values = values.reindex([ticker for ticker in self.db_interface.all_tickers if ticker in values.index])
+        return {ticker: float(value) for ticker, value in values.items()}
     
     def compute_momentum_factor(self, start_date, end_date):
         # This function computes the momentum factor by calculating prior 11-month returns and forming Winner and Loser portfolios
@@ -145,100 +214,27 @@ class CAPMModel:
         if self.momentum is not None:
             return self.momentum
         # Determine the date range needed for momentum calculation
-        momentum_start_date = start_date - datetime.timedelta(days=365)
+        momentum_start_date = start_date - datetime.timedelta(days=MOMENTUM_LOOKBACK_DAYS)
         if self.all_prices is None:
             print("Fetching historical prices for all tickers for momentum calculation...")
             tickers = self.db_interface.all_tickers
             # self.all_prices = yf.download(tickers, start=momentum_start_date, end=end_date)['Close']
-            self.all_prices = self.db_interface.query_batch_stock_history(tickers, start_date=momentum_start_date, end_date=end_date)['close']
+            # Bulk binary export of the whole universe's closes
+            self.all_prices = self.db_interface.export_price_panel(tickers, start_date=momentum_start_date, end_date=end_date, field='close')
             # Make the data tz-naive
             self.all_prices.index = self.all_prices.index.tz_localize(None)
-        # Calculate prior returns for each stock at each month end
-        month_ends = pd.date_range(start=start_date, end=end_date, freq='ME')
-        momentum_returns = []
-        for formation_date in month_ends:
-            # Check if we have enough data
-            if formation_date - pd.DateOffset(months=12) < self.all_prices.index.min():
-                continue
-            # Calculate prior 11-month returns (t-12 to t-1)
-            start_period = (formation_date - pd.DateOffset(months=12)).strftime('%Y-%m-%d')
-            end_period = (formation_date - pd.DateOffset(months=1)).strftime('%Y-%m-%d')
-            prior_prices = self.all_prices.loc[start_period:end_period]
-            if prior_prices.empty:
-                continue
-            prior_returns = (prior_prices.iloc[-1] / prior_prices.iloc[0] - 1).dropna()
-            # Rank stocks based on prior returns
-            num_stocks = len(prior_returns)
-            if num_stocks < 10:
-                continue
-            top_cutoff = prior_returns.quantile(0.7)
-            bottom_cutoff = prior_returns.quantile(0.3)
-            winners = prior_returns[prior_returns >= top_cutoff].index.tolist()
-            losers = prior_returns[prior_returns <= bottom_cutoff].index.tolist()
-            # Calculate returns of Winner and Loser portfolios over next month
-            start_next_month = formation_date.strftime('%Y-%m-%d')
-            end_next_month = (formation_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)).strftime('%Y-%m-%d')  # Adjust end date
-            winner_prices = self.all_prices.loc[start_next_month:end_next_month, winners]
-            loser_prices = self.all_prices.loc[start_next_month:end_next_month, losers]
-            if winner_prices.empty or loser_prices.empty:
-                continue
-            # Calculate portfolio returns
-            winner_returns = winner_prices.pct_change(fill_method=None).mean(axis=1)
-            loser_returns = loser_prices.pct_change(fill_method=None).mean(axis=1)
-            # Calculate momentum factor as difference
-            mom_returns = winner_returns - loser_returns
-            momentum_returns.append(mom_returns)
-        if momentum_returns:
-            # Concatenate momentum returns
-            momentum = pd.concat(momentum_returns)
-            # Handle duplicate indices by averaging
-            momentum = momentum.groupby(momentum.index).mean()
-            self.momentum = momentum
-            return momentum
-        else:
+        momentum = momentum_factor(self.all_prices, start_date, end_date)
+        if momentum is None:
             print("Unable to compute momentum factor due to insufficient data.")
-            self.momentum = None
-            return None
+        self.momentum = momentum
+        return momentum
     
     def compute_profitability(self, date):
         # This function computes operating profitability for all tickers
         if self.profitability is not None:
             return self.profitability
-        self.profitability = {}
-        for ticker in self.db_interface.all_tickers:
-            income_statement = self.fetch_financial_data(ticker, date, report_type='income')
-            balance_sheet = self.fetch_financial_data(ticker, date, report_type='balance_sheet')
-
-            if income_statement is None or balance_sheet is None:
-                continue
-            
-            # Safely extract and convert financial data
-            def get_float(value):
-                try:
-                    return float(value)
-                except (TypeError, ValueError):
-                    return np.nan
-            
-            revenue = get_float(income_statement.get('TotalRevenue'))
-            cogs = get_float(income_statement.get('CostOfRevenue'))
-            sga = get_float(income_statement.get('SellingGeneralAndAdministration'))
-            total_equity = get_float(balance_sheet.get('StockholdersEquity'))
-            
-            # Handle InterestExpense: if None or NaN, set to zero
-            interest_expense = income_statement.get('InterestExpense')
-            if interest_expense is None or pd.isna(interest_expense):
-                interest_expense = 0.0
-            else:
-                interest_expense = get_float(interest_expense)
-
-            # Check for missing or invalid values
-            if np.isnan(revenue) or np.isnan(cogs) or np.isnan(sga) or np.isnan(interest_expense) or np.isnan(total_equity) or total_equity == 0:
-                continue  # Skip if any required value is missing or invalid
-
-            # Calculate operating profit and profitability
-            operating_profit = revenue - cogs - sga - interest_expense
-            profitability = operating_profit / total_equity
-            self.profitability[ticker] = profitability
+        # Tickers with a missing line item (InterestExpense counts as zero) or zero equity are left out
+        self.profitability = self.to_ticker_dict(self.fetch_characteristics(date)['profitability'])
         print(f"Total tickers with profitability data: {len(self.profitability)}")
         return self.profitability
 
@@ -246,102 +242,21 @@ class CAPMModel:
         # This function computes investment (asset growth) for all tickers
         if self.investment is not None:
             return self.investment
-        self.investment = {}
-        for ticker in self.db_interface.all_tickers:
-            balance_sheet_current = self.fetch_financial_data(ticker, date, report_type='balance_sheet')
-            balance_sheet_prior = self.fetch_financial_data(ticker, date - relativedelta(years=1), report_type='balance_sheet')
-            if balance_sheet_current is None or balance_sheet_prior is None:
-                continue
-            total_assets_current = float(balance_sheet_current.get('TotalAssets', np.nan))
-            total_assets_prior = float(balance_sheet_prior.get('TotalAssets', np.nan))
-            if np.isnan(total_assets_current) or np.isnan(total_assets_prior) or total_assets_prior == 0:
-                continue
-            investment = (total_assets_current - total_assets_prior) / total_assets_prior
-            self.investment[ticker] = investment
+        # Asset growth over the year, tickers without total assets at either date are left out
+        self.investment = self.to_ticker_dict(self.fetch_characteristics(date)['investment'])
         return self.investment
 
     def form_portfolios(self, market_caps, bm_ratios):
-        df = pd.DataFrame({
-            'Ticker': list(market_caps.keys()),
-            'Market_Cap': list(market_caps.values()),
-            'BM_Ratio': [bm_ratios[ticker] for ticker in market_caps.keys()]
-        })
-        # Remove missing values
-        df.dropna(inplace=True)
-        # Size breakpoints
-        size_median = df['Market_Cap'].median()
-        # Value breakpoints
-        bm30 = df['BM_Ratio'].quantile(0.3)
-        bm70 = df['BM_Ratio'].quantile(0.7)
-        # Assign Size
-        df['Size'] = np.where(df['Market_Cap'] <= size_median, 'Small', 'Big')
-        # Assign Value
-        conditions = [
-            (df['BM_Ratio'] <= bm30),
-            (df['BM_Ratio'] > bm30) & (df['BM_Ratio'] <= bm70),
-            (df['BM_Ratio'] > bm70)
-        ]
-        choices = ['Low', 'Medium', 'High']
-        df['Value'] = np.select(conditions, choices, default='Unknown')
-        # Create portfolio labels
-        df['Portfolio'] = df['Size'] + '/' + df['Value']
-        return df
+        return form_sort_portfolios(market_caps, bm_ratios, 'BM_Ratio', 'Value', VALUE_GROUPS)
 
     def form_profitability_portfolios(self, market_caps, profitability):
-        df = pd.DataFrame({
-            'Ticker': list(market_caps.keys()),
-            'Market_Cap': list(market_caps.values()),
-            'Profitability': [profitability.get(ticker, np.nan) for ticker in market_caps.keys()]
-        })
-        df.dropna(inplace=True)
-        # Size breakpoints
-        size_median = df['Market_Cap'].median()
-        # Profitability breakpoints
-        prof30 = df['Profitability'].quantile(0.3)
-        prof70 = df['Profitability'].quantile(0.7)
-        # Assign Size
-        df['Size'] = np.where(df['Market_Cap'] <= size_median, 'Small', 'Big')
-        # Assign Profitability
-        conditions = [
-            (df['Profitability'] <= prof30),
-            (df['Profitability'] > prof30) & (df['Profitability'] <= prof70),
-            (df['Profitability'] > prof70)
-        ]
-        choices = ['Weak', 'Neutral', 'Robust']
-        df['Profitability_Group'] = np.select(conditions, choices, default='Unknown')
-        # Create portfolio labels
-        df['Portfolio'] = df['Size'] + '/' + df['Profitability_Group']
-
+        df = form_sort_portfolios(market_caps, profitability, 'Profitability', 'Profitability_Group', PROFITABILITY_GROUPS)
         # Print portfolio counts
         print("\nProfitability Portfolios Formed:")
-    
         return df
 
     def form_investment_portfolios(self, market_caps, investment):
-        df = pd.DataFrame({
-            'Ticker': list(market_caps.keys()),
-            'Market_Cap': list(market_caps.values()),
-            'Investment': [investment.get(ticker, np.nan) for ticker in market_caps.keys()]
-        })
-        df.dropna(inplace=True)
-        # Size breakpoints
-        size_median = df['Market_Cap'].median()
-        # Investment breakpoints
-        inv30 = df['Investment'].quantile(0.3)
-        inv70 = df['Investment'].quantile(0.7)
-        # Assign Size
-        df['Size'] = np.where(df['Market_Cap'] <= size_median, 'Small', 'Big')
-        # Assign Investment
-        conditions = [
-            (df['Investment'] <= inv30),
-            (df['Investment'] > inv30) & (df['Investment'] <= inv70),
-            (df['Investment'] > inv70)
-        ]
-        choices = ['Conservative', 'Neutral', 'Aggressive']
-        df['Investment_Group'] = np.select(conditions, choices, default='Unknown')
-        # Create portfolio labels
-        df['Portfolio'] = df['Size'] + '/' + df['Investment_Group']
-        return df
+        return form_sort_portfolios(market_caps, investment, 'Investment', 'Investment_Group', INVESTMENT_GROUPS)
     
     def calculate_portfolio_returns(self, portfolios, start_date, end_date):
         # Map portfolios to tickers
@@ -351,7 +266,7 @@ class CAPMModel:
         for portfolio, tickers in portfolio_groups.items():
             try:
                 # Fetch adjusted close prices for tickers
-                prices = self.db_interface.query_batch_stock_history(tickers, start_date=start_date, end_date=end_date)['close']
+                prices = self.db_interface.query_price_panel(tickers, start_date=start_date, end_date=end_date, field='close')
                 # Make the data tz-naive
                 prices.index = prices.index.tz_localize(None)
                 # Handle single ticker case
@@ -371,37 +286,29 @@ class CAPMModel:
         # This function computes the SMB (small minus big) and HML (High [B/M] minus low [B/M]) factors
         # HML is a measure of value, while SMB is a measure of size
         # This is done by forming portfolios based on size and value, and calculating the returns of these portfolios
-        # SMB calculation
-        small_ports = ['Small/Low', 'Small/Medium', 'Small/High']
-        big_ports = ['Big/Low', 'Big/Medium', 'Big/High']
-        small_returns = pd.concat([portfolio_returns[port] for port in small_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        big_returns = pd.concat([portfolio_returns[port] for port in big_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        smb = small_returns - big_returns
-        # HML calculation
-        value_ports = ['Small/High', 'Big/High']
-        growth_ports = ['Small/Low', 'Big/Low']
-        value_returns = pd.concat([portfolio_returns[port] for port in value_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        growth_returns = pd.concat([portfolio_returns[port] for port in growth_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        hml = value_returns - growth_returns
-        return smb, hml
+        return smb_hml_factors(portfolio_returns)
     
     def compute_rmw(self, portfolio_returns):
         # Compute RMW (Robust Minus Weak) factor
-        robust_ports = ['Small/Robust', 'Big/Robust']
-        weak_ports = ['Small/Weak', 'Big/Weak']
-        robust_returns = pd.concat([portfolio_returns[port] for port in robust_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        weak_returns = pd.concat([portfolio_returns[port] for port in weak_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        rmw = robust_returns - weak_returns
-        return rmw
+        return rmw_factor(portfolio_returns)
 
     def compute_cma(self, portfolio_returns):
         # Compute CMA (Conservative Minus Aggressive) factor
-        conservative_ports = ['Small/Conservative', 'Big/Conservative']
-        aggressive_ports = ['Small/Aggressive', 'Big/Aggressive']
-        conservative_returns = pd.concat([portfolio_returns[port] for port in conservative_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        aggressive_returns = pd.concat([portfolio_returns[port] for port in aggressive_ports if port in portfolio_returns], axis=1).mean(axis=1)
-        cma = conservative_returns - aggressive_returns
-        return cma
+        return cma_factor(portfolio_returns)
+
+    def fetch_factor_returns(self, start_date, end_date) -> pd.DataFrame:
+        # (date x factor) universe factor returns stored by scripts/generate_factor_returns.py, loaded once per date range
+        # Computing them takes minutes for the whole universe, so a range the stored series doesn't cover raises instead
+        key = (pd.Timestamp(start_date).normalize(), pd.Timestamp(end_date).normalize())
+        factor_returns = self.factor_returns.get(key)
+        if factor_returns is None:
+            factor_returns = self.db_interface.query_factor_returns(start_date=start_date, end_date=end_date, factors=FACTORS)
+            stored = factor_returns.dropna(how='all').index
+            if stored.empty or stored.min() - key[0] > FACTOR_COVERAGE_SLACK or key[1] - stored.max() > FACTOR_COVERAGE_SLACK:
+                raise ValueError(f"Stored factor returns don't cover {key[0].date()} to {key[1].date()}, "
+                                 "run scripts/generate_factor_returns.py for the range")
+            self.factor_returns[key] = factor_returns
+        return factor_returns
     
     def calculate_regression(self, data, factors=['Market_Excess', 'SMB', 'HML']):
         y = data['Asset_Excess']
@@ -421,6 +328,31 @@ class CAPMModel:
                 expected_return += betas[factor] * factor_means[factor]
         return expected_return
 
+    def factor_model_results(self, ticker, model_name, data, risk_free_rate_latest, market_index, start_date, end_date) -> dict:
+        # Regression of a ticker's excess returns on the model's factors and the results dict of the per-ticker models
+        # data holds the aligned Asset_Excess, Market and factor returns without missing values, risk_free_rate_latest is the
+        # rate of the ticker's last price in the window. Shared with the worker processes of parallel_models.py
+        factors = MODEL_FACTORS[model_name]
+        # Perform regression
+        model = self.calculate_regression(data, factors=factors)
+        betas = model.params
+        # Calculate expected return
+        factor_means = data[factors].mean()
+        expected_return = self.calculate_expected_return(risk_free_rate_latest, betas, factor_means)
+        return {
+            'ticker': ticker,
+            'model_name': model_name,
+            'start_date': start_date,
+            'end_date': end_date,
+            'betas': betas,
+            'expected_return': float(expected_return),
+            'risk_free_rate': float(risk_free_rate_latest),
+            'market_index': market_index,
+            'average_market_return': float(data['Market'].mean()),
+            'factor_means': factor_means,
+            'p_values': model.pvalues
+        }
+
     def capm_model(self, ticker, market_index, start_date, end_date):
         # Fetch data
         asset_prices, market_prices = self.fetch_asset_market_data(ticker, market_index, start_date, end_date)
@@ -457,46 +389,20 @@ class CAPMModel:
         market_returns = market_prices.pct_change(fill_method=None)
         # Fetch risk-free rate
         risk_free_rates = self.fetch_risk_free_rate(asset_prices, start_date, end_date)
-        # Compute market caps and B/M ratios at the formation date
-        formation_date = datetime.datetime(start_date.year, 6, 30)
-        market_caps, bm_ratios = self.compute_market_cap_bm(formation_date)
-        # Form portfolios
-        portfolios = self.form_portfolios(market_caps, bm_ratios)
-        # Calculate portfolio returns
-        portfolio_returns = self.calculate_portfolio_returns(portfolios, start_date, end_date)
-        # Compute SMB and HML factors
-        smb, hml = self.compute_smb_hml(portfolio_returns)
+        # Load the universe factor returns
+        factor_returns = self.fetch_factor_returns(start_date, end_date)
         # Align data
         data = pd.DataFrame({
             'Asset': asset_returns,
             'Market': market_returns,
             'Risk_Free': risk_free_rates,
-            'SMB': smb,
-            'HML': hml
+            'SMB': factor_returns['SMB'],
+            'HML': factor_returns['HML']
         })
         data['Asset_Excess'] = data['Asset'] - data['Risk_Free']
         data['Market_Excess'] = data['Market'] - data['Risk_Free']
         data.dropna(inplace=True)
-        # Perform regression
-        model = self.calculate_regression(data)
-        betas = model.params
-        # Calculate expected return
-        factor_means = data[['Market_Excess', 'SMB', 'HML']].mean()
-        expected_return = risk_free_rates.iloc[-1] + betas['Market_Excess'] * factor_means['Market_Excess'] + \
-                          betas['SMB'] * factor_means['SMB'] + betas['HML'] * factor_means['HML']
-        return {
-            'ticker': ticker,
-            'model_name': 'Fama-French Three-Factor',
-            'start_date': start_date,
-            'end_date': end_date,
-            'betas': betas,
-            'expected_return': float(expected_return),
-            'risk_free_rate': float(risk_free_rates.iloc[-1]),
-            'market_index': market_index,
-            'average_market_return': float(data['Market'].mean()),
-            'factor_means': factor_means,
-            'p_values': model.pvalues
-        }
+        return self.factor_model_results(ticker, 'Fama-French Three-Factor', data, risk_free_rates.iloc[-1], market_index, start_date, end_date)
     
     def four_factor_model(self, ticker, market_index, start_date, end_date):
         # Fetch asset and market data
@@ -505,25 +411,9 @@ class CAPMModel:
         market_returns = market_prices.pct_change(fill_method=None)
         # Fetch risk-free rate
         risk_free_rates = self.fetch_risk_free_rate(asset_prices, start_date, end_date)
-        # Compute SMB and HML if not already computed
-        if self.smb is None or self.hml is None:
-            # Compute market caps and B/M ratios at the formation date
-            formation_date = datetime.datetime(start_date.year, 6, 30)
-            market_caps, bm_ratios = self.compute_market_cap_bm(formation_date)
-            # Form portfolios
-            portfolios = self.form_portfolios(market_caps, bm_ratios)
-            # Calculate portfolio returns
-            portfolio_returns = self.calculate_portfolio_returns(portfolios, start_date, end_date)
-            # Compute SMB and HML factors
-            smb, hml = self.compute_smb_hml(portfolio_returns)
-            self.smb = smb
-            self.hml = hml
-        else:
-            smb = self.smb
-            hml = self.hml
-        # Compute momentum factor
-        momentum = self.compute_momentum_factor(start_date, end_date)
-        if momentum is None:
+        # Load the universe factor returns
+        factor_returns = self.fetch_factor_returns(start_date, end_date)
+        if factor_returns['MOM'].isna().all():
             print("Momentum factor could not be computed.")
             return None
         # Align data
@@ -531,9 +421,9 @@ class CAPMModel:
             'Asset': asset_returns,
             'Market': market_returns,
             'Risk_Free': risk_free_rates,
-            'SMB': smb,
-            'HML': hml,
-            'MOM': momentum
+            'SMB': factor_returns['SMB'],
+            'HML': factor_returns['HML'],
+            'MOM': factor_returns['MOM']
         })
         data['Asset_Excess'] = data['Asset'] - data['Risk_Free']
         data['Market_Excess'] = data['Market'] - data['Risk_Free']
@@ -541,32 +431,7 @@ class CAPMModel:
         if data.empty:
             print("No data available after aligning for regression.")
             return None
-        # Perform regression
-        y = data['Asset_Excess']
-        X = data[['Market_Excess', 'SMB', 'HML', 'MOM']]
-        X = add_constant(X)
-        model = OLS(y, X).fit()
-        betas = model.params
-        # Calculate expected return
-        factor_means = data[['Market_Excess', 'SMB', 'HML', 'MOM']].mean()
-        expected_return = risk_free_rates.iloc[-1] + \
-                          betas['Market_Excess'] * factor_means['Market_Excess'] + \
-                          betas['SMB'] * factor_means['SMB'] + \
-                          betas['HML'] * factor_means['HML'] + \
-                          betas['MOM'] * factor_means['MOM']
-        return {
-            'ticker': ticker,
-            'model_name': 'Carhart Four-Factor',
-            'start_date': start_date,
-            'end_date': end_date,
-            'betas': betas,
-            'expected_return': float(expected_return),
-            'risk_free_rate': float(risk_free_rates.iloc[-1]),
-            'market_index': market_index,
-            'average_market_return': float(data['Market'].mean()),
-            'factor_means': factor_means,
-            'p_values': model.pvalues
-        }
+        return self.factor_model_results(ticker, 'Carhart Four-Factor', data, risk_free_rates.iloc[-1], market_index, start_date, end_date)
     
     def five_factor_model(self, ticker, market_index, start_date, end_date):
         # Fetch asset and market data
@@ -575,103 +440,33 @@ class CAPMModel:
         market_returns = market_prices.pct_change(fill_method=None)
         # Fetch risk-free rate
         risk_free_rates = self.fetch_risk_free_rate(asset_prices, start_date, end_date)
-        # Compute market caps, B/M ratios, profitability, and investment at the formation date
-        formation_date = datetime.datetime(start_date.year, 6, 30)
-        market_caps, bm_ratios = self.compute_market_cap_bm(formation_date)
-        profitability = self.compute_profitability(formation_date)
-        investment = self.compute_investment(formation_date)
-        # Form portfolios
-        portfolios_sv = self.form_portfolios(market_caps, bm_ratios)
-        portfolios_sp = self.form_profitability_portfolios(market_caps, profitability)
-        portfolios_si = self.form_investment_portfolios(market_caps, investment)
-        # Merge portfolios
-        portfolios_all = pd.concat([portfolios_sv, portfolios_sp, portfolios_si])
-        # Calculate portfolio returns
-        portfolio_returns = self.calculate_portfolio_returns(portfolios_all, start_date, end_date)
-        # Compute SMB and HML factors
-        smb, hml = self.compute_smb_hml(portfolio_returns)
-        self.smb = smb
-        self.hml = hml
-        # Compute RMW and CMA factors
-        rmw = self.compute_rmw(portfolio_returns)
-        cma = self.compute_cma(portfolio_returns)
-        self.rmw = rmw
-        self.cma = cma
+        # Load the universe factor returns
+        factor_returns = self.fetch_factor_returns(start_date, end_date)
         # Align data
         data = pd.DataFrame({
             'Asset': asset_returns,
             'Market': market_returns,
             'Risk_Free': risk_free_rates,
-            'SMB': smb,
-            'HML': hml,
-            'RMW': rmw,
-            'CMA': cma
+            'SMB': factor_returns['SMB'],
+            'HML': factor_returns['HML'],
+            'RMW': factor_returns['RMW'],
+            'CMA': factor_returns['CMA']
         })
         data['Asset_Excess'] = data['Asset'] - data['Risk_Free']
         data['Market_Excess'] = data['Market'] - data['Risk_Free']
         data.dropna(inplace=True)
-        # Perform regression
-        model = self.calculate_regression(data, factors=['Market_Excess', 'SMB', 'HML', 'RMW', 'CMA'])
-        betas = model.params
-        # Calculate expected return
-        factor_means = data[['Market_Excess', 'SMB', 'HML', 'RMW', 'CMA']].mean()
-        expected_return = self.calculate_expected_return(risk_free_rates.iloc[-1], betas, factor_means)
-        return {
-            'ticker': ticker,
-            'model_name': 'Fama-French Five-Factor',
-            'start_date': start_date,
-            'end_date': end_date,
-            'betas': betas,
-            'expected_return': float(expected_return),
-            'risk_free_rate': float(risk_free_rates.iloc[-1]),
-            'market_index': market_index,
-            'average_market_return': float(data['Market'].mean()),
-            'factor_means': factor_means,
-            'p_values': model.pvalues
-        }
+        return self.factor_model_results(ticker, 'Fama-French Five-Factor', data, risk_free_rates.iloc[-1], market_index, start_date, end_date)
 
     def six_factor_model(self, ticker, market_index, start_date, end_date):
-        # Currently this function raises an exception if the 5-factor model has not run first
-        # TODO fix that
-
         # Fetch asset and market data
         asset_prices, market_prices = self.fetch_asset_market_data(ticker, market_index, start_date, end_date)
         asset_returns = asset_prices.pct_change(fill_method=None)
         market_returns = market_prices.pct_change(fill_method=None)
         # Fetch risk-free rate
         risk_free_rates = self.fetch_risk_free_rate(asset_prices, start_date, end_date)
-        # Compute factors if not already computed
-        if self.smb is None or self.hml is None or self.rmw is None or self.cma is None:
-            # Compute market caps, B/M ratios, profitability, and investment at the formation date
-            formation_date = datetime.datetime(start_date.year, 6, 30)
-            market_caps, bm_ratios = self.compute_market_cap_bm(formation_date)
-            profitability = self.compute_profitability(formation_date)
-            investment = self.compute_investment(formation_date)
-            # Form portfolios
-            portfolios_sv = self.form_portfolios(market_caps, bm_ratios)
-            portfolios_sp = self.form_profitability_portfolios(market_caps, profitability)
-            portfolios_si = self.form_investment_portfolios(market_caps, investment)
-            # Merge portfolios
-            portfolios_all = pd.concat([portfolios_sv, portfolios_sp, portfolios_si]).drop_duplicates(subset='Ticker')
-            # Calculate portfolio returns
-            portfolio_returns = self.calculate_portfolio_returns(portfolios_all, start_date, end_date)
-            # Compute SMB and HML factors
-            smb, hml = self.compute_smb_hml(portfolio_returns)
-            self.smb = smb
-            self.hml = hml
-            # Compute RMW and CMA factors
-            rmw = self.compute_rmw(portfolio_returns)
-            cma = self.compute_cma(portfolio_returns)
-            self.rmw = rmw
-            self.cma = cma
-        else:
-            smb = self.smb
-            hml = self.hml
-            rmw = self.rmw
-            cma = self.cma
-        # Compute momentum factor
-        momentum = self.compute_momentum_factor(start_date, end_date)
-        if momentum is None:
+        # Load the universe factor returns
+        factor_returns = self.fetch_factor_returns(start_date, end_date)
+        if factor_returns['MOM'].isna().all():
             print("Momentum factor could not be computed.")
             return None
         # Align data
@@ -679,11 +474,11 @@ class CAPMModel:
             'Asset': asset_returns,
             'Market': market_returns,
             'Risk_Free': risk_free_rates,
-            'SMB': smb,
-            'HML': hml,
-            'RMW': rmw,
-            'CMA': cma,
-            'MOM': momentum
+            'SMB': factor_returns['SMB'],
+            'HML': factor_returns['HML'],
+            'RMW': factor_returns['RMW'],
+            'CMA': factor_returns['CMA'],
+            'MOM': factor_returns['MOM']
         })
         data['Asset_Excess'] = data['Asset'] - data['Risk_Free']
         data['Market_Excess'] = data['Market'] - data['Risk_Free']
@@ -691,26 +486,215 @@ class CAPMModel:
         if data.empty:
             print("No data available after aligning for regression.")
             return None
-        # Perform regression
-        model = self.calculate_regression(data, factors=['Market_Excess', 'SMB', 'HML', 'RMW', 'CMA', 'MOM'])
-        betas = model.params
-        # Calculate expected return
-        factor_means = data[['Market_Excess', 'SMB', 'HML', 'RMW', 'CMA', 'MOM']].mean()
-        expected_return = self.calculate_expected_return(risk_free_rates.iloc[-1], betas, factor_means)
-        return {
-            'ticker': ticker,
-            'model_name': 'Fama-French Six-Factor',
-            'start_date': start_date,
-            'end_date': end_date,
-            'betas': betas,
-            'expected_return': float(expected_return),
-            'risk_free_rate': float(risk_free_rates.iloc[-1]),
-            'market_index': market_index,
-            'average_market_return': float(data['Market'].mean()),
-            'factor_means': factor_means,
-            'p_values': model.pvalues
-        }
+        return self.factor_model_results(ticker, 'Fama-French Six-Factor', data, risk_free_rates.iloc[-1], market_index, start_date, end_date)
     
+    def multifactor_inputs(self, tickers, market_index, start_date, end_date, factors, dropna=True):
+        # Aligned regression inputs of the batched models: the market, risk-free and factor returns on the dates where all of
+        # them are available, and the (dates x tickers) excess returns of the tickers on those dates
+        # With dropna=False the dates missing some factors are kept (only the market and risk-free rate are required)
+        # Returns (data, asset_excess, risk_free_rates)
+        prices = self.db_interface.export_price_panel(tickers, start_date=start_date, end_date=end_date, field='close')
+        # Each ticker's return is measured from its own previous close, like pct_change on its own price series
+        asset_returns = prices.ffill().pct_change(fill_method=None).where(prices.notna())
+        market_returns = self.fetch_market_prices(market_index, start_date, end_date).pct_change(fill_method=None)
+        risk_free_rates = self.fetch_risk_free_rate(prices, start_date, end_date)
+        factor_returns = self.fetch_factor_returns(start_date, end_date)
+        # Align data
+        data = pd.DataFrame({
+            'Market': market_returns,
+            'Risk_Free': risk_free_rates,
+        }).join(factor_returns[[factor for factor in factors if factor != 'Market_Excess']], how='outer')
+        data['Market_Excess'] = data['Market'] - data['Risk_Free']
+        data = data.dropna() if dropna else data.dropna(subset=['Market_Excess'])
+        asset_excess = asset_returns.reindex(data.index).sub(data['Risk_Free'], axis=0)
+        return data, asset_excess, risk_free_rates
+
+    def multifactor_models(self, tickers, market_index, start_date, end_date, model_name='Fama-French Five-Factor') -> dict:
+        # Batched version of the per-ticker factor models: every ticker is regressed on the model's factors in one
+        # batch_ols call instead of one OLS fit each, the prices of all tickers come from one bulk export
+        # Returns {ticker: results} with the same results dicts as three/four/five/six_factor_model (ready for
+        # push_multifactor_model_summary), tickers without enough data for the regression are left out
+        factors = MODEL_FACTORS[model_name]
+        tickers = list(tickers)
+        data, asset_excess, risk_free_rates = self.multifactor_inputs(tickers, market_index, start_date, end_date, factors)
+        # Perform the regressions
+        fit = batch_ols(data[factors], asset_excess)
+        means = masked_means(data[factors + ['Market']], asset_excess)
+        risk_free_rate_latest = risk_free_rates.iloc[-1]
+        results = {}
+        for ticker in tickers:
+            betas = fit['params'].loc[ticker].rename(None)
+            if fit['df_resid'][ticker] <= 0 or betas.isna().any():
+                continue
+            factor_means = means.loc[ticker, factors].rename(None)
+            expected_return = self.calculate_expected_return(risk_free_rate_latest, betas, factor_means)
+            results[ticker] = {
+                'ticker': ticker,
+                'model_name': model_name,
+                'start_date': start_date,
+                'end_date': end_date,
+                'betas': betas,
+                'expected_return': float(expected_return),
+                'risk_free_rate': float(risk_free_rate_latest),
+                'market_index': market_index,
+                'average_market_return': float(means.loc[ticker, 'Market']),
+                'factor_means': factor_means,
+                'p_values': fit['pvalues'].loc[ticker].rename(None)
+            }
+        return results
+
+    def rolling_betas(self, ticker, market_index, start_date, end_date, model_name='CAPM', window=252, halflife=None) -> pd.DataFrame:
+        # Time series of a ticker's betas on the model's factors (MODEL_FACTORS) between start_date and end_date
+        # Each date's betas come from the trailing `window` trading days, or from all the days before it exponentially
+        # weighted with the given halflife (in trading days) when halflife is set
+        # Returns a (date x ['const'] + factors) DataFrame, dates without enough history are NaN
+        # Only the shared caches of the model are written, so concurrent requests can use one model
+        factors = MODEL_FACTORS[model_name]
+        asset_prices = self.load_asset_prices(ticker, start_date, end_date)
+        market_prices = self.fetch_market_prices(market_index, start_date, end_date)
+        risk_free_rates = self.risk_free_rates_on(asset_prices.index)
+        # Align data
+        data = pd.DataFrame({
+            'Asset': asset_prices.pct_change(fill_method=None),
+            'Market': market_prices.pct_change(fill_method=None),
+            'Risk_Free': risk_free_rates,
+        })
+        if len(factors) > 1:
+            data = data.join(self.fetch_factor_returns(start_date, end_date)[factors[1:]])
+        data['Asset_Excess'] = data['Asset'] - data['Risk_Free']
+        data['Market_Excess'] = data['Market'] - data['Risk_Free']
+        data.dropna(inplace=True)
+        if halflife is not None:
+            return ewm_betas(data[factors], data['Asset_Excess'], halflife=halflife)
+        return rolling_betas(data[factors], data['Asset_Excess'], window=window)
+
+    def multifactor_statistics(self, tickers, market_index, start_date, end_date, model_name='Fama-French Five-Factor') -> dict:
+        # Sufficient statistics (regression_statistics) of every ticker's regression on the model's factors over the days from
+        # start_date to end_date, the return of start_date is measured from the previous close so the statistics of adjacent
+        # ranges add up to those of the combined range
+        # Also returns market_sum (the market returns summed over each ticker's days), last_date (the last day with data,
+        # None when there is none) and risk_free_rate (the latest daily rate)
+        factors = MODEL_FACTORS[model_name]
+        start_date = pd.Timestamp(start_date).normalize()
+        data, asset_excess, risk_free_rates = self.multifactor_inputs(list(tickers), market_index, start_date - STATISTICS_LOOKBACK, end_date, factors)
+        data = data.loc[start_date:]
+        asset_excess = asset_excess.loc[start_date:]
+        statistics = regression_statistics(data[factors], asset_excess)
+        statistics['market_sum'] = asset_excess.notna().to_numpy(dtype=float).T @ data['Market'].to_numpy(dtype=float)
+        statistics['last_date'] = data.index.max() if not data.empty else None
+        risk_free_rates = risk_free_rates.dropna()
+        statistics['risk_free_rate'] = float(risk_free_rates.iloc[-1]) if not risk_free_rates.empty else np.nan
+        return statistics
+
+    def multifactor_results_from_statistics(self, tickers, statistics, market_index, start_date, end_date, model_name) -> dict:
+        # The results dicts of multifactor_models derived from the tickers' sufficient statistics instead of their returns
+        fit = ols_from_statistics(statistics['gram'], statistics['moments'], statistics['yy'], statistics['nobs'])
+        regressors = statistics['regressors']
+        results = {}
+        for i, ticker in enumerate(tickers):
+            if fit['df_resid'][i] <= 0 or np.isnan(fit['params'][i]).any():
+                continue
+            nobs = statistics['nobs'][i]
+            betas = pd.Series(fit['params'][i], index=regressors)
+            # With a constant the first row of X'X holds the sums of the factors
+            factor_means = pd.Series(statistics['gram'][i, 0, 1:] / nobs, index=regressors[1:])
+            expected_return = self.calculate_expected_return(statistics['risk_free_rate'], betas, factor_means)
+            results[ticker] = {
+                'ticker': ticker,
+                'model_name': model_name,
+                'start_date': start_date,
+                'end_date': end_date,
+                'betas': betas,
+                'expected_return': float(expected_return),
+                'risk_free_rate': float(statistics['risk_free_rate']),
+                'market_index': market_index,
+                'average_market_return': float(statistics['market_sum'][i] / nobs),
+                'factor_means': factor_means,
+                'p_values': pd.Series(fit['pvalues'][i], index=regressors)
+            }
+        return results
+
+    def statistics_inputs_checksum(self, market_index, start_date, end_date, model_name) -> str:
+        # Fingerprint of the market, risk-free and factor series behind a model's statistics over start_date to end_date
+        # The tickers' own prices are left out, reading them would cost as much as rebuilding the statistics
+        start_date = pd.Timestamp(start_date).normalize() - STATISTICS_LOOKBACK
+        market_prices = self.fetch_market_prices(market_index, start_date, end_date)
+        inputs = pd.DataFrame({'Market': market_prices, 'Risk_Free': self.fetch_risk_free_rate(market_prices, start_date, end_date)})
+        factors = [factor for factor in MODEL_FACTORS[model_name] if factor != 'Market_Excess']
+        if factors:
+            inputs = inputs.join(self.db_interface.query_factor_returns(start_date=start_date, end_date=end_date, factors=factors), how='outer')
+        inputs = inputs.sort_index()
+        checksum = hashlib.sha1(inputs.index.to_numpy(dtype='datetime64[ns]').tobytes())
+        checksum.update(inputs.to_numpy(dtype=float).tobytes())
+        return checksum.hexdigest()
+
+    def incremental_multifactor_models(self, tickers, market_index, num_years, model_name='Fama-French Five-Factor', end_date=None, rebuild=False) -> dict:
+        # multifactor_models over the num_years years ending at end_date (default now), updated from the sufficient statistics
+        # stored by the previous run: the days after its last day are added and the days that left the window are subtracted,
+        # so a daily refresh reads a few weeks of returns instead of the whole window
+        # Only the days older than STATISTICS_SETTLE_DAYS are stored, the younger ones are computed again by every run and added
+        # to the stored statistics for the results. Stored statistics whose market, risk-free or factor series changed since
+        # (statistics_inputs_checksum) are rebuilt, like the tickers without usable stored statistics (all of them with rebuild=True)
+        # The updated statistics are stored for the next run, returns {ticker: results} like multifactor_models
+        end_date = pd.Timestamp(end_date if end_date is not None else datetime.datetime.now())
+        start_date = (end_date - pd.Timedelta(days=365 * num_years)).normalize()
+        settled_date = (end_date - STATISTICS_SETTLE_DAYS).normalize()
+        num_params = len(MODEL_FACTORS[model_name]) + 1
+        tickers = list(tickers)
+        stored = {} if rebuild else self.db_interface.query_model_statistics(model_name, num_years, tickers)
+        # Tickers are updated together per stored window, None groups the tickers that have to be rebuilt
+        checksums = {}
+        groups = {}
+        for ticker in tickers:
+            record = stored.get(ticker)
+            window = None
+            if record is not None and record['gram'].shape == (num_params, num_params):
+                stored_start, stored_end = pd.Timestamp(record['start_date']), pd.Timestamp(record['end_date'])
+                if stored_start <= start_date <= stored_end <= settled_date:
+                    if (stored_start, stored_end) not in checksums:
+                        checksums[(stored_start, stored_end)] = self.statistics_inputs_checksum(market_index, stored_start, stored_end, model_name)
+                    if record['inputs_checksum'] == checksums[(stored_start, stored_end)]:
+                        window = (stored_start, stored_end)
+            groups.setdefault(window, []).append(ticker)
+
+        # Ranges without a trading day (a weekend, a holiday) have no returns to add or subtract
+        trading_days = self.fetch_market_prices(market_index, min([start_date] + [window[0] for window in groups if window]), end_date).index
+        def has_trading_days(first_date, last_date):
+            return ((trading_days >= first_date) & (trading_days <= last_date)).any()
+
+        results = {}
+        inputs_checksum = self.statistics_inputs_checksum(market_index, start_date, settled_date, model_name)
+        for window, group in groups.items():
+            if window is None:
+                print(f"Building {model_name} statistics for {len(group)} tickers ({num_years} year window)")
+                statistics = self.multifactor_statistics(group, market_index, start_date, settled_date, model_name)
+            else:
+                stored_start, stored_end = window
+                statistics = {name: np.array([stored[ticker][name] for ticker in group]) for name in ADDITIVE_STATISTICS + ['risk_free_rate']}
+                statistics['regressors'] = ['const'] + MODEL_FACTORS[model_name]
+                statistics['risk_free_rate'] = statistics['risk_free_rate'][-1]
+                if stored_end < settled_date and has_trading_days(stored_end + pd.Timedelta(days=1), settled_date):
+                    added = self.multifactor_statistics(group, market_index, stored_end + pd.Timedelta(days=1), settled_date, model_name)
+                    for name in ADDITIVE_STATISTICS:
+                        statistics[name] = statistics[name] + added[name]
+                    if not np.isnan(added['risk_free_rate']):
+                        statistics['risk_free_rate'] = added['risk_free_rate']
+                if stored_start < start_date and has_trading_days(stored_start, start_date - pd.Timedelta(days=1)):
+                    expired = self.multifactor_statistics(group, market_index, stored_start, start_date - pd.Timedelta(days=1), model_name)
+                    for name in ADDITIVE_STATISTICS:
+                        statistics[name] = statistics[name] - expired[name]
+                print(f"Updated {model_name} statistics for {len(group)} tickers ({num_years} year window) to {settled_date.date()}")
+            statistics['inputs_checksum'] = inputs_checksum
+            self.db_interface.push_model_statistics(model_name, num_years, group, statistics, start_date, settled_date)
+            # The days after settled_date are added for the results only
+            if has_trading_days(settled_date + pd.Timedelta(days=1), end_date):
+                recent = self.multifactor_statistics(group, market_index, settled_date + pd.Timedelta(days=1), end_date, model_name)
+                statistics = dict(statistics, **{name: statistics[name] + recent[name] for name in ADDITIVE_STATISTICS})
+                if not np.isnan(recent['risk_free_rate']):
+                    statistics['risk_free_rate'] = recent['risk_free_rate']
+            results.update(self.multifactor_results_from_statistics(group, statistics, market_index, start_date, end_date, model_name))
+        return results
+
     def multifactor_results_to_string(self, results, include_factors=False):
         string = f"{len(list(results['betas'].items()))-1}-Factor Model Results for {results['ticker']}:\n"
         string += f"Expected Return: {round(results['expected_return'] * 100 * 252, 4)}%\n"
@@ -0,0 +1,96 @@
+# Cross-sectional firm characteristics used to form the Fama-French sort portfolios:
+# size (market cap), value (B/M), operating profitability and investment (asset growth)
+# Every characteristic is computed for all tickers and formation dates at once with column operations on
+# point-in-time panels indexed by (date, ticker), instead of per-ticker statement and price queries
+import pandas as pd
+
+# Statement line items the characteristics are built from
+CHARACTERISTIC_LINE_ITEMS = ['ShareIssued', 'StockholdersEquity', 'TotalAssets', 'TotalRevenue', 'CostOfRevenue',
+                             'SellingGeneralAndAdministration', 'InterestExpense']
+CHARACTERISTIC_REPORT_TYPES = ('balance_sheet', 'income')
+CHARACTERISTICS = ['market_cap', 'bm_ratio', 'profitability', 'investment']
+
+def formation_index(dates) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(sorted(set(pd.to_datetime(list(dates)).normalize())), name='date').astype('datetime64[ns]')
+
+def align_fundamentals(history, dates, report_types=CHARACTERISTIC_REPORT_TYPES) -> pd.DataFrame:
+    # Point-in-time fundamentals panel from the long statement history returned by DBInterface.query_fundamentals_history
+    # For every date and ticker the latest statement of each report type on or before the date is picked (the highest period_code
+    # breaks ties, like DBInterface.query_fundamentals_snapshot), a line item reported on more than one report type keeps the
+    # value of the first report type listed
+    # Returns a (date, ticker) x line item frame, tickers without a statement at a date have no row for it
+    dates = formation_index(dates)
+    # merge_asof needs both date keys at the same resolution
+    history = history.assign(as_of_date=pd.to_datetime(history['as_of_date']).astype('datetime64[ns]'))
+    statements = history[['ticker', 'report_type', 'as_of_date', 'period_code']].drop_duplicates()
+    statements = statements.sort_values('period_code').drop_duplicates(['ticker', 'report_type', 'as_of_date'], keep='last')
+    statements = statements.sort_values('as_of_date')
+    # One row per (ticker, report type, date), matched to the statement in effect at that date
+    grid = statements[['ticker', 'report_type']].drop_duplicates().merge(pd.DataFrame({'date': dates}), how='cross')
+    grid = pd.merge_asof(grid.sort_values('date'), statements, left_on='date', right_on='as_of_date', by=['ticker', 'report_type'])
+    grid = grid.dropna(subset=['as_of_date'])
+    values = history.dropna(subset=['line_item']).merge(grid, on=['ticker', 'report_type', 'as_of_date', 'period_code'])
+    values['order'] = values['report_type'].map({report_type: i for i, report_type in enumerate(report_types)})
+    values = values.sort_values('order').drop_duplicates(['date', 'ticker', 'line_item'])
+    panel = values.pivot(index=['date', 'ticker'], columns='line_item', values='value').sort_index()
+    panel.columns.name = None
+    return panel
+
+def lookup(panel, index) -> pd.Series:
+    # Values of a (date x ticker) panel at the (date, ticker) pairs of index, NaN where the panel has no such date or ticker
+    rows = panel.index.get_indexer(index.get_level_values('date'))
+    cols = panel.columns.get_indexer(index.get_level_values('ticker'))
+    values = panel.to_numpy(dtype=float)[rows, cols]
+    values[(rows < 0) | (cols < 0)] = float('nan')
+    return pd.Series(values, index=index)
+
+def compute_characteristics(fundamentals, prices, prior_total_assets=None) -> pd.DataFrame:
+    # fundamentals: (date, ticker) x line item panel from align_fundamentals
+    # prices: (date x ticker) prices aligned to the same dates
+    # prior_total_assets: TotalAssets a year before each (date, ticker), investment is left empty without it
+    # Returns a (date, ticker) x CHARACTERISTICS frame, a characteristic is NaN for tickers it can't be computed for
+    fundamentals = fundamentals.reindex(columns=CHARACTERISTIC_LINE_ITEMS)
+    stock_price = lookup(prices, fundamentals.index)
+    shares_outstanding = fundamentals['ShareIssued']
+    total_equity = fundamentals['StockholdersEquity']
+    characteristics = pd.DataFrame(index=fundamentals.index, columns=CHARACTERISTICS, dtype=float)
+    # Size and value need shares outstanding, equity and a price
+    valid = shares_outstanding.notna() & total_equity.notna() & stock_price.notna() & (shares_outstanding != 0) & (stock_price != 0)
+    characteristics['market_cap'] = (shares_outstanding * stock_price).where(valid)
+    characteristics['bm_ratio'] = (total_equity / shares_outstanding / stock_price).where(valid)
+    # Operating profitability, a missing InterestExpense counts as zero
+    operating_profit = fundamentals['TotalRevenue'] - fundamentals['CostOfRevenue'] - fundamentals['SellingGeneralAndAdministration'] \
+        - fundamentals['InterestExpense'].fillna(0.0)
+    characteristics['profitability'] = (operating_profit / total_equity).where(operating_profit.notna() & total_equity.notna() & (total_equity != 0))
+    # Investment is the growth of total assets over the year
+    if prior_total_assets is not None:
+        total_assets = fundamentals['TotalAssets']
+        prior_total_assets = prior_total_assets.reindex(fundamentals.index)
+        characteristics['investment'] = ((total_assets - prior_total_assets) / prior_total_assets).where(
+            total_assets.notna() & prior_total_assets.notna() & (prior_total_assets != 0))
+    return characteristics
+
+def build_characteristics(history, prices, dates) -> pd.DataFrame:
+    # Characteristics at every formation date from a statement history and (date x ticker) prices aligned to the dates
+    dates = formation_index(dates)
+    prior_dates = dates - pd.DateOffset(years=1)
+    # Statements are aligned once for the formation dates and the dates a year earlier
+    fundamentals = align_fundamentals(history, dates.union(prior_dates))
+    current = fundamentals[fundamentals.index.get_level_values('date').isin(dates)]
+    prior_index = pd.MultiIndex.from_arrays([current.index.get_level_values('date') - pd.DateOffset(years=1),
+                                             current.index.get_level_values('ticker')], names=['date', 'ticker'])
+    prior_total_assets = fundamentals['TotalAssets'].reindex(prior_index) if 'TotalAssets' in fundamentals else pd.Series(float('nan'), index=prior_index)
+    prior_total_assets.index = current.index
+    return compute_characteristics(current, prices, prior_total_assets)
+
+def load_characteristics(db_interface, dates, tickers=None) -> pd.DataFrame:
+    # Loads the statements and prices needed for the formation dates with one history query and one price snapshot query
+    # and computes every characteristic, returns a (date, ticker) x CHARACTERISTICS frame
+    dates = formation_index(dates)
+    if tickers is None:
+        tickers = db_interface.all_tickers
+    tickers = list(tickers)
+    history = db_interface.query_fundamentals_history(report_types=CHARACTERISTIC_REPORT_TYPES, period_type='q',
+                                                      line_items=CHARACTERISTIC_LINE_ITEMS, tickers=tickers, end_date=dates.max())
+    prices = db_interface.query_price_snapshots(dates, tickers=tickers)
+    return build_characteristics(history, prices, dates)
@@ -1,9 +1,20 @@
 import os
+import io
 import json
+import time
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
 import psycopg2
 from psycopg2 import sql
-from datetime import datetime
+from psycopg2 import extensions
+from psycopg2.extras import execute_values
+from psycopg2.pool import PoolError
+from datetime import datetime, date
+from response_cache import response_cache, notify_cache_invalidation, CACHE_SCOPES, UNIVERSE
 
 def check_env_vars() -> bool:
     env_vars = ['DATABASE_HOST', 'DATABASE_USER', 'DATABASE_PASSWORD']
@@ -16,13 +27,482 @@ def check_env_vars() -> bool:
             return check_env_vars()
     return all_present
 
+def parse_date(value):
+    # dates can be of type str, datetime, or date
+    if isinstance(value, str):
+        try:
+            value = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError("date must be in 'YYYY-MM-DD' format")
+    elif isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        raise ValueError("date must be a date string, datetime, or date object")
+    return value
+
+# Report types stored in the fundamentals table, each one is its own list partition
+FUNDAMENTAL_REPORT_TYPES = ['balance_sheet', 'income', 'cash_flow', 'valuation_measures']
+
+def create_fundamentals_table(conn):
+    # Every statement for every ticker lives in one long-format table, one row per line item
+    # period_type is 'q' or 'a', period_code is the statement's own periodType ('3M', '12M' or 'TTM')
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fundamentals (
+            ticker TEXT NOT NULL,
+            period_type TEXT NOT NULL,
+            report_type TEXT NOT NULL,
+            as_of_date DATE NOT NULL,
+            period_code TEXT NOT NULL,
+            currency_code TEXT,
+            line_item TEXT NOT NULL,
+            value DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (ticker, report_type, period_type, as_of_date, period_code, line_item)
+        ) PARTITION BY LIST (report_type);
+    """)
+    for report_type in FUNDAMENTAL_REPORT_TYPES:
+        cursor.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF fundamentals FOR VALUES IN (%s);").format(
+            sql.Identifier(f'fundamentals_{report_type}')), [report_type])
+    cursor.execute("CREATE TABLE IF NOT EXISTS fundamentals_other PARTITION OF fundamentals DEFAULT;")
+    # Cross-sectional scans (every ticker's statement for a date) read this index instead of the per-ticker primary key
+    cursor.execute("CREATE INDEX IF NOT EXISTS fundamentals_cross_section_idx ON fundamentals (report_type, period_type, as_of_date);")
+    conn.commit()
+    cursor.close()
+
+def create_model_statistics_table(conn):
+    # Sufficient statistics of every ticker's model regression over its current window (X'X and X'y flattened, y'y, the number of
+    # days and the summed market return), written by CAPMModel.incremental_multifactor_models so the next run only adds new days
+    # inputs_checksum fingerprints the market, risk-free and factor series the statistics were computed from, the next run
+    # rebuilds them instead of subtracting expired days if those series changed since
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS model_statistics (
+            ticker TEXT NOT NULL,
+            model_name TEXT NOT NULL,
+            num_years INTEGER NOT NULL,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            nobs INTEGER NOT NULL,
+            gram DOUBLE PRECISION[] NOT NULL,
+            moments DOUBLE PRECISION[] NOT NULL,
+            yy DOUBLE PRECISION NOT NULL,
+            market_sum DOUBLE PRECISION NOT NULL,
+            risk_free_rate DOUBLE PRECISION,
+            inputs_checksum TEXT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (ticker, model_name, num_years)
+        );
+        ALTER TABLE model_statistics ADD COLUMN IF NOT EXISTS inputs_checksum TEXT;
+    """)
+    conn.commit()
+    cursor.close()
+
+def create_model_runs_table(conn):
+    # Ledger of scripts/generate_multifactor_models.py runs, one row per ticker, window and model of a run with its outcome
+    # status is 'completed', 'skipped' (the model can't be fitted, e.g. without momentum returns) or 'failed' (with the error)
+    # duration is the fit's time in seconds, NULL for tickers regressed together in one batch
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE SEQUENCE IF NOT EXISTS model_run_ids;
+        CREATE TABLE IF NOT EXISTS model_runs (
+            run_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            num_years INTEGER NOT NULL,
+            model_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            duration DOUBLE PRECISION,
+            error TEXT,
+            finished_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (run_id, ticker, num_years, model_name)
+        );
+    """)
+    conn.commit()
+    cursor.close()
+
+def create_model_jobs_table(conn):
+    # Work queue of a model generation run shared by any number of worker processes (model_jobs.py), one job per ticker and window
+    # status is 'queued', 'running' (claimed by worker until leased_until, extended by its heartbeats), 'completed' or 'failed'
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS model_jobs (
+            run_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            num_years INTEGER NOT NULL,
+            end_date DATE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker TEXT,
+            leased_until TIMESTAMPTZ,
+            heartbeat_at TIMESTAMPTZ,
+            error TEXT,
+            PRIMARY KEY (run_id, ticker, num_years)
+        );
+        CREATE INDEX IF NOT EXISTS model_jobs_status_idx ON model_jobs (run_id, status);
+    """)
+    conn.commit()
+    cursor.close()
+
+def create_data_versions_table(conn):
+    # One row per (scope, ticker) bumped by every write to that data, the API derives ETag / Last-Modified headers from it
+    # scope is one of CACHE_SCOPES ('fundamentals', 'multifactor_model', 'price_history', 'factor_returns', 'risk_free_rates'),
+    # factor returns are versioned under the ticker UNIVERSE and risk-free rates under their series
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            scope TEXT NOT NULL,
+            ticker TEXT NOT NULL,
+            version BIGINT NOT NULL DEFAULT 1,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT date_trunc('second', now()),
+            PRIMARY KEY (scope, ticker)
+        );
+    """)
+    conn.commit()
+    cursor.close()
+
+def create_factor_returns_table(conn):
+    # Daily returns of the universe-wide factors (SMB, HML, RMW, CMA, MOM), one row per factor and date
+    # Written by scripts/generate_factor_returns.py and read by every per-ticker model
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS factor_returns (
+            factor TEXT NOT NULL,
+            date DATE NOT NULL,
+            value DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (factor, date)
+        );
+    """)
+    conn.commit()
+    cursor.close()
+
+def create_risk_free_rates_table(conn):
+    # Published observations of risk-free rate series from FRED (e.g. the monthly TB3MS), annual rates in percent as published
+    # Written by scripts/update_risk_free_rates.py and read by every model instead of calling FRED
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS risk_free_rates (
+            series TEXT NOT NULL,
+            date DATE NOT NULL,
+            value DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (series, date)
+        );
+    """)
+    conn.commit()
+    cursor.close()
+
+def mark_data_changed(conn, scope, ticker):
+    # Bumps the data version and queues the cache invalidation inside the caller's transaction
+    # Call it right before committing a write so the new version, the new data and the NOTIFY all become visible together
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO data_versions (scope, ticker) VALUES (%s, %s)
+        ON CONFLICT (scope, ticker) DO UPDATE SET
+            version = data_versions.version + 1,
+            updated_at = date_trunc('second', now());
+    """, [scope, ticker])
+    cursor.close()
+    notify_cache_invalidation(conn, scope, ticker)
+
+def statement_query(ticker, period_type, report_type, as_of_date=None, exclude_ttm=False, latest=None, columns=None):
+    # Builds the fundamentals query behind DBInterface.query, returns (sql, params) with %s placeholders
+    # Statements are stored one line item per row, jsonb_object_agg pivots each statement back into a single dict
+    # as_of_date keeps statements dated on or before it, exclude_ttm drops trailing-twelve-month statements,
+    # latest=N keeps the N most recent remaining statements and columns limits the line items returned
+    conditions = ['ticker = %s', 'report_type = %s', 'period_type = %s']
+    params = [ticker, report_type, period_type]
+    if as_of_date is not None:
+        conditions.append('as_of_date <= %s')
+        params.append(parse_date(as_of_date))
+    if exclude_ttm:
+        conditions.append("period_code <> 'TTM'")
+    item_filter = ''
+    item_params = []
+    if columns is not None:
+        item_filter = 'AND line_item = ANY(%s)'
+        item_params = [list(columns)]
+    if latest is None:
+        sql_string = f"""
+            SELECT as_of_date, period_code, max(currency_code), jsonb_object_agg(line_item, value)
+            FROM fundamentals
+            WHERE {' AND '.join(conditions)} {item_filter}
+            GROUP BY as_of_date, period_code
+            ORDER BY as_of_date, period_code
+        """
+        return sql_string, params + item_params
+    # The newest statements are found by walking the primary key backwards from as_of_date and stopping after N of them
+    sql_string = f"""
+        WITH selected AS (
+            SELECT DISTINCT as_of_date, period_code
+            FROM fundamentals
+            WHERE {' AND '.join(conditions)}
+            ORDER BY as_of_date DESC, period_code DESC
+            LIMIT %s
+        )
+        SELECT as_of_date, period_code, max(currency_code), jsonb_object_agg(line_item, value)
+        FROM fundamentals JOIN selected USING (as_of_date, period_code)
+        WHERE ticker = %s AND report_type = %s AND period_type = %s {item_filter}
+        GROUP BY as_of_date, period_code
+        ORDER BY as_of_date, period_code
+    """
+    return sql_string, params + [int(latest), ticker, report_type, period_type] + item_params
+
+def statement_cache_key(ticker, period_type, report_type, as_of_date=None, exclude_ttm=False, latest=None, columns=None) -> tuple:
+    # Response cache key of a DBInterface.query call, shared with AsyncDBInterface
+    return ('fundamentals', ticker, period_type, report_type,
+            None if as_of_date is None else parse_date(as_of_date).isoformat(),
+            bool(exclude_ttm), latest, None if columns is None else tuple(sorted(columns)))
+
+def statement_to_dict(ticker, as_of_date, period_code, currency_code, line_items) -> dict:
+    # Rebuild the row shape of the original per-ticker statement tables
+    statement = {
+        'symbol': ticker,
+        'asOfDate': as_of_date.isoformat(),
+        'periodType': period_code,
+        'currencyCode': currency_code,
+    }
+    statement.update(line_items)
+    return statement
+
+# Price history tables by bar period, every ticker shares one date-partitioned table
+PRICE_HISTORY_TABLES = {'1d': 'price_history'}
+# Benchmark indices stored in price_history next to the stocks (scripts/stock_data_script.py), the models read their market returns from here
+MARKET_INDICES = ['^GSPC', '^DJI', '^IXIC', '^RUT']
+PRICE_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'adj_close']
+# Structured dtype of the columnar price fetch path, dates are selected as days since the epoch so they drop straight into datetime64[D]
+PRICE_ARRAY_DTYPE = np.dtype([('date', 'M8[D]'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'), ('volume', 'i8'), ('adj_close', 'f8')])
+# NULL prices become NaN (and NULL volume 0) so every value fits its fixed-width column
+PRICE_ARRAY_COLUMNS = "(date - DATE '1970-01-01'), " + ", ".join(
+    f"COALESCE({field}, 0)" if field == 'volume' else f"COALESCE({field}, 'NaN')" for field in PRICE_FIELDS)
+
+def ticker_positions_from(table_name) -> str:
+    # FROM clause numbering every row's ticker by its 1-based position (t.position) in a %s::text[] list of tickers
+    # The list is joined as a table (hashed once) instead of scanned with array_position for every row
+    return f"{table_name} p JOIN unnest(%s::text[]) WITH ORDINALITY AS t(ticker, position) ON p.ticker = t.ticker"
+
+# PostgreSQL binary COPY framing, see https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+COPY_BINARY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+# Each exported row is (date, ticker position, value), all NOT NULL, so every record has the same width:
+# int16 field count, then an int32 length followed by the value for each field (binary DATE is int32 days since 2000-01-01)
+PRICE_COPY_RECORD_DTYPE = np.dtype([
+    ('num_fields', '>i2'),
+    ('date_length', '>i4'), ('date', '>i4'),
+    ('ticker_length', '>i4'), ('ticker', '>i4'),
+    ('value_length', '>i4'), ('value', '>f8'),
+])
+POSTGRES_EPOCH = np.datetime64('2000-01-01', 'D')
+
+def decode_price_copy(buffer) -> np.ndarray:
+    # Decodes a binary COPY of (date, ticker position, value) rows into a record array without creating per-row Python objects
+    buffer = memoryview(buffer)
+    if bytes(buffer[:11]) != COPY_BINARY_SIGNATURE:
+        raise ValueError("not a PostgreSQL binary COPY stream")
+    header_length = 19 + int.from_bytes(buffer[15:19], 'big')
+    # The stream ends with a 2 byte trailer (-1 as int16)
+    body_length = len(buffer) - header_length - 2
+    if body_length % PRICE_COPY_RECORD_DTYPE.itemsize != 0:
+        raise ValueError("unexpected record width in binary COPY stream")
+    records = np.frombuffer(buffer, dtype=PRICE_COPY_RECORD_DTYPE, count=body_length // PRICE_COPY_RECORD_DTYPE.itemsize, offset=header_length)
+    if len(records) and not ((records['num_fields'] == 3).all() and (records['date_length'] == 4).all()
+                             and (records['ticker_length'] == 4).all() and (records['value_length'] == 8).all()):
+        raise ValueError("unexpected field layout in binary COPY stream")
+    return records
+
+def select_price_fields(fields=None) -> list:
+    # Validates a requested subset of price columns, returning them in table order (all of them for None)
+    if fields is None:
+        return list(PRICE_FIELDS)
+    unknown = set(fields) - set(PRICE_FIELDS)
+    if unknown or not fields:
+        raise ValueError(f"fields must be a non-empty subset of {PRICE_FIELDS}")
+    return [field for field in PRICE_FIELDS if field in fields]
+
+def fetch_into_array(cursor, dtype, chunk_size=10000) -> np.ndarray:
+    # Copies the result of an executed query into a preallocated structured array chunk by chunk
+    # so no dict or Python-level float()/to_datetime conversion is made per row
+    data = np.empty(max(cursor.rowcount, 0), dtype=dtype)
+    filled = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        data[filled:filled + len(rows)] = rows
+        filled += len(rows)
+    return data[:filled]
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    # A bounded, thread-safe pool of psycopg2 connections
+    # psycopg2's own ThreadedConnectionPool closes every connection above minconn when it is returned
+    # and raises instead of waiting when it is exhausted, so callers here block (up to timeout seconds) for a free connection
+    def __init__(self, minconn=1, maxconn=10, timeout=30.0, health_check_interval=30.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("pool sizes must satisfy 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        # Connections idle for longer than this many seconds are pinged before being handed out
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque() # (connection, last used time) pairs, most recently used last
+        self._size = 0 # open connections, both idle and checked out
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0, # checkouts that had to wait for a connection to be returned
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'connections_created': 0,
+            'connections_discarded': 0, # stale or broken connections that were closed
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        with self._cond:
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['connections_discarded'] += 1
+            self._cond.notify()
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"no database connection available after {self.timeout} seconds")
+                    waited = True
+                    self._cond.wait(remaining)
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, last_used):
+                self._discard(conn)
+                continue
+            break
+        wait_time = time.monotonic() - start
+        with self._cond:
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+            self._stats['wait_time_total'] += wait_time
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            # Never hand the next caller a connection that is mid-transaction
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        # Check out a connection for the duration of a with block
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+        stats['minconn'] = self.minconn
+        stats['maxconn'] = self.maxconn
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
 class DBInterface:
-    def __init__(self):
+    def __init__(self, minconn=None, maxconn=None, pool_timeout=None):
         vars_present = check_env_vars()
         if vars_present == False:
             raise Exception("Database environment variables not set")
 
-        self.conn = psycopg2.connect(
+        # Pool sizes default to the DATABASE_POOL_MIN / DATABASE_POOL_MAX environment variables
+        if minconn is None:
+            minconn = int(os.getenv('DATABASE_POOL_MIN', 1))
+        if maxconn is None:
+            maxconn = int(os.getenv('DATABASE_POOL_MAX', 10))
+        if pool_timeout is None:
+            pool_timeout = float(os.getenv('DATABASE_POOL_TIMEOUT', 30))
+        self.pool = ConnectionPool(
+            minconn=minconn,
+            maxconn=maxconn,
+            timeout=pool_timeout,
             host=os.getenv('DATABASE_HOST'),
             database='financials',
             user=os.getenv('DATABASE_USER'),
@@ -34,204 +514,845 @@ class DBInterface:
         self.close_connection()
 
     def close_connection(self):
-        self.conn.close()
+        if hasattr(self, 'pool'):
+            self.pool.closeall()
     
-    def get_connection(self): # this may not be necessary
-        return self.conn
+    def get_connection(self):
+        # Returns a context manager that checks a connection out of the pool and returns it afterwards
+        # usage: with db_interface.get_connection() as conn:
+        return self.pool.connection()
+
+    def get_pool_stats(self) -> dict:
+        return self.pool.stats()
+
+    def get_cache_stats(self) -> dict:
+        return response_cache.stats()
+
+    def invalidate_cache(self, scope=None, ticker=None):
+        # Drops cached responses in this process and notifies every API server to do the same
+        # scope is one of CACHE_SCOPES, None invalidates every scope
+        with self.pool.connection() as conn:
+            for cache_scope in ([scope] if scope else CACHE_SCOPES):
+                notify_cache_invalidation(conn, cache_scope, ticker)
+            conn.commit()
+        response_cache.invalidate(scope, ticker)
     
     def set_all_tickers(self):
         self.all_tickers = self.get_all_tickers()
     
-    def query(self, ticker='AAPL', period_type='q', report_type='balance_sheet') -> list:
-        cursor = self.conn.cursor()
-        sql_string = f'SELECT * FROM "{ticker}_{period_type}_{report_type}"'
-        cursor.execute(sql_string)
-        financial_data = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
-        data_dict_list = [dict(zip(column_names, row)) for row in financial_data]
+    def get_data_versions(self, scope, tickers) -> dict:
+        # Returns {ticker: {'version': int, 'updated_at': epoch seconds}} for the tickers' data in scope
+        # a ticker maps to {} if its data was never versioned
+        # Cached like the data itself, so conditional requests that end in a 304 never touch the database
+        versions = response_cache.get_many_or_load([(scope, ticker, 'version') for ticker in tickers],
+                                                   lambda keys: self._get_data_versions(scope, keys))
+        return {key[1]: version for key, version in versions.items()}
 
-        return data_dict_list
+    def _get_data_versions(self, scope, keys) -> dict:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT ticker, version, extract(epoch FROM updated_at) FROM data_versions WHERE scope = %s AND ticker = ANY(%s);",
+                               [scope, [key[1] for key in keys]])
+                rows = cursor.fetchall()
+            except psycopg2.errors.UndefinedTable:
+                conn.rollback()
+                rows = []
+            cursor.close()
+        versions = {row[0]: {'version': row[1], 'updated_at': float(row[2])} for row in rows}
+        return {key: versions.get(key[1], {}) for key in keys}
+
+    def query(self, ticker='AAPL', period_type='q', report_type='balance_sheet', as_of_date=None, exclude_ttm=False, latest=None, columns=None) -> list:
+        # Returns the ticker's statements oldest first, the optional filters run in SQL (see statement_query)
+        # e.g. the latest non-TTM statement on or before a date: query(ticker, as_of_date=date, exclude_ttm=True, latest=1)
+        # Statements only change when the ingest scripts run, so results are served from the response cache
+        # The ingest scripts NOTIFY the cache invalidation channel after writing new statements
+        filters = dict(as_of_date=as_of_date, exclude_ttm=exclude_ttm, latest=latest, columns=columns)
+        return response_cache.get_or_load(statement_cache_key(ticker, period_type, report_type, **filters),
+                                          lambda: self._query(ticker, period_type, report_type, **filters))
+
+    def _query(self, ticker, period_type, report_type, **filters) -> list:
+        sql_string, params = statement_query(ticker, period_type, report_type, **filters)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, params)
+            financial_data = cursor.fetchall()
+            cursor.close()
+        return [statement_to_dict(ticker, *row) for row in financial_data]
     
+    def query_statements(self, tickers, period_type='q', report_type='balance_sheet', exclude_ttm=False) -> dict:
+        # Batch version of query returning {ticker: statements}, tickers missing from the cache are read with one query
+        keys = [statement_cache_key(ticker, period_type, report_type, exclude_ttm=exclude_ttm) for ticker in tickers]
+        statements = response_cache.get_many_or_load(keys, lambda keys: self._query_statements(keys, period_type, report_type, exclude_ttm))
+        return {key[1]: data for key, data in statements.items()}
+
+    def _query_statements(self, keys, period_type, report_type, exclude_ttm) -> dict:
+        sql_string = f"""
+            SELECT ticker, as_of_date, period_code, max(currency_code), jsonb_object_agg(line_item, value)
+            FROM fundamentals
+            WHERE ticker = ANY(%s) AND report_type = %s AND period_type = %s {"AND period_code <> 'TTM'" if exclude_ttm else ''}
+            GROUP BY ticker, as_of_date, period_code
+            ORDER BY ticker, as_of_date, period_code
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, ([key[1] for key in keys], report_type, period_type))
+            financial_data = cursor.fetchall()
+            cursor.close()
+        statements = {key[1]: [] for key in keys}
+        for row in financial_data:
+            statements[row[0]].append(statement_to_dict(*row))
+        return {key: statements[key[1]] for key in keys}
+
+    def query_fundamentals_snapshot(self, as_of_date, report_types=('balance_sheet', 'income'), period_type='q', line_items=None, tickers=None) -> pd.DataFrame:
+        # Point-in-time (ticker x line item) DataFrame of every ticker's latest non-TTM statement of each report type on or before as_of_date
+        # Each report type's statement is picked independently, like query(as_of_date=..., exclude_ttm=True, latest=1) per ticker,
+        # but for the whole universe in one statement: DISTINCT ON picks the statements and the join reads only their line items
+        # line_items limits the columns, tickers limits the rows (default every ticker with a statement)
+        # Tickers without a statement are left out, line items a ticker didn't report are NaN
+        conditions = ['report_type = ANY(%s)', 'period_type = %s', 'as_of_date <= %s', "period_code <> 'TTM'"]
+        params = [list(report_types), period_type, parse_date(as_of_date)]
+        if tickers is not None:
+            conditions.append('ticker = ANY(%s)')
+            params.append(list(tickers))
+        item_filter = ''
+        if line_items is not None:
+            item_filter = 'AND f.line_item = ANY(%s)'
+            params.append(list(line_items))
+        sql_string = f"""
+            WITH latest AS (
+                SELECT DISTINCT ON (ticker, report_type) ticker, report_type, period_type, as_of_date, period_code
+                FROM fundamentals
+                WHERE {' AND '.join(conditions)}
+                ORDER BY ticker, report_type, as_of_date DESC, period_code DESC
+            )
+            SELECT f.ticker, f.report_type, f.line_item, f.value
+            FROM fundamentals f JOIN latest USING (ticker, report_type, period_type, as_of_date, period_code)
+            WHERE true {item_filter}
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        long_df = pd.DataFrame(rows, columns=['ticker', 'report_type', 'line_item', 'value'])
+        # A line item reported on more than one statement type keeps the value from the first report type listed
+        long_df['order'] = long_df['report_type'].map({report_type: i for i, report_type in enumerate(report_types)})
+        long_df = long_df.sort_values('order').drop_duplicates(['ticker', 'line_item'])
+        snapshot = long_df.pivot(index='ticker', columns='line_item', values='value')
+        if line_items is not None:
+            snapshot = snapshot.reindex(columns=list(line_items))
+        snapshot.columns.name = None
+        return snapshot.sort_index()
+
+    def query_fundamentals_history(self, report_types=('balance_sheet', 'income'), period_type='q', line_items=None, tickers=None, end_date=None) -> pd.DataFrame:
+        # Long DataFrame (ticker, report_type, as_of_date, period_code, line_item, value) of every non-TTM statement on or before end_date
+        # Used to align statements to many dates at once (see characteristics.align_fundamentals)
+        # Every statement has at least one row, statements without any of the requested line items get a single row with a null line_item
+        # so point-in-time lookups still see them as the latest statement
+        conditions = ['report_type = ANY(%s)', 'period_type = %s', "period_code <> 'TTM'"]
+        params = [list(report_types), period_type]
+        if tickers is not None:
+            conditions.append('ticker = ANY(%s)')
+            params.append(list(tickers))
+        if end_date is not None:
+            conditions.append('as_of_date <= %s')
+            params.append(parse_date(end_date))
+        item_filter = ''
+        if line_items is not None:
+            item_filter = 'AND f.line_item = ANY(%s)'
+            params.append(list(line_items))
+        sql_string = f"""
+            WITH statements AS (
+                SELECT DISTINCT ticker, report_type, period_type, as_of_date, period_code
+                FROM fundamentals
+                WHERE {' AND '.join(conditions)}
+            )
+            SELECT s.ticker, s.report_type, s.as_of_date, s.period_code, f.line_item, f.value
+            FROM statements s LEFT JOIN fundamentals f
+                ON f.ticker = s.ticker AND f.report_type = s.report_type AND f.period_type = s.period_type
+                AND f.as_of_date = s.as_of_date AND f.period_code = s.period_code {item_filter}
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        history = pd.DataFrame(rows, columns=['ticker', 'report_type', 'as_of_date', 'period_code', 'line_item', 'value'])
+        history['as_of_date'] = pd.to_datetime(history['as_of_date'])
+        history['value'] = history['value'].astype(float)
+        return history
+
+    def query_price_snapshot(self, as_of_date, tickers=None, field='close', period_type='1d') -> pd.Series:
+        # Series of each ticker's field value on its last trading day on or before as_of_date (NaN when that value is missing)
+        snapshot = self.query_price_snapshots([as_of_date], tickers=tickers, field=field, period_type=period_type).iloc[0]
+        return snapshot.rename(field).rename_axis('ticker')
+
+    def query_price_snapshots(self, dates, tickers=None, field='close', period_type='1d') -> pd.DataFrame:
+        # (date x ticker) frame of each ticker's field value on its last trading day on or before every date (NaN when missing)
+        # One statement for all the dates and the whole universe, the lateral join reads each (date, ticker)'s row from the (ticker, date) primary key
+        if field not in PRICE_FIELDS:
+            raise ValueError(f"field must be one of {PRICE_FIELDS}")
+        if tickers is None:
+            tickers = self.all_tickers
+        tickers = list(tickers)
+        dates = [parse_date(date) for date in dates]
+        sql_string = f"""
+            SELECT d.position::int, t.position::int, COALESCE(p.{field}::double precision, 'NaN')
+            FROM unnest(%s::date[]) WITH ORDINALITY AS d(date, position)
+            CROSS JOIN unnest(%s::text[]) WITH ORDINALITY AS t(ticker, position)
+            CROSS JOIN LATERAL (
+                SELECT {field} FROM {PRICE_HISTORY_TABLES[period_type]}
+                WHERE ticker = t.ticker AND date <= d.date
+                ORDER BY date DESC
+                LIMIT 1
+            ) p
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, [dates, tickers])
+            data = fetch_into_array(cursor, np.dtype([('date', 'i4'), ('ticker', 'i4'), ('value', 'f8')]))
+            cursor.close()
+        matrix = np.full((len(dates), len(tickers)), np.nan)
+        matrix[data['date'] - 1, data['ticker'] - 1] = data['value']
+        index = pd.DatetimeIndex(dates, name='date').astype('datetime64[ns]')
+        return pd.DataFrame(matrix, index=index, columns=pd.Index(tickers, name='ticker'))
+
     def parse_date(self, date):
-        # dates can be of type str, datetime, or date
-        if isinstance(date, str):
-            try:
-                date = datetime.strptime(date, '%Y-%m-%d').date()
-            except ValueError:
-                raise ValueError("date must be in 'YYYY-MM-DD' format")
-        elif isinstance(date, datetime):
-            date = date.date()
-        elif not isinstance(date, date):
-            raise ValueError("date must be a date string, datetime, or date object")
-        return date
+        return parse_date(date)
     
-    def query_stock_history(self, ticker='AAPL', period_type='1d', start_date=None, end_date=None):
-        cursor = self.conn.cursor()
-        table_name = f'{ticker}_{period_type}_price_history'
-        sql_string = f'SELECT * FROM "{table_name}"'
+    def price_history_conditions(self, start_date=None, end_date=None):
+        # Builds the date range part of a price_history WHERE clause
+        # dates can be of type str, datetime, or date
         conditions = []
         params = []
-
-        # parse and validate start_date
-        # dates can be of type str, datetime, or date
         if start_date is not None:
-            start_date = self.parse_date(start_date)
             conditions.append('date >= %s')
-            params.append(start_date)
-
-        # parse and validate end_date
+            params.append(self.parse_date(start_date))
         if end_date is not None:
-            end_date = self.parse_date(end_date)
             conditions.append('date <= %s') # prevent SQL injection
-            params.append(end_date)
+            params.append(self.parse_date(end_date))
+        return conditions, params
 
-        if conditions:
-            sql_string += ' WHERE ' + ' AND '.join(conditions)
+    def query_stock_history(self, ticker='AAPL', period_type='1d', start_date=None, end_date=None, fields=None):
+        # fields optionally limits the returned columns to a subset of PRICE_FIELDS, date is always included
+        if period_type not in PRICE_HISTORY_TABLES:
+            print(f"No price history table for period {period_type}.")
+            return []
+        table_name = PRICE_HISTORY_TABLES[period_type]
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        sql_string = f'SELECT date, {", ".join(select_price_fields(fields))} FROM {table_name} WHERE ' + ' AND '.join(['ticker = %s'] + conditions)
         # Order the results by date
         sql_string += ' ORDER BY date'
 
-        try:
-            cursor.execute(sql_string, params)
-            price_data = cursor.fetchall()
-            column_names = [desc[0] for desc in cursor.description]
-            data_dict_list = [dict(zip(column_names, row)) for row in price_data]
-        except psycopg2.errors.UndefinedTable:
-            print(f"Table {table_name} does not exist.")
-            data_dict_list = []
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            data_dict_list = []
-        finally:
-            cursor.close()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql_string, [ticker] + params)
+                price_data = cursor.fetchall()
+                column_names = [desc[0] for desc in cursor.description]
+                data_dict_list = [dict(zip(column_names, row)) for row in price_data]
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                data_dict_list = []
+            finally:
+                cursor.close()
 
         return data_dict_list
+
+    def query_price_histories(self, tickers, period_type='1d', start_date=None, end_date=None, fields=None) -> dict:
+        # Batch version of query_stock_history returning {ticker: rows} from one query over the (ticker, date) primary key
+        if period_type not in PRICE_HISTORY_TABLES:
+            print(f"No price history table for period {period_type}.")
+            return {}
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        field_list = select_price_fields(fields)
+        sql_string = f'SELECT ticker, date, {", ".join(field_list)} FROM {PRICE_HISTORY_TABLES[period_type]} WHERE '
+        sql_string += ' AND '.join(['ticker = ANY(%s)'] + conditions) + ' ORDER BY ticker, date'
+        histories = {ticker: [] for ticker in tickers}
+        column_names = ['date'] + field_list
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, [list(tickers)] + params)
+            for row in cursor.fetchall():
+                histories[row[0]].append(dict(zip(column_names, row[1:])))
+            cursor.close()
+        return histories
+
+    def stream_stock_history(self, ticker='AAPL', period_type='1d', start_date=None, end_date=None, chunk_size=2000, fields=None):
+        # Generator version of query_stock_history that yields lists of at most chunk_size row dicts
+        # Rows are read through a named (server-side) cursor so only one chunk is held in memory at a time
+        # The pooled connection stays checked out until the generator is exhausted or closed
+        table_name = PRICE_HISTORY_TABLES[period_type]
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        column_names = ['date'] + select_price_fields(fields)
+        sql_string = f'SELECT {", ".join(column_names)} FROM {table_name} WHERE ' + ' AND '.join(['ticker = %s'] + conditions) + ' ORDER BY date'
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(name=f'price_history_stream_{uuid.uuid4().hex}')
+            cursor.itersize = chunk_size
+            try:
+                cursor.execute(sql_string, [ticker] + params)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield [dict(zip(column_names, row)) for row in rows]
+            finally:
+                cursor.close()
+
+    def query_resampled_stock_history(self, ticker='AAPL', interval='week', period_type='1d', start_date=None, end_date=None, fields=None) -> list:
+        # Aggregates daily bars into weekly or monthly OHLCV bars inside PostgreSQL
+        # Each bar is dated with the last trading day of its week / month
+        if interval not in ['week', 'month']:
+            raise ValueError("interval must be 'week' or 'month'")
+        fields = select_price_fields(fields)
+        table_name = PRICE_HISTORY_TABLES[period_type]
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        aggregates = {
+            'open': '(array_agg(open ORDER BY date))[1]',
+            'high': 'max(high)',
+            'low': 'min(low)',
+            'close': '(array_agg(close ORDER BY date DESC))[1]',
+            'volume': 'sum(volume)::bigint',
+            'adj_close': '(array_agg(adj_close ORDER BY date DESC))[1]',
+        }
+        select_list = ', '.join(f'{aggregates[field]} AS {field}' for field in fields)
+        sql_string = (f'SELECT max(date) AS date, {select_list} FROM {table_name} WHERE '
+                      + ' AND '.join(['ticker = %s'] + conditions)
+                      + f" GROUP BY date_trunc('{interval}', date) ORDER BY 1")
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, [ticker] + params)
+            rows = cursor.fetchall()
+            cursor.close()
+        column_names = ['date'] + fields
+        return [dict(zip(column_names, row)) for row in rows]
+
+    def query_stock_history_arrays(self, ticker='AAPL', period_type='1d', start_date=None, end_date=None, as_frame=True):
+        # Columnar variant of query_stock_history for model code
+        # Returns a date-indexed float DataFrame, or with as_frame=False the structured array (PRICE_ARRAY_DTYPE) itself
+        table_name = PRICE_HISTORY_TABLES[period_type]
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        sql_string = f'SELECT {PRICE_ARRAY_COLUMNS} FROM {table_name} WHERE ' + ' AND '.join(['ticker = %s'] + conditions) + ' ORDER BY date'
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, [ticker] + params)
+            data = fetch_into_array(cursor, PRICE_ARRAY_DTYPE)
+            cursor.close()
+        if not as_frame:
+            return data
+        return pd.DataFrame({field: data[field] for field in PRICE_FIELDS}, index=pd.DatetimeIndex(data['date'].astype('M8[ns]'), name='date'))
+
+    def query_market_index(self, market_index='^GSPC', start_date=None, end_date=None, field='close', period_type='1d') -> pd.Series:
+        # Date-indexed series of one price field of a benchmark index (one of MARKET_INDICES), start and end dates included
+        # Raises ValueError when no prices of the index are stored in the range, they are ingested by scripts/stock_data_script.py
+        if field not in PRICE_FIELDS:
+            raise ValueError(f"field must be one of {PRICE_FIELDS}")
+        data = self.query_stock_history_arrays(ticker=market_index, period_type=period_type, start_date=start_date, end_date=end_date)
+        if data.empty:
+            raise ValueError(f"No {market_index} prices stored between {start_date} and {end_date}, run scripts/stock_data_script.py")
+        return data[field].rename(market_index)
+
+    def query_price_arrays(self, tickers, period_type, start_date, end_date, fields):
+        # Fetches the given fields for many tickers in one statement into flat arrays
+        # Returns the sorted unique dates, the row position of every fetched row, the ticker position of every fetched row and the field arrays
+        table_name = PRICE_HISTORY_TABLES[period_type]
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        dtype = np.dtype([('date', 'M8[D]'), ('ticker', 'i4')] + [(field, 'f8') for field in fields])
+        columns = ', '.join(f"COALESCE(p.{field}::double precision, 'NaN')" for field in fields)
+        # Tickers come back as their 1-based position in the requested list instead of as text
+        sql_string = (f"SELECT (p.date - DATE '1970-01-01'), t.position::int, {columns} FROM {ticker_positions_from(table_name)} WHERE "
+                      + ' AND '.join(['true'] + conditions))
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql_string, [list(tickers)] + params)
+            data = fetch_into_array(cursor, dtype)
+            cursor.close()
+        dates, date_index = np.unique(data['date'], return_inverse=True)
+        return dates, date_index, data['ticker'] - 1, data
+
+    def query_price_panel(self, tickers=None, period_type='1d', start_date=None, end_date=None, field='close') -> pd.DataFrame:
+        # Returns a (date x ticker) DataFrame of one price field for many tickers using a single statement
+        # With tickers=None the whole universe (all_tickers) is returned
+        # The date range is served by the (date, ticker) covering index rather than one lookup per ticker
+        if field not in PRICE_FIELDS:
+            raise ValueError(f"field must be one of {PRICE_FIELDS}")
+        if tickers is None:
+            tickers = self.all_tickers
+        tickers = list(tickers)
+        dates, date_index, ticker_index, data = self.query_price_arrays(tickers, period_type, start_date, end_date, [field])
+        if len(data) == 0:
+            return pd.DataFrame()
+        matrix = np.full((len(dates), len(tickers)), np.nan)
+        matrix[date_index, ticker_index] = data[field]
+        # Only keep tickers that returned rows
+        present = np.unique(ticker_index)
+        return pd.DataFrame(matrix[:, present], index=pd.DatetimeIndex(dates.astype('M8[ns]'), name='date'), columns=[tickers[i] for i in present])
+    
+    def export_price_panel(self, tickers=None, start_date=None, end_date=None, field='close', period_type='1d') -> pd.DataFrame:
+        # Bulk (date x ticker) export of one price field for research jobs that load the whole universe
+        # Uses COPY ... TO STDOUT (FORMAT BINARY) and decodes the fixed-width records straight into NumPy arrays
+        # The raw stream is held in memory while decoding (30 bytes per row)
+        # Unlike query_price_panel, every requested ticker gets a column (all NaN if it has no rows) so the matrix is aligned to the request
+        if field not in PRICE_FIELDS:
+            raise ValueError(f"field must be one of {PRICE_FIELDS}")
+        if tickers is None:
+            tickers = self.all_tickers
+        tickers = list(tickers)
+        table_name = PRICE_HISTORY_TABLES[period_type]
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # COPY takes no bind parameters, so the values are escaped into the statement with mogrify
+            select_string = cursor.mogrify(
+                f"SELECT p.date, t.position::int, COALESCE(p.{field}::double precision, 'NaN') FROM {ticker_positions_from(table_name)} WHERE "
+                + ' AND '.join(['true'] + conditions), [tickers] + params).decode()
+            buffer = io.BytesIO()
+            cursor.copy_expert(f"COPY ({select_string}) TO STDOUT (FORMAT BINARY)", buffer)
+            cursor.close()
+        records = decode_price_copy(buffer.getbuffer())
+        dates, date_index = np.unique(records['date'], return_inverse=True)
+        matrix = np.full((len(dates), len(tickers)), np.nan)
+        matrix[date_index, records['ticker'] - 1] = records['value']
+        index = pd.DatetimeIndex((POSTGRES_EPOCH + dates.astype('i8')).astype('M8[ns]'), name='date')
+        return pd.DataFrame(matrix, index=index, columns=tickers)
     
     def query_batch_stock_history(self, tickers, period_type='1d', start_date=None, end_date=None):
-        dfs = []  # list to store dataframes
-        for ticker in tickers:
-            data = self.query_stock_history(ticker, period_type, start_date, end_date)
-            if data:
-                df = pd.DataFrame(data)
-                # Ensure 'date' is in the dataframe
-                if 'date' in df.columns:
-                    df['date'] = pd.to_datetime(df['date'])
-                    df.set_index('date', inplace=True)
-                    # Create MultiIndex columns
-                    df.columns = pd.MultiIndex.from_product([df.columns, [ticker]])
-                    dfs.append(df)
-                else:
-                    print(f"No 'date' column for ticker {ticker}, skipping.")
-            else:
-                print(f"No data returned for ticker {ticker}, skipping.")
-        if dfs:
-            # Concatenate along columns
-            combined_df = pd.concat(dfs, axis=1)
-
-            # check for duplicate labels
-            if combined_df.columns.duplicated().any():
-                # Remove duplicate columns
-                combined_df = combined_df.loc[:, ~combined_df.columns.duplicated()]
-
-            # Define the order of fields
-            fields_order = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
-            # Reindex the MultiIndex columns to match the field order
-            combined_df = combined_df.reindex(fields_order, level=0, axis=1)
-
-            # convert all rows to float
-            combined_df = combined_df.astype(float)
-            # Sort columns to match yf.download format
-            combined_df.sort_index(axis=1, level=[0,1], inplace=True)
-            return combined_df
-        else:
+        # Returns every price field for the given tickers with (field, ticker) MultiIndex columns, like yf.download
+        tickers = list(tickers)
+        # Define the order of fields
+        fields_order = ['open', 'high', 'low', 'close', 'adj_close', 'volume']
+        dates, date_index, ticker_index, data = self.query_price_arrays(tickers, period_type, start_date, end_date, fields_order)
+        if len(data) == 0:
             print("No data found for any tickers.")
             return pd.DataFrame()  # Return empty dataframe
+
+        present = np.unique(ticker_index)
+        blocks = []
+        for field in fields_order:
+            matrix = np.full((len(dates), len(tickers)), np.nan)
+            matrix[date_index, ticker_index] = data[field]
+            blocks.append(matrix[:, present])
+        columns = pd.MultiIndex.from_product([fields_order, [tickers[i] for i in present]])
+        combined_df = pd.DataFrame(np.hstack(blocks), index=pd.DatetimeIndex(dates.astype('M8[ns]'), name='date'), columns=columns)
+        # Sort columns to match yf.download format
+        combined_df.sort_index(axis=1, level=[0,1], inplace=True)
+        return combined_df
     
     def query_multifactor_model(self, ticker='AAPL', years=10, num_factors=5):
         # TODO implement an input verification function
-        # Returns the JSON object stored in the database
-        cursor = self.conn.cursor()
+        # Returns the JSON object stored in the database, cached until push_multifactor_model_summary replaces it
+        return response_cache.get_or_load(('multifactor_model', ticker, years, num_factors),
+                                          lambda: self._query_multifactor_model(ticker, years, num_factors))
+
+    def _query_multifactor_model(self, ticker, years, num_factors):
         table_name = f"{ticker}_{years}y_{num_factors}_factor_model_summary"
         sql_string = f'SELECT * FROM "{table_name}"'
-        try:
-            cursor.execute(sql_string)
-            data = cursor.fetchall()
-            if data:
-                model_data = data[-1][-1]
-            else:   
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql_string)
+                data = cursor.fetchall()
+                if data:
+                    model_data = data[-1][-1]
+                else:   
+                    model_data = {}
+            except psycopg2.errors.UndefinedTable:
+                print(f"Table {table_name} does not exist.")
                 model_data = {}
-        except psycopg2.errors.UndefinedTable:
-            print(f"Table {table_name} does not exist.")
-            model_data = {}
-        cursor.close()
+            cursor.close()
         return model_data
 
+    def push_factor_returns(self, factor_returns: pd.DataFrame):
+        # Upserts a (date x factor) DataFrame of daily factor returns, missing values are not stored
+        rows = factor_returns.rename_axis(index='date', columns='factor').stack().dropna()
+        values = [(factor, date.date(), float(value)) for (date, factor), value in rows.items()]
+        with self.pool.connection() as conn:
+            create_factor_returns_table(conn)
+            create_data_versions_table(conn)
+            cursor = conn.cursor()
+            try:
+                execute_values(cursor, """
+                    INSERT INTO factor_returns (factor, date, value) VALUES %s
+                    ON CONFLICT (factor, date) DO UPDATE SET value = EXCLUDED.value
+                """, values, page_size=5000)
+                # Responses computed from the factors (e.g. rolling betas) carry this version in their ETag
+                mark_data_changed(conn, 'factor_returns', UNIVERSE)
+                conn.commit()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
+            finally:
+                cursor.close()
+        return len(values)
+
+    def query_factor_returns(self, start_date=None, end_date=None, factors=None) -> pd.DataFrame:
+        # (date x factor) DataFrame of the stored daily factor returns, empty when none are stored for the range
+        conditions = ['true']
+        params = []
+        if start_date is not None:
+            conditions.append('date >= %s')
+            params.append(parse_date(start_date))
+        if end_date is not None:
+            conditions.append('date <= %s')
+            params.append(parse_date(end_date))
+        if factors is not None:
+            conditions.append('factor = ANY(%s)')
+            params.append(list(factors))
+        sql_string = 'SELECT date, factor, value FROM factor_returns WHERE ' + ' AND '.join(conditions)
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql_string, params)
+                rows = cursor.fetchall()
+            except psycopg2.errors.UndefinedTable:
+                conn.rollback()
+                rows = []
+            finally:
+                cursor.close()
+        long_df = pd.DataFrame(rows, columns=['date', 'factor', 'value'])
+        long_df['date'] = pd.to_datetime(long_df['date'])
+        factor_returns = long_df.pivot(index='date', columns='factor', values='value').sort_index()
+        factor_returns.columns.name = None
+        if factors is not None:
+            factor_returns = factor_returns.reindex(columns=list(factors))
+        return factor_returns.astype(float)
+
+    def push_risk_free_rates(self, series, rates: pd.Series):
+        # Upserts the date-indexed observations of a risk-free rate series, missing values are not stored
+        rates = rates.dropna()
+        values = [(series, pd.Timestamp(date).date(), float(value)) for date, value in rates.items()]
+        with self.pool.connection() as conn:
+            create_risk_free_rates_table(conn)
+            create_data_versions_table(conn)
+            cursor = conn.cursor()
+            try:
+                execute_values(cursor, """
+                    INSERT INTO risk_free_rates (series, date, value) VALUES %s
+                    ON CONFLICT (series, date) DO UPDATE SET value = EXCLUDED.value
+                """, values, page_size=5000)
+                mark_data_changed(conn, 'risk_free_rates', series)
+                conn.commit()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
+            finally:
+                cursor.close()
+        return len(values)
+
+    def query_risk_free_rates(self, series='TB3MS', start_date=None, end_date=None) -> pd.Series:
+        # Date-indexed stored observations of a risk-free rate series, empty when none are stored for the range
+        conditions, params = self.price_history_conditions(start_date, end_date)
+        sql_string = 'SELECT date, value FROM risk_free_rates WHERE ' + ' AND '.join(['series = %s'] + conditions) + ' ORDER BY date'
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql_string, [series] + params)
+                rows = cursor.fetchall()
+            except psycopg2.errors.UndefinedTable:
+                conn.rollback()
+                rows = []
+            finally:
+                cursor.close()
+        index = pd.DatetimeIndex([row[0] for row in rows], name='date')
+        return pd.Series([row[1] for row in rows], index=index, name=series, dtype=float)
+
+    def start_model_run(self) -> int:
+        # Id of a new model generation run
+        with self.pool.connection() as conn:
+            create_model_runs_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT nextval('model_run_ids')")
+            run_id = cursor.fetchone()[0]
+            conn.commit()
+            cursor.close()
+        return run_id
+
+    def latest_model_run(self):
+        # Id of the most recent run with ledger entries, None before the first one
+        with self.pool.connection() as conn:
+            create_model_runs_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(run_id) FROM model_runs")
+            run_id = cursor.fetchone()[0]
+            cursor.close()
+        return run_id
+
+    def record_model_runs(self, run_id, entries: list):
+        # Upserts ledger entries (ticker, num_years, model_name, status, duration in seconds or None, error) of a run
+        if not entries:
+            return 0
+        with self.pool.connection() as conn:
+            create_model_runs_table(conn)
+            cursor = conn.cursor()
+            try:
+                execute_values(cursor, """
+                    INSERT INTO model_runs (run_id, ticker, num_years, model_name, status, duration, error) VALUES %s
+                    ON CONFLICT (run_id, ticker, num_years, model_name) DO UPDATE SET
+                        status = EXCLUDED.status, duration = EXCLUDED.duration, error = EXCLUDED.error, finished_at = now()
+                """, [(run_id, ticker, num_years, model_name, status, duration, error) for ticker, num_years, model_name, status, duration, error in entries])
+                conn.commit()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
+            finally:
+                cursor.close()
+        return len(entries)
+
+    def query_model_run(self, run_id) -> dict:
+        # {(ticker, num_years, model_name): status} of a run's ledger entries
+        with self.pool.connection() as conn:
+            create_model_runs_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT ticker, num_years, model_name, status FROM model_runs WHERE run_id = %s", (run_id,))
+            rows = cursor.fetchall()
+            cursor.close()
+        return {(ticker, num_years, model_name): status for ticker, num_years, model_name, status in rows}
+
+    def enqueue_model_jobs(self, run_id, jobs: list, end_date):
+        # Queues (ticker, num_years) jobs of a run whose windows end at end_date, jobs already in the queue are left as they are
+        with self.pool.connection() as conn:
+            create_model_jobs_table(conn)
+            cursor = conn.cursor()
+            try:
+                execute_values(cursor, """
+                    INSERT INTO model_jobs (run_id, ticker, num_years, end_date) VALUES %s
+                    ON CONFLICT (run_id, ticker, num_years) DO NOTHING
+                """, [(run_id, ticker, num_years, parse_date(end_date)) for ticker, num_years in jobs])
+                queued = cursor.rowcount
+                conn.commit()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
+                queued = 0
+            finally:
+                cursor.close()
+        return queued
+
+    def claim_model_jobs(self, run_id, worker, limit=16, lease_seconds=300, max_attempts=3) -> list:
+        # Claims up to limit queued jobs of a run for worker, leased for lease_seconds, returns [(ticker, num_years, end_date)]
+        # Running jobs whose lease expired (their worker stopped sending heartbeats) are queued again first, or failed after max_attempts
+        # SKIP LOCKED lets concurrent workers claim different jobs without waiting on each other
+        with self.pool.connection() as conn:
+            create_model_jobs_table(conn)
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    UPDATE model_jobs SET status = CASE WHEN attempts < %s THEN 'queued' ELSE 'failed' END, worker = NULL,
+                                          error = 'Lease of ' || worker || ' expired'
+                    WHERE run_id = %s AND status = 'running' AND leased_until < now()
+                """, (max_attempts, run_id))
+                cursor.execute("""
+                    UPDATE model_jobs SET status = 'running', worker = %s, attempts = attempts + 1, heartbeat_at = now(),
+                                          leased_until = now() + make_interval(secs => %s)
+                    WHERE (run_id, ticker, num_years) IN (
+                        SELECT run_id, ticker, num_years FROM model_jobs
+                        WHERE run_id = %s AND status = 'queued'
+                        ORDER BY num_years DESC, ticker
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING ticker, num_years, end_date
+                """, (worker, lease_seconds, run_id, limit))
+                jobs = sorted(cursor.fetchall(), key=lambda job: (-job[1], job[0]))
+                conn.commit()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
+                jobs = []
+            finally:
+                cursor.close()
+        return jobs
+
+    def heartbeat_model_jobs(self, run_id, worker, lease_seconds=300) -> int:
+        # Extends the leases of the jobs worker is running, returns how many it still holds
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE model_jobs SET heartbeat_at = now(), leased_until = now() + make_interval(secs => %s)
+                WHERE run_id = %s AND worker = %s AND status = 'running'
+            """, (lease_seconds, run_id, worker))
+            held = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        return held
+
+    def finish_model_job(self, run_id, worker, ticker, num_years, status, error=None) -> bool:
+        # Marks a job worker is running as completed or failed, returns False when its lease was lost to another worker
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE model_jobs SET status = %s, error = %s, leased_until = NULL
+                WHERE run_id = %s AND ticker = %s AND num_years = %s AND worker = %s AND status = 'running'
+            """, (status, error, run_id, ticker, num_years, worker))
+            finished = cursor.rowcount == 1
+            conn.commit()
+            cursor.close()
+        return finished
+
+    def requeue_failed_model_jobs(self, run_id) -> int:
+        # Queues the failed jobs of a run again with fresh attempts, returns how many
+        with self.pool.connection() as conn:
+            create_model_jobs_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("UPDATE model_jobs SET status = 'queued', attempts = 0, worker = NULL WHERE run_id = %s AND status = 'failed'", (run_id,))
+            requeued = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        return requeued
+
+    def query_model_job_counts(self, run_id) -> dict:
+        # {status: number of jobs} of a run's queue
+        with self.pool.connection() as conn:
+            create_model_jobs_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM model_jobs WHERE run_id = %s GROUP BY status", (run_id,))
+            counts = dict(cursor.fetchall())
+            cursor.close()
+        return counts
+
+    def latest_model_job_run(self):
+        # Id of the most recent run with queued jobs, None before the first one
+        with self.pool.connection() as conn:
+            create_model_jobs_table(conn)
+            cursor = conn.cursor()
+            cursor.execute("SELECT MAX(run_id) FROM model_jobs")
+            run_id = cursor.fetchone()[0]
+            cursor.close()
+        return run_id
+
+    def push_model_statistics(self, model_name, num_years, tickers, statistics: dict, start_date, end_date):
+        # Upserts the sufficient statistics of the tickers' model regressions over start_date to end_date
+        # statistics holds gram, moments, yy, nobs and market_sum arrays in the order of tickers, the latest risk_free_rate
+        # and the inputs_checksum of the series they were computed from
+        values = [(ticker, model_name, num_years, parse_date(start_date), parse_date(end_date), int(statistics['nobs'][i]),
+                   statistics['gram'][i].ravel().tolist(), statistics['moments'][i].tolist(), float(statistics['yy'][i]),
+                   float(statistics['market_sum'][i]), float(statistics['risk_free_rate']), statistics.get('inputs_checksum'))
+                  for i, ticker in enumerate(tickers)]
+        with self.pool.connection() as conn:
+            create_model_statistics_table(conn)
+            cursor = conn.cursor()
+            try:
+                execute_values(cursor, """
+                    INSERT INTO model_statistics (ticker, model_name, num_years, start_date, end_date, nobs, gram, moments, yy,
+                                                  market_sum, risk_free_rate, inputs_checksum) VALUES %s
+                    ON CONFLICT (ticker, model_name, num_years) DO UPDATE SET
+                        start_date = EXCLUDED.start_date, end_date = EXCLUDED.end_date, nobs = EXCLUDED.nobs, gram = EXCLUDED.gram,
+                        moments = EXCLUDED.moments, yy = EXCLUDED.yy, market_sum = EXCLUDED.market_sum,
+                        risk_free_rate = EXCLUDED.risk_free_rate, inputs_checksum = EXCLUDED.inputs_checksum, updated_at = now()
+                """, values, page_size=1000)
+                conn.commit()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
+            finally:
+                cursor.close()
+        return len(values)
+
+    def query_model_statistics(self, model_name, num_years, tickers=None) -> dict:
+        # {ticker: statistics} of the stored model regressions, gram is returned as a k x k array and moments as an array
+        conditions = ['model_name = %s', 'num_years = %s']
+        params = [model_name, num_years]
+        if tickers is not None:
+            conditions.append('ticker = ANY(%s)')
+            params.append(list(tickers))
+        sql_string = ('SELECT ticker, start_date, end_date, nobs, gram, moments, yy, market_sum, risk_free_rate, inputs_checksum FROM model_statistics WHERE '
+                      + ' AND '.join(conditions))
+        with self.pool.connection() as conn:
+            # Also adds inputs_checksum to tables created before it existed
+            create_model_statistics_table(conn)
+            cursor = conn.cursor()
+            cursor.execute(sql_string, params)
+            rows = cursor.fetchall()
+            cursor.close()
+        statistics = {}
+        for ticker, start_date, end_date, nobs, gram, moments, yy, market_sum, risk_free_rate, inputs_checksum in rows:
+            num_params = len(moments)
+            statistics[ticker] = {
+                'start_date': start_date,
+                'end_date': end_date,
+                'nobs': nobs,
+                'gram': np.array(gram, dtype=float).reshape(num_params, num_params) if len(gram) == num_params ** 2 else np.empty((0, 0)),
+                'moments': np.array(moments, dtype=float),
+                'yy': yy,
+                'market_sum': market_sum,
+                'risk_free_rate': risk_free_rate,
+                'inputs_checksum': inputs_checksum,
+            }
+        return statistics
+
     def push_multifactor_model_summary(self, results: dict):
-        cursor = self.conn.cursor()
-        try:
-            ticker = results['ticker']
-            num_factors = len(results['betas']) - 1
-            # Parse start_date and end_date if they are strings
-            if isinstance(results['start_date'], str):
-                start_date = datetime.strptime(results['start_date'], '%Y-%m-%d')
-            else:
-                start_date = results['start_date']
-            if isinstance(results['end_date'], str):
-                end_date = datetime.strptime(results['end_date'], '%Y-%m-%d')
-            else:
-                end_date = results['end_date']
-            # Compute num_years
-            num_years = round((end_date - start_date).days / 365)
-            # Ensure at least 1 year
-            num_years = max(num_years, 1)
-            # Create table name
-            table_name = f"{ticker}_{num_years}y_{num_factors}_factor_model_summary"
-            # Ensure that all types are native Python types
-            # Ensure start_date and end_date are strings
-            if isinstance(results['start_date'], datetime):
-                results['start_date'] = results['start_date'].strftime('%Y-%m-%d')
-            if isinstance(results['end_date'], datetime):
-                results['end_date'] = results['end_date'].strftime('%Y-%m-%d')
-            # cast factor_means and p_value items to float
-            for factor in results['betas'].index:
-                if factor != 'const':
-                    results['factor_means'][factor] = float(results['factor_means'][factor])
-                    results['p_values'][factor] = float(results['p_values'][factor])
-            # Convert any field that is a series to a dict
-            for key in results:
-                if isinstance(results[key], pd.Series):
-                    results[key] = results[key].to_dict()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                ticker = results['ticker']
+                num_factors = len(results['betas']) - 1
+                # Parse start_date and end_date if they are strings
+                if isinstance(results['start_date'], str):
+                    start_date = datetime.strptime(results['start_date'], '%Y-%m-%d')
+                else:
+                    start_date = results['start_date']
+                if isinstance(results['end_date'], str):
+                    end_date = datetime.strptime(results['end_date'], '%Y-%m-%d')
+                else:
+                    end_date = results['end_date']
+                # Compute num_years
+                num_years = round((end_date - start_date).days / 365)
+                # Ensure at least 1 year
+                num_years = max(num_years, 1)
+                # Create table name
+                table_name = f"{ticker}_{num_years}y_{num_factors}_factor_model_summary"
+                # Ensure that all types are native Python types
+                # Ensure start_date and end_date are strings
+                if isinstance(results['start_date'], datetime):
+                    results['start_date'] = results['start_date'].strftime('%Y-%m-%d')
+                if isinstance(results['end_date'], datetime):
+                    results['end_date'] = results['end_date'].strftime('%Y-%m-%d')
+                # cast factor_means and p_value items to float
+                for factor in results['betas'].index:
+                    if factor != 'const':
+                        results['factor_means'][factor] = float(results['factor_means'][factor])
+                        results['p_values'][factor] = float(results['p_values'][factor])
+                # Convert any field that is a series to a dict
+                for key in results:
+                    if isinstance(results[key], pd.Series):
+                        results[key] = results[key].to_dict()
             
-            # Create table if it doesn't exist
-            create_table_query = sql.SQL("""
-                CREATE TABLE IF NOT EXISTS {} (
-                    id SERIAL PRIMARY KEY,
-                    data JSONB
-                )
-            """).format(sql.Identifier(table_name))
-            cursor.execute(create_table_query)
-            self.conn.commit()
-            # Delete existing entries to overwrite previous data
-            delete_query = sql.SQL("DELETE FROM {}").format(sql.Identifier(table_name))
-            cursor.execute(delete_query)
-            # Insert new data
-            data_json = json.dumps(results)
-            insert_query = sql.SQL("INSERT INTO {} (data) VALUES (%s)").format(sql.Identifier(table_name))
-            cursor.execute(insert_query, [data_json])
-            self.conn.commit()
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            self.conn.rollback()
-        finally:
-            cursor.close()
+                # Create table if it doesn't exist
+                create_table_query = sql.SQL("""
+                    CREATE TABLE IF NOT EXISTS {} (
+                        id SERIAL PRIMARY KEY,
+                        data JSONB
+                    )
+                """).format(sql.Identifier(table_name))
+                cursor.execute(create_table_query)
+                create_data_versions_table(conn)
+                # Delete existing entries to overwrite previous data
+                delete_query = sql.SQL("DELETE FROM {}").format(sql.Identifier(table_name))
+                cursor.execute(delete_query)
+                # Insert new data
+                data_json = json.dumps(results)
+                insert_query = sql.SQL("INSERT INTO {} (data) VALUES (%s)").format(sql.Identifier(table_name))
+                cursor.execute(insert_query, [data_json])
+                # Tell every API server to drop its cached summaries for this ticker once the new one is committed
+                mark_data_changed(conn, 'multifactor_model', ticker)
+                conn.commit()
+                response_cache.invalidate('multifactor_model', ticker)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
+            finally:
+                cursor.close()
             
     def get_all_tickers(self) -> list:
-        cursor = self.conn.cursor()
-        # Query to get distinct tickers from the financial_master table
-        cursor.execute("SELECT DISTINCT ticker FROM financial_master;")
-        tickers = cursor.fetchall()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # Query to get distinct tickers from the financial_master table
+            cursor.execute("SELECT DISTINCT ticker FROM financial_master;")
+            tickers = cursor.fetchall()
+            cursor.close()
         # Extract tickers from tuples
         ticker_list = [ticker[0] for ticker in tickers]
-        cursor.close()
         return ticker_list
 
     def verify_query_input(self, period_type, ticker) -> bool:
@@ -249,35 +1370,38 @@ class DBInterface:
         return True
     
     def get_github_user(self, github_id):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT * FROM github_users WHERE github_id = %s
-        """, (github_id,))
-        user = cursor.fetchone()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM github_users WHERE github_id = %s
+            """, (github_id,))
+            user = cursor.fetchone()
+            cursor.close()
         # remove email from user data
         if user:
             user = user[:-1]
         return user
 
     def push_github_user(self, github_id, username, email):
-        cursor = self.conn.cursor()
-        # Create table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS github_users (
-                github_id BIGINT PRIMARY KEY,
-                username TEXT,
-                email TEXT
-            )
-        """)
-        try:
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            # Create table if it doesn't exist
             cursor.execute("""
-                INSERT INTO github_users (github_id, username, email)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (github_id) DO UPDATE
-                SET username = EXCLUDED.username, email = EXCLUDED.email;""", (github_id, username, email)
+                CREATE TABLE IF NOT EXISTS github_users (
+                    github_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    email TEXT
+                )
+            """)
+            try:
+                cursor.execute("""
+                    INSERT INTO github_users (github_id, username, email)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (github_id) DO UPDATE
+                    SET username = EXCLUDED.username, email = EXCLUDED.email;""", (github_id, username, email)
                 
-            )
-            self.conn.commit()
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            self.conn.rollback()
\ No newline at end of file
+                )
+                conn.commit()
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                conn.rollback()
\ No newline at end of file
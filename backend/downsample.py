@@ -0,0 +1,30 @@
+# Downsampling helpers for chart data
+import numpy as np
+
+def lttb_indices(x, y, threshold) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets: picks `threshold` points that preserve the visual shape of the (x, y) series
+    # The first and last points are always kept, every bucket in between contributes the point that forms the
+    # largest triangle with the previously selected point and the average of the next bucket
+    # x and y must be float arrays without NaNs, returns the (sorted) positions of the selected points
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket boundaries for the n - 2 interior points
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)).astype(int) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # The next bucket is the final point when we are in the last interior bucket
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
@@ -0,0 +1,169 @@
+# Universe-wide factor returns: SMB, HML (size and value), RMW (profitability), CMA (investment) and MOM (momentum)
+# The factors only depend on the universe, not on the ticker being modelled, so they are computed once for a date range
+# by scripts/generate_factor_returns.py, stored in the factor_returns table and loaded by every per-ticker model
+import datetime
+import numpy as np
+import pandas as pd
+from characteristics import load_characteristics
+
+FACTORS = ['SMB', 'HML', 'RMW', 'CMA', 'MOM']
+VALUE_GROUPS = ['Low', 'Medium', 'High']
+PROFITABILITY_GROUPS = ['Weak', 'Neutral', 'Robust']
+INVESTMENT_GROUPS = ['Conservative', 'Neutral', 'Aggressive']
+# Days of prices needed before the first date for the momentum lookback
+MOMENTUM_LOOKBACK_DAYS = 365
+
+def form_sort_portfolios(market_caps, values, value_column, group_column, choices) -> pd.DataFrame:
+    # 2 x 3 sort of the tickers in market_caps: Small / Big at the median market cap and three groups at the
+    # 30th and 70th percentiles of values ({ticker: characteristic}), tickers missing a value are left out
+    # Returns one row per ticker with its 'Size/Group' label in the Portfolio column
+    df = pd.DataFrame({
+        'Ticker': list(market_caps.keys()),
+        'Market_Cap': list(market_caps.values()),
+        value_column: [values.get(ticker, np.nan) for ticker in market_caps.keys()]
+    })
+    df.dropna(inplace=True)
+    # Size breakpoints
+    size_median = df['Market_Cap'].median()
+    # Characteristic breakpoints
+    low_cutoff = df[value_column].quantile(0.3)
+    high_cutoff = df[value_column].quantile(0.7)
+    df['Size'] = np.where(df['Market_Cap'] <= size_median, 'Small', 'Big')
+    conditions = [
+        (df[value_column] <= low_cutoff),
+        (df[value_column] > low_cutoff) & (df[value_column] <= high_cutoff),
+        (df[value_column] > high_cutoff)
+    ]
+    df[group_column] = np.select(conditions, choices, default='Unknown')
+    # Create portfolio labels
+    df['Portfolio'] = df['Size'] + '/' + df[group_column]
+    return df
+
+def form_all_portfolios(market_caps, bm_ratios, profitability, investment) -> pd.DataFrame:
+    # The size / value, size / profitability and size / investment sorts, a ticker appears once in each
+    return pd.concat([
+        form_sort_portfolios(market_caps, bm_ratios, 'BM_Ratio', 'Value', VALUE_GROUPS),
+        form_sort_portfolios(market_caps, profitability, 'Profitability', 'Profitability_Group', PROFITABILITY_GROUPS),
+        form_sort_portfolios(market_caps, investment, 'Investment', 'Investment_Group', INVESTMENT_GROUPS)
+    ])
+
+def portfolio_returns(returns, portfolios) -> dict:
+    # Equal-weighted daily returns of every portfolio from a (date x ticker) frame of stock returns
+    portfolio_groups = portfolios.groupby('Portfolio')['Ticker'].apply(list)
+    return {portfolio: returns.reindex(columns=tickers).mean(axis=1) for portfolio, tickers in portfolio_groups.items()}
+
+def average_returns(portfolio_returns, portfolios) -> pd.Series:
+    # Mean return of the listed portfolios that were formed
+    returns = [portfolio_returns[port] for port in portfolios if port in portfolio_returns]
+    if not returns:
+        return pd.Series(dtype=float)
+    return pd.concat(returns, axis=1).mean(axis=1)
+
+def smb_hml_factors(portfolio_returns):
+    # SMB (small minus big) is a measure of size and HML (high minus low B/M) a measure of value
+    small_returns = average_returns(portfolio_returns, ['Small/Low', 'Small/Medium', 'Small/High'])
+    big_returns = average_returns(portfolio_returns, ['Big/Low', 'Big/Medium', 'Big/High'])
+    smb = small_returns - big_returns
+    value_returns = average_returns(portfolio_returns, ['Small/High', 'Big/High'])
+    growth_returns = average_returns(portfolio_returns, ['Small/Low', 'Big/Low'])
+    hml = value_returns - growth_returns
+    return smb, hml
+
+def rmw_factor(portfolio_returns) -> pd.Series:
+    # RMW (robust minus weak operating profitability)
+    return average_returns(portfolio_returns, ['Small/Robust', 'Big/Robust']) - average_returns(portfolio_returns, ['Small/Weak', 'Big/Weak'])
+
+def cma_factor(portfolio_returns) -> pd.Series:
+    # CMA (conservative minus aggressive investment)
+    return average_returns(portfolio_returns, ['Small/Conservative', 'Big/Conservative']) - \
+        average_returns(portfolio_returns, ['Small/Aggressive', 'Big/Aggressive'])
+
+def momentum_factor(prices, start_date, end_date):
+    # Momentum from a (date x ticker) price frame starting MOMENTUM_LOOKBACK_DAYS before start_date
+    # At each month end stocks are ranked on their prior 11-month return (t-12 to t-1), MOM is the return of the
+    # top 30% (winners) minus the bottom 30% (losers) over the following month
+    # Returns None when there isn't enough data
+    month_ends = pd.date_range(start=start_date, end=end_date, freq='ME')
+    momentum_returns = []
+    for formation_date in month_ends:
+        # Check if we have enough data
+        if formation_date - pd.DateOffset(months=12) < prices.index.min():
+            continue
+        # Calculate prior 11-month returns (t-12 to t-1)
+        start_period = (formation_date - pd.DateOffset(months=12)).strftime('%Y-%m-%d')
+        end_period = (formation_date - pd.DateOffset(months=1)).strftime('%Y-%m-%d')
+        prior_prices = prices.loc[start_period:end_period]
+        if prior_prices.empty:
+            continue
+        prior_returns = (prior_prices.iloc[-1] / prior_prices.iloc[0] - 1).dropna()
+        # Rank stocks based on prior returns
+        if len(prior_returns) < 10:
+            continue
+        top_cutoff = prior_returns.quantile(0.7)
+        bottom_cutoff = prior_returns.quantile(0.3)
+        winners = prior_returns[prior_returns >= top_cutoff].index.tolist()
+        losers = prior_returns[prior_returns <= bottom_cutoff].index.tolist()
+        # Calculate returns of Winner and Loser portfolios over next month
+        start_next_month = formation_date.strftime('%Y-%m-%d')
+        end_next_month = (formation_date + pd.DateOffset(months=1) - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        winner_prices = prices.loc[start_next_month:end_next_month, winners]
+        loser_prices = prices.loc[start_next_month:end_next_month, losers]
+        if winner_prices.empty or loser_prices.empty:
+            continue
+        winner_returns = winner_prices.pct_change(fill_method=None).mean(axis=1)
+        loser_returns = loser_prices.pct_change(fill_method=None).mean(axis=1)
+        momentum_returns.append(winner_returns - loser_returns)
+    if not momentum_returns:
+        return None
+    momentum = pd.concat(momentum_returns)
+    # Handle duplicate indices by averaging
+    return momentum.groupby(momentum.index).mean()
+
+def formation_dates_for(start_date, end_date) -> list:
+    # Portfolios are formed every June 30 and held for the following twelve months,
+    # returns the formation dates whose holding period overlaps [start_date, end_date]
+    formation_dates = [pd.Timestamp(year, 6, 30) for year in range(start_date.year - 1, end_date.year + 1)]
+    return [date for date in formation_dates if date < end_date and date + pd.DateOffset(years=1) >= start_date]
+
+def compute_factor_returns(db_interface, start_date, end_date, tickers=None) -> pd.DataFrame:
+    # Daily returns of every factor in FACTORS between start_date and end_date for the universe (default every ticker)
+    # The characteristics of all formation dates, and the closes of every ticker, are each loaded in one pass
+    start_date = pd.Timestamp(start_date).normalize()
+    end_date = pd.Timestamp(end_date).normalize()
+    if tickers is None:
+        tickers = db_interface.all_tickers
+    tickers = list(tickers)
+    formation_dates = formation_dates_for(start_date, end_date)
+    characteristics = load_characteristics(db_interface, formation_dates, tickers=tickers)
+    formed = set(characteristics.index.get_level_values('date'))
+    prices = db_interface.export_price_panel(tickers, start_date=start_date - datetime.timedelta(days=MOMENTUM_LOOKBACK_DAYS),
+                                             end_date=end_date, field='close')
+    returns = prices.pct_change(fill_method=None)
+
+    sort_factors = []
+    for formation_date in formation_dates:
+        holding_returns = returns.loc[max(formation_date + pd.Timedelta(days=1), start_date):min(formation_date + pd.DateOffset(years=1), end_date)]
+        if holding_returns.empty or formation_date not in formed:
+            continue
+        formation = characteristics.xs(formation_date, level='date')
+        market_caps = formation['market_cap'].dropna().to_dict()
+        if not market_caps:
+            print(f"No market caps at {formation_date.date()}, skipping its holding period")
+            continue
+        portfolios = form_all_portfolios(market_caps, formation['bm_ratio'].dropna().to_dict(),
+                                         formation['profitability'].dropna().to_dict(), formation['investment'].dropna().to_dict())
+        holding_portfolio_returns = portfolio_returns(holding_returns, portfolios)
+        smb, hml = smb_hml_factors(holding_portfolio_returns)
+        sort_factors.append(pd.DataFrame({
+            'SMB': smb,
+            'HML': hml,
+            'RMW': rmw_factor(holding_portfolio_returns),
+            'CMA': cma_factor(holding_portfolio_returns)
+        }, index=holding_returns.index))
+
+    factor_returns = pd.concat(sort_factors) if sort_factors else pd.DataFrame(columns=FACTORS[:4], dtype=float)
+    momentum = momentum_factor(prices, start_date, end_date)
+    factor_returns = factor_returns.join(momentum.rename('MOM'), how='outer') if momentum is not None else factor_returns.assign(MOM=np.nan)
+    factor_returns = factor_returns.loc[start_date:end_date, FACTORS]
+    factor_returns.index.name = 'date'
+    return factor_returns
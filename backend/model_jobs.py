@@ -0,0 +1,78 @@
+# Worker side of the model_jobs queue, any number of these can run against the same database on one or several machines
+# Each worker claims a few (ticker, window) jobs at a time with SELECT ... FOR UPDATE SKIP LOCKED, keeps their leases alive
+# with a heartbeat thread while it fits them, and marks them finished. Jobs of a worker that dies stop receiving heartbeats,
+# so their leases expire and the next claim by any worker queues them again
+import os
+import time
+import socket
+import threading
+
+def worker_name() -> str:
+    # Identifies this process in the queue, e.g. 'host:12345'
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class JobHeartbeat:
+    # Background thread extending the leases of the jobs a worker holds every interval seconds
+    def __init__(self, db_interface, run_id, worker, lease_seconds=300, interval=None):
+        self.db_interface = db_interface
+        self.run_id = run_id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        # A few heartbeats fit in every lease so a slow database round trip doesn't lose it
+        self.interval = interval if interval is not None else lease_seconds / 3
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='model-job-heartbeat', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.db_interface.heartbeat_model_jobs(self.run_id, self.worker, self.lease_seconds)
+            except Exception as e:
+                print(f"Model job heartbeat error: {e}")
+
+def run_model_jobs(db_interface, run_id, process_jobs, worker=None, batch_size=16, lease_seconds=300, max_attempts=3, poll_interval=10.0) -> dict:
+    # Claims and processes jobs of a run until none are queued or running anywhere
+    # process_jobs([(ticker, num_years, end_date)]) fits the claimed jobs and returns {(ticker, num_years): error or None},
+    # a job it leaves out or raises for is failed (requeue_failed_model_jobs queues the failed jobs of a run again)
+    # When every remaining job is running on other workers this one waits, in case their leases expire
+    # Returns {status: number of jobs this worker finished}
+    worker = worker or worker_name()
+    finished = {}
+    heartbeat = JobHeartbeat(db_interface, run_id, worker, lease_seconds).start()
+    try:
+        while True:
+            jobs = db_interface.claim_model_jobs(run_id, worker, limit=batch_size, lease_seconds=lease_seconds, max_attempts=max_attempts)
+            if not jobs:
+                counts = db_interface.query_model_job_counts(run_id)
+                if not counts.get('queued') and not counts.get('running'):
+                    break
+                time.sleep(poll_interval)
+                continue
+            try:
+                errors = process_jobs(jobs)
+            except Exception as e:
+                print(f"Failed to process {len(jobs)} jobs")
+                print(e)
+                errors = {(ticker, num_years): str(e) for ticker, num_years, _ in jobs}
+            for ticker, num_years, _ in jobs:
+                error = errors.get((ticker, num_years), "Job was not processed")
+                status = 'completed' if error is None else 'failed'
+                if db_interface.finish_model_job(run_id, worker, ticker, num_years, status, error):
+                    finished[status] = finished.get(status, 0) + 1
+                else:
+                    print(f"Lost the lease of {ticker} ({num_years} year window) to another worker")
+    finally:
+        heartbeat.stop()
+    return finished
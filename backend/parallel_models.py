@@ -0,0 +1,118 @@
+# Per-ticker multifactor model fits spread over a pool of worker processes
+# The universe price panel and the factor series are loaded once, copied into multiprocessing.shared_memory blocks and mapped
+# by every worker as NumPy arrays without copying, each worker then fits its chunks of tickers with
+# CAPMModel.factor_model_results, the regression and results of the per-ticker models like five_factor_model / six_factor_model
+import os
+import time
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool, shared_memory
+from capm_model import CAPMModel, MODEL_FACTORS
+
+# Tickers fitted per task sent to a worker
+CHUNK_SIZE = 16
+
+# Shared arrays (and their memory blocks, which have to stay open while the arrays are used) of a worker process, set by attach_panel
+worker_panel = {}
+worker_blocks = []
+# Only the fitting functions of the model are used in the workers, it has no database connection
+worker_model = CAPMModel(fred_api_key=None, db_interface=None)
+
+def share_array(array):
+    # Copies array into a new shared memory block, returns the block and the descriptor the workers attach to it with
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, order=order)
+    shared[...] = array
+    return block, (block.name, array.shape, array.dtype.str, order)
+
+def attach_array(descriptor):
+    # Maps a shared_array descriptor to (block, array) in this process
+    name, shape, dtype, order = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf, order=order)
+
+def attach_panel(descriptors, columns):
+    # Pool initializer, maps the shared dates, data (dates x columns) and excess returns (dates x tickers) of the panel
+    for key, descriptor in descriptors.items():
+        block, array = attach_array(descriptor)
+        worker_blocks.append(block)
+        worker_panel[key] = array
+    worker_panel['columns'] = columns
+
+def fit_ticker(ticker, model_name, data, asset_excess, market_index, start_date, end_date):
+    # One ticker's model on its dates of the window, the results dict of the per-ticker CAPMModel models
+    # Returns None for momentum models without momentum returns, like four_factor_model / six_factor_model
+    factors = MODEL_FACTORS[model_name]
+    if 'MOM' in factors and data['MOM'].isna().all():
+        return None
+    # The latest risk-free rate is the one of the ticker's last price in the window
+    risk_free_rate_latest = data['Risk_Free'][~np.isnan(asset_excess)].iloc[-1]
+    ticker_data = data[['Market'] + factors].assign(Asset_Excess=asset_excess).dropna()
+    return worker_model.factor_model_results(ticker, model_name, ticker_data, risk_free_rate_latest, market_index, start_date, end_date)
+
+def fit_tickers(task):
+    # Worker task: fits one model over one window for a chunk of (column, ticker) pairs of the shared panel
+    # Returns [(window, model_name, ticker, results or None, error message or None, seconds)] in the order of the chunk,
+    # a failing ticker doesn't stop the others
+    window, model_name, (first_row, last_row), start_date, end_date, market_index, chunk = task
+    dates = pd.DatetimeIndex(worker_panel['dates'][first_row:last_row])
+    data = pd.DataFrame(worker_panel['data'][first_row:last_row], index=dates, columns=worker_panel['columns'])
+    outcomes = []
+    for column, ticker in chunk:
+        started = time.perf_counter()
+        try:
+            result = fit_ticker(ticker, model_name, data, worker_panel['excess'][first_row:last_row, column], market_index, start_date, end_date)
+            outcomes.append((window, model_name, ticker, result, None, time.perf_counter() - started))
+        except Exception as e:
+            outcomes.append((window, model_name, ticker, None, str(e), time.perf_counter() - started))
+    return outcomes
+
+def parallel_multifactor_models(capm_model, tickers, market_index, windows, model_names, workers=None, chunk_size=CHUNK_SIZE, skip=None):
+    # Fits every model in model_names for every ticker over every (start_date, end_date) window on `workers` processes
+    # (default one per core), the inputs are loaded once for the span of all the windows
+    # skip is a set of (ticker, window index, model_name) fits to leave out
+    # Yields the outcome list of every chunk of tickers, ordered by window, model and ticker, as soon as it is available:
+    # [(window index, model_name, ticker, results or None, error message or None, seconds)], results is None when the fit
+    # raised (error is set) or when the model can't be fitted without momentum returns (error is None)
+    tickers = list(tickers)
+    skip = skip or set()
+    factors = list(dict.fromkeys(factor for model_name in model_names for factor in MODEL_FACTORS[model_name]))
+    span_start = min(start_date for start_date, _ in windows)
+    span_end = max(end_date for _, end_date in windows)
+    data, asset_excess, _ = capm_model.multifactor_inputs(tickers, market_index, span_start, span_end, factors, dropna=False)
+    columns = ['Market', 'Risk_Free'] + factors
+    dates = data.index.to_numpy(dtype='datetime64[ns]')
+    arrays = {
+        'dates': dates,
+        'data': data[columns].to_numpy(dtype=float),
+        # Column major so every ticker's returns are contiguous
+        'excess': np.asfortranarray(asset_excess[tickers].to_numpy(dtype=float)),
+    }
+    blocks = []
+    try:
+        descriptors = {}
+        for key, array in arrays.items():
+            block, descriptors[key] = share_array(array)
+            blocks.append(block)
+        columns_tickers = list(enumerate(tickers))
+        tasks = []
+        for window, (start_date, end_date) in enumerate(windows):
+            # The first day of a window has no return when the window is fitted on its own, so it is skipped here too
+            # (the panel has no returns on the first day of the span already)
+            first_row = int(dates.searchsorted(pd.Timestamp(start_date).to_datetime64()))
+            if start_date > span_start:
+                first_row += 1
+            last_row = int(dates.searchsorted(pd.Timestamp(end_date).to_datetime64(), side='right'))
+            for model_name in model_names:
+                pending = [(column, ticker) for column, ticker in columns_tickers if (ticker, window, model_name) not in skip]
+                for i in range(0, len(pending), chunk_size):
+                    tasks.append((window, model_name, (first_row, last_row), start_date, end_date, market_index, pending[i:i + chunk_size]))
+        with Pool(workers or os.cpu_count(), initializer=attach_panel, initargs=(descriptors, columns)) as pool:
+            # imap hands back the chunks in task order whichever worker finishes first
+            for outcomes in pool.imap(fit_tickers, tasks):
+                yield outcomes
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
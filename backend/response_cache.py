@@ -0,0 +1,265 @@
+# In-process response cache for data that only changes when an ingest script or model run writes it
+# (financial statements and multifactor model summaries)
+import os
+import json
+import time
+import select
+import threading
+from collections import OrderedDict
+import psycopg2
+from psycopg2 import extensions
+
+# Writers NOTIFY this channel after committing, every API process LISTENs on it and drops the matching entries
+# The payload is '<scope>' or '<scope>:<ticker>', e.g. 'fundamentals:AAPL' or 'multifactor_model'
+CACHE_INVALIDATION_CHANNEL = 'kocoon_cache_invalidate'
+CACHE_SCOPES = ['fundamentals', 'multifactor_model', 'price_history', 'factor_returns', 'risk_free_rates']
+# Ticker of the universe-wide data versions (the factor returns are not per ticker), e.g. ('factor_returns', 'universe')
+UNIVERSE = 'universe'
+
+def notify_cache_invalidation(conn, scope, ticker=None):
+    # Queues an invalidation message on conn, PostgreSQL only delivers it once the transaction commits
+    # so API servers never drop an entry before the new data is visible
+    payload = scope if ticker is None else f'{scope}:{ticker}'
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_notify(%s, %s);", [CACHE_INVALIDATION_CHANNEL, payload])
+    cursor.close()
+
+# Marks a cache miss, so a loader result of None is cached like any other value
+MISSING = object()
+
+def parse_invalidation_payload(payload):
+    # Returns (scope, ticker), ticker is None when the whole scope should be dropped
+    scope, _, ticker = payload.partition(':')
+    return scope, ticker or None
+
+class ResponseCache:
+    # Thread-safe LRU cache with a time-to-live and limits on both the number of entries and their total size
+    # Keys are tuples whose first two items are the scope and the ticker, e.g. ('fundamentals', 'AAPL', 'q', 'income')
+    # Values are stored as serialized JSON, so hits hand every caller its own copy and entry sizes are exact
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, payload bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Invalidation counters of the whole cache, of each scope and of each (scope, ticker), a value loaded while one of its
+        # counters moved may predate the write that invalidated it and is not stored
+        self._cleared = 0
+        self._scope_generations = {}
+        self._ticker_generations = {}
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'oversize': 0,
+            'stale': 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        # RESPONSE_CACHE_TTL=0 or RESPONSE_CACHE_MAX_ENTRIES=0 turns the cache off
+        return cls(
+            max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024)),
+            max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+            ttl=float(os.getenv('RESPONSE_CACHE_TTL', 3600))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0 and self.ttl > 0
+
+    def _remove(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def _generation(self, key):
+        return (self._cleared, self._scope_generations.get(key[0], 0), self._ticker_generations.get((key[0], key[1]), 0))
+
+    def generation(self, key):
+        # Read before loading a value for key and passed to set, which drops the value if key was invalidated in between
+        with self._lock:
+            return self._generation(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            expires_at, payload = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+        return json.loads(payload)
+
+    def set(self, key, value, generation=None):
+        # generation is the value of self.generation(key) from before value was loaded
+        if not self.enabled:
+            return
+        payload = json.dumps(value, default=str).encode()
+        with self._lock:
+            if generation is not None and generation != self._generation(key):
+                self._stats['stale'] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            # A single response bigger than the whole budget would just flush everything else
+            if len(payload) > self.max_bytes:
+                self._stats['oversize'] += 1
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._bytes += len(payload)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def get_or_load(self, key, loader):
+        # Returns the cached value for key, calling loader() and caching its result on a miss
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            generation = self.generation(key)
+            value = loader()
+            self.set(key, value, generation)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        # Same as get_or_load for a coroutine function loader
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            generation = self.generation(key)
+            value = await loader()
+            self.set(key, value, generation)
+        return value
+
+    def get_many_or_load(self, keys, loader) -> dict:
+        # Batch version of get_or_load, loader(missing_keys) is called once with every missed key and returns {key: value}
+        # Keys the loader leaves out are neither returned nor cached, the others are returned in the order of keys
+        values, missing, generations = self._get_many(keys)
+        if missing:
+            loaded = loader(missing)
+            self._set_many(missing, loaded, values, generations)
+        return {key: values[key] for key in keys if key in values}
+
+    async def get_many_or_load_async(self, keys, loader) -> dict:
+        # Same as get_many_or_load for a coroutine function loader
+        values, missing, generations = self._get_many(keys)
+        if missing:
+            loaded = await loader(missing)
+            self._set_many(missing, loaded, values, generations)
+        return {key: values[key] for key in keys if key in values}
+
+    def _get_many(self, keys):
+        values = {}
+        missing = []
+        for key in keys:
+            value = self.get(key, MISSING)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                values[key] = value
+        generations = {key: self.generation(key) for key in missing}
+        return values, missing, generations
+
+    def _set_many(self, keys, loaded, values, generations):
+        for key in keys:
+            if key in loaded:
+                values[key] = loaded[key]
+                self.set(key, loaded[key], generations[key])
+
+    def invalidate(self, scope=None, ticker=None) -> int:
+        # Drops every entry for the scope (and ticker when given), everything when scope is None
+        # Returns the number of entries removed
+        with self._lock:
+            if scope is None:
+                self._cleared += 1
+            elif ticker is None:
+                self._scope_generations[scope] = self._scope_generations.get(scope, 0) + 1
+            else:
+                self._ticker_generations[(scope, ticker)] = self._ticker_generations.get((scope, ticker), 0) + 1
+            keys = [key for key in self._entries
+                    if (scope is None or key[0] == scope) and (ticker is None or key[1] == ticker)]
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidations'] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        stats['max_entries'] = self.max_entries
+        stats['max_bytes'] = self.max_bytes
+        stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+class InvalidationListener:
+    # Background thread that LISTENs on CACHE_INVALIDATION_CHANNEL and applies each message to a ResponseCache
+    # It keeps a dedicated connection outside of the pools and reconnects (clearing the cache, since messages
+    # may have been missed in between) if that connection drops
+    def __init__(self, cache, poll_interval=5.0, **connect_kwargs):
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.connect_kwargs = connect_kwargs
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='cache-invalidation-listener', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _listen(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = conn.cursor()
+        cursor.execute(f"LISTEN {CACHE_INVALIDATION_CHANNEL};")
+        cursor.close()
+        return conn
+
+    def _run(self):
+        conn = None
+        while not self._stop.is_set():
+            try:
+                if conn is None:
+                    conn = self._listen()
+                    self.cache.clear()
+                if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    scope, ticker = parse_invalidation_payload(conn.notifies.pop(0).payload)
+                    self.cache.invalidate(scope, ticker)
+            except Exception as e:
+                print(f"Cache invalidation listener error: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                conn = None
+                self._stop.wait(self.poll_interval)
+        if conn is not None:
+            conn.close()
+
+# Shared by DBInterface and AsyncDBInterface so both data paths fill and invalidate the same entries
+response_cache = ResponseCache.from_env()
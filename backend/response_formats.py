@@ -0,0 +1,243 @@
+# Content negotiation, binary encodings (Arrow IPC / MessagePack) and response compression for the API's data routes
+# pyarrow, msgpack and brotli are optional, formats and encodings whose library is missing are simply not offered
+import io
+import json
+import zlib
+from datetime import date, datetime
+import pandas as pd
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FORMAT_MEDIA_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'msgpack': 'application/msgpack',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+MEDIA_TYPE_FORMATS = {media_type: fmt for fmt, media_type in FORMAT_MEDIA_TYPES.items()}
+MEDIA_TYPE_FORMATS['application/x-msgpack'] = 'msgpack'
+MEDIA_TYPE_FORMATS['application/vnd.msgpack'] = 'msgpack'
+
+# Formats each kind of route can produce, tables are lists of row dicts (or {ticker: rows}) and documents are plain dicts
+TABLE_FORMATS = ['json', 'ndjson', 'msgpack', 'arrow']
+BATCH_FORMATS = ['json', 'msgpack', 'arrow']
+DOCUMENT_FORMATS = ['json', 'msgpack']
+
+def format_available(fmt) -> bool:
+    if fmt == 'arrow':
+        return pa is not None
+    if fmt == 'msgpack':
+        return msgpack is not None
+    return fmt in FORMAT_MEDIA_TYPES
+
+def negotiate_format(format_param, accept, supported):
+    # Picks the response format from an explicit ?format= parameter, falling back to the Accept header
+    # Returns None when nothing acceptable can be produced, which the routes answer with 406
+    supported = [fmt for fmt in supported if format_available(fmt)]
+    if format_param is not None:
+        return format_param if format_param in supported else None
+    if not accept:
+        return 'json'
+    best, best_rank = None, (0.0, 0)
+    for part in accept.split(','):
+        media_type, *params = [item.strip() for item in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        # An explicitly listed media type beats a wildcard of the same quality
+        if media_type in ['*/*', 'application/*']:
+            fmt, specific = 'json', 0
+        else:
+            fmt, specific = MEDIA_TYPE_FORMATS.get(media_type.lower()), 1
+        if fmt in supported and quality > 0 and (quality, specific) > best_rank:
+            best, best_rank = fmt, (quality, specific)
+    return best
+
+def msgpack_default(value):
+    # Dates are sent as 'YYYY-MM-DD' strings, the same as in the JSON responses
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__} to MessagePack")
+
+def encode_msgpack(data) -> bytes:
+    return msgpack.packb(data, default=msgpack_default)
+
+def rows_to_frame(data) -> pd.DataFrame:
+    # Lists of row dicts become one column per key (rows that lack a key get nulls)
+    # {ticker: rows} becomes a single frame with a leading ticker column
+    if isinstance(data, dict):
+        frames = [pd.DataFrame(rows).assign(ticker=ticker) for ticker, rows in data.items() if rows]
+        if not frames:
+            return pd.DataFrame(columns=['ticker'])
+        frame = pd.concat(frames, ignore_index=True)
+        return frame[['ticker'] + [col for col in frame.columns if col != 'ticker']]
+    return pd.DataFrame(data)
+
+def encode_arrow(data) -> bytes:
+    table = pa.Table.from_pandas(rows_to_frame(data), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def encode_data(data, fmt) -> bytes:
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(row, default=str) + '\n' for row in data).encode()
+    if fmt == 'arrow':
+        return encode_arrow(data)
+    if fmt == 'msgpack':
+        return encode_msgpack(data)
+    raise ValueError(f"Unsupported binary format {fmt}")
+
+def price_arrow_schema(fields):
+    return pa.schema([('date', pa.date32())] + [(field, pa.int64() if field == 'volume' else pa.float64()) for field in fields])
+
+def drain(buffer) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+async def stream_arrow_batches(chunks, schema):
+    # Writes an Arrow IPC stream with one record batch per chunk of row dicts, so the response starts before the query ends
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, schema) as writer:
+        yield drain(buffer)
+        async for chunk in chunks:
+            writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=schema))
+            yield drain(buffer)
+    # Closing the writer appends the end-of-stream marker
+    yield drain(buffer)
+
+async def stream_msgpack_rows(chunks):
+    # MessagePack arrays carry their length up front, so streamed rows are collected and packed as one array
+    rows = []
+    async for chunk in chunks:
+        rows.extend(chunk)
+    yield await run_in_threadpool(encode_msgpack, rows)
+
+# Media types worth compressing, Arrow IPC is left alone since its buffers are already compact binary
+COMPRESSIBLE_MEDIA_TYPES = ['application/json', 'application/x-ndjson', 'application/msgpack']
+
+def choose_encoding(accept_encoding):
+    # Prefers brotli over gzip, an encoding listed with q=0 is refused
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, *params = [item.strip().lower() for item in part.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    for coding in ['br', 'gzip']:
+        if coding == 'br' and brotli is None:
+            continue
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+class GzipCompressor:
+    def __init__(self, level=6):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, more_body) -> bytes:
+        # A sync flush after each streamed chunk lets clients decode the rows that have arrived so far
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+class BrotliCompressor:
+    def __init__(self, quality=5):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, more_body) -> bytes:
+        return self.compressor.process(data) + (self.compressor.flush() if more_body else self.compressor.finish())
+
+class CompressionMiddleware:
+    # ASGI middleware that compresses JSON, NDJSON and MessagePack responses with brotli (when installed) or gzip
+    # Streaming responses are compressed chunk by chunk, bodies over thread_minimum_size are compressed off the event loop
+    # Compressed responses get a weak ETag since their bytes differ from the uncompressed representation
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=5, thread_minimum_size=256 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.thread_minimum_size = thread_minimum_size
+
+    def new_compressor(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+    async def compress(self, compressor, body, more_body) -> bytes:
+        if len(body) >= self.thread_minimum_size:
+            return await run_in_threadpool(compressor.compress, body, more_body)
+        return compressor.compress(body, more_body)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor
+            if message['type'] == 'http.response.start':
+                # Hold the headers back until the first body chunk shows whether compressing is worthwhile
+                start_message = message
+                return
+            if message['type'] != 'http.response.body':
+                if start_message is not None:
+                    await send(start_message)
+                    start_message = None
+                await send(message)
+                return
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if start_message is not None:
+                headers = MutableHeaders(raw=start_message['headers'])
+                media_type = headers.get('content-type', '').partition(';')[0].strip().lower()
+                if media_type in COMPRESSIBLE_MEDIA_TYPES:
+                    headers.add_vary_header('Accept-Encoding')
+                    if start_message['status'] == 200 and 'content-encoding' not in headers and (more_body or len(body) >= self.minimum_size):
+                        compressor = self.new_compressor(encoding)
+                        body = await self.compress(compressor, body, more_body)
+                        headers['Content-Encoding'] = encoding
+                        if more_body:
+                            del headers['Content-Length']
+                        else:
+                            headers['Content-Length'] = str(len(body))
+                        if 'etag' in headers and not headers['etag'].startswith('W/'):
+                            headers['ETag'] = 'W/' + headers['etag']
+                        message = dict(message, body=body)
+                await send(start_message)
+                start_message = None
+            elif compressor is not None:
+                message = dict(message, body=await self.compress(compressor, body, more_body))
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,54 @@
+# Rolling-window and exponentially weighted factor betas
+# Both keep running sums of X'X and X'y over the dates, so each date's betas cost one k x k solve
+# (O(T * k^2) for the whole series) instead of refitting the regression on every window
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from batch_regression import solve_normal_equations
+
+def regression_moments(X, y, add_constant=True):
+    # Per-date contributions to X'X (dates x k x k) and X'y (dates x k), zero on dates where y or a regressor is missing
+    # Returns (regressors, xx, xy, valid)
+    regressors = (['const'] if add_constant else []) + list(X.columns)
+    x = X.to_numpy(dtype=float)
+    if add_constant:
+        x = np.column_stack([np.ones(len(x)), x])
+    values = y.reindex(X.index).to_numpy(dtype=float)
+    valid = ~np.isnan(values) & ~np.isnan(x).any(axis=1)
+    x = np.where(valid[:, None], x, 0.0)
+    values = np.where(valid, values, 0.0)
+    return regressors, x[:, :, None] * x[:, None, :], x * values[:, None], valid
+
+def betas_frame(index, regressors, gram, moments, usable) -> pd.DataFrame:
+    coefficients, _, solvable = solve_normal_equations(gram, moments)
+    coefficients[~(usable & solvable)] = np.nan
+    return pd.DataFrame(coefficients, index=index, columns=regressors)
+
+def rolling_betas(X, y, window=252, min_periods=None, add_constant=True) -> pd.DataFrame:
+    # OLS betas of y on X over the trailing `window` dates ending at every date, the same as refitting
+    # OLS(y, add_constant(X)) on each window's rows with missing values dropped
+    # Dates whose window has fewer than min_periods (default window) complete observations are NaN, so with the default
+    # a single incomplete date blanks the `window` dates whose windows contain it, drop incomplete dates first
+    # (as CAPMModel.rolling_betas does) or pass a lower min_periods to fit the windows around gaps
+    min_periods = window if min_periods is None else min_periods
+    regressors, xx, xy, valid = regression_moments(X, y, add_constant)
+    # Window sums are differences of cumulative sums, prefixed with a zero row so window t is cumulative[t + 1] - cumulative[t + 1 - window]
+    def window_sums(values):
+        cumulative = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+        ends = np.arange(1, len(values) + 1)
+        return cumulative[ends] - cumulative[np.maximum(ends - window, 0)]
+    counts = window_sums(valid.astype(float))
+    usable = counts >= max(min_periods, len(regressors) + 1)
+    return betas_frame(X.index, regressors, window_sums(xx), window_sums(xy), usable)
+
+def ewm_betas(X, y, halflife=63, min_periods=None, add_constant=True) -> pd.DataFrame:
+    # Exponentially weighted least squares betas at every date, observations lose half their weight every `halflife` dates
+    # The weighted sums follow S_t = decay * S_t-1 + x_t x_t', run for every element at once as a first order linear filter
+    # Dates with fewer than min_periods (default halflife) complete observations so far are NaN
+    min_periods = halflife if min_periods is None else min_periods
+    regressors, xx, xy, valid = regression_moments(X, y, add_constant)
+    decay = 0.5 ** (1.0 / halflife)
+    gram = lfilter([1.0], [1.0, -decay], xx, axis=0)
+    moments = lfilter([1.0], [1.0, -decay], xy, axis=0)
+    usable = np.cumsum(valid) >= max(min_periods, len(regressors) + 1)
+    return betas_frame(X.index, regressors, gram, moments, usable)
@@ -0,0 +1,90 @@
+# Script to benchmark batch_ols against fitting one statsmodels OLS per ticker, and check that both give the same estimates.
+# By default the universe's daily excess returns are regressed on the stored factor_returns, with the equal-weighted
+# universe return standing in for the market so no market data has to be downloaded. --synthetic N uses generated data.
+# usage: python benchmark_batch_regression.py [--years 5] [--factors Market_Excess SMB HML RMW CMA] [--synthetic 3000] [--days 2520]
+
+import sys
+import time
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+from statsmodels.api import OLS, add_constant
+
+sys.path.append("..")
+from batch_regression import batch_ols
+
+def per_ticker_ols(X, Y) -> dict:
+    """Fit one statsmodels OLS per ticker on its dropna'd data, the way CAPMModel.calculate_regression does."""
+    fits = {}
+    for ticker in Y.columns:
+        data = X.assign(Asset_Excess=Y[ticker]).dropna()
+        if len(data) <= X.shape[1] + 1:
+            continue
+        fits[ticker] = OLS(data['Asset_Excess'], add_constant(data[list(X.columns)], has_constant='add')).fit()
+    return fits
+
+def database_inputs(years, factors):
+    """Build the regressors from stored factor returns and the (dates x tickers) excess returns of the universe."""
+    from db_interface import DBInterface
+    db_interface = DBInterface()
+    end_date = datetime.datetime.now()
+    start_date = end_date - datetime.timedelta(days=365 * years)
+    prices = db_interface.export_price_panel(db_interface.all_tickers, start_date=start_date, end_date=end_date, field='close')
+    returns = prices.ffill().pct_change(fill_method=None).where(prices.notna())
+    X = db_interface.query_factor_returns(start_date=start_date, end_date=end_date)
+    if X.empty:
+        raise Exception("No stored factor returns, run generate_factor_returns.py first")
+    X['Market_Excess'] = returns.mean(axis=1)
+    return X[factors].dropna(), returns
+
+def synthetic_inputs(num_tickers, num_days, factors, seed=0):
+    """Generate factor returns and asset returns with staggered listings and scattered missing days."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2000-01-03', periods=num_days)
+    X = pd.DataFrame(rng.normal(0, 0.01, (num_days, len(factors))), index=dates, columns=factors)
+    betas = rng.normal(0.5, 0.5, (len(factors), num_tickers))
+    Y = pd.DataFrame(X.to_numpy() @ betas + rng.normal(0, 0.02, (num_days, num_tickers)), index=dates, columns=[f"T{i:05d}" for i in range(num_tickers)])
+    # A quarter of the tickers list part way through and a few days are missing everywhere
+    listing = rng.integers(0, num_days // 2, num_tickers) * (rng.random(num_tickers) < 0.25)
+    mask = np.arange(num_days)[:, None] < listing[None, :]
+    mask |= rng.random((num_days, num_tickers)) < 0.001
+    return X, Y.mask(mask)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched OLS against per-ticker statsmodels fits")
+    parser.add_argument('--years', type=int, default=5, help="years of history to regress on (database mode)")
+    parser.add_argument('--factors', nargs='+', default=['Market_Excess', 'SMB', 'HML', 'RMW', 'CMA'], help="regressors")
+    parser.add_argument('--synthetic', type=int, help="number of generated tickers instead of the database")
+    parser.add_argument('--days', type=int, default=2520, help="number of generated days (synthetic mode)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        X, Y = synthetic_inputs(args.synthetic, args.days, args.factors)
+    else:
+        X, Y = database_inputs(args.years, args.factors)
+    print(f"{Y.shape[1]} tickers, {len(X)} days, {len(args.factors)} factors")
+
+    start = time.perf_counter()
+    fits = per_ticker_ols(X, Y)
+    per_ticker_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = batch_ols(X, Y)
+    batch_time = time.perf_counter() - start
+
+    worst = {}
+    for name, attribute in [('params', 'params'), ('bse', 'bse'), ('tvalues', 'tvalues'), ('pvalues', 'pvalues')]:
+        differences = [np.max(np.abs(batch[name].loc[ticker].to_numpy() - getattr(fit, attribute).to_numpy())) for ticker, fit in fits.items()]
+        worst[name] = max(differences) if differences else 0.0
+    missing = [ticker for ticker in fits if batch['params'].loc[ticker].isna().any()]
+
+    print(f"Per-ticker statsmodels: {per_ticker_time:.3f}s ({len(fits)} fits)")
+    print(f"Batched: {batch_time:.3f}s ({per_ticker_time / batch_time:.1f}x faster)")
+    print("Largest absolute differences: " + ", ".join(f"{name} {value:.2e}" for name, value in worst.items()))
+    if missing:
+        print(f"Tickers fitted by statsmodels but not by batch_ols: {missing}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# Script to benchmark the API server's sync (psycopg2 on the threadpool) and async (asyncpg) data paths side by side.
+# Each mode is started as its own single uvicorn worker and hit with the same concurrent request mix.
+# usage: python benchmark_db_modes.py [--requests 2000] [--concurrency 200] [--modes sync async]
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import httpx
+from dotenv import load_dotenv
+
+sys.path.append("..")
+from db_interface import DBInterface
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def build_request_paths(tickers, num_requests):
+    """Build a reproducible mix of statement, price history and model requests."""
+    rng = random.Random(0)
+    templates = [
+        '/api/balance_sheet/q/{ticker}',
+        '/api/income/q/{ticker}',
+        '/api/cash_flow/a/{ticker}',
+        '/api/price_history/1d/{ticker}',
+        '/api/multifactor_model/10y/{ticker}/5',
+    ]
+    return [rng.choice(templates).format(ticker=rng.choice(tickers)) for _ in range(num_requests)]
+
+def start_server(mode, port):
+    """Start a single uvicorn worker serving api_server in the given mode."""
+    env = dict(os.environ, KOCOON_DB_MODE=mode)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'api_server:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+
+async def wait_until_ready(base_url, timeout=60):
+    """Poll the tickers endpoint until the server answers."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get('/api/tickers')
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"server at {base_url} did not start within {timeout} seconds")
+
+async def run_load(base_url, paths, concurrency):
+    """Issue every request with at most `concurrency` in flight and return per-request latencies."""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        async def fetch(path):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch(path) for path in paths))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def benchmark_mode(mode, port, paths, concurrency):
+    server = start_server(mode, port)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        # Warm up the connection pools before measuring
+        asyncio.run(run_load(base_url, paths[:concurrency], concurrency))
+        latencies, errors, elapsed = asyncio.run(run_load(base_url, paths, concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        'mode': mode,
+        'requests': len(paths),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync and async API data paths under concurrent load")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'], choices=['sync', 'async'])
+    parser.add_argument('--port', type=int, default=5091)
+    args = parser.parse_args()
+
+    load_dotenv()
+    tickers = DBInterface(minconn=0, maxconn=1).get_all_tickers()
+    paths = build_request_paths(tickers, args.requests)
+
+    results = [benchmark_mode(mode, args.port, paths, args.concurrency) for mode in args.modes]
+    print(f"{args.requests} requests, {args.concurrency} in flight, one uvicorn worker per mode")
+    print(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for r in results:
+        print(f"{r['mode']:<8}{r['throughput']:>10.1f}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['p99']:>10.1f}{r['errors']:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Script to convert the TEXT columns of existing "{ticker}_{period}_{report}" statement tables to typed columns in place.
+# asOfDate becomes DATE and every line item whose values are all numeric becomes DOUBLE PRECISION,
+# values that are not plain numbers ('NaN', '', ...) become NULL. Identifier columns and any non-numeric column stay TEXT.
+# Each table is rewritten by a single ALTER TABLE and committed on its own, so the script can be re-run after an interruption.
+
+import sys
+import argparse
+from psycopg2 import sql
+
+sys.path.append("..")
+from db_interface import FUNDAMENTAL_REPORT_TYPES
+from stock_data_script import get_database_connection, get_all_tickers
+from migrate_fundamentals import NUMERIC_PATTERN
+from migrate_data import DATE_COLUMNS, TEXT_COLUMNS
+
+def get_text_columns(conn, table_name) -> list:
+    """Return the TEXT columns of a table, an empty list if the table doesn't exist."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s AND data_type = 'text'
+        ORDER BY ordinal_position;
+    """, [table_name])
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return columns
+
+def find_numeric_columns(conn, table_name, columns) -> list:
+    """Return the columns whose values are all numbers or missing, checked with one scan of the table."""
+    if not columns:
+        return []
+    cursor = conn.cursor()
+    checks = [
+        sql.SQL("bool_and({col} IS NULL OR {col} ~ %s OR {col} IN ('', 'NaN', 'nan'))").format(col=sql.Identifier(col))
+        for col in columns
+    ]
+    cursor.execute(sql.SQL("SELECT {} FROM {};").format(sql.SQL(', ').join(checks), sql.Identifier(table_name)),
+                   [NUMERIC_PATTERN] * len(columns))
+    result = cursor.fetchone()
+    cursor.close()
+    # bool_and is NULL for an empty table, its columns are left as they are
+    return [col for col, numeric in zip(columns, result) if numeric]
+
+def convert_table(conn, table_name, dry_run=False) -> list:
+    """Convert the date and numeric TEXT columns of one statement table, returning the (column, type) pairs changed."""
+    text_columns = get_text_columns(conn, table_name)
+    line_items = [col for col in text_columns if col not in DATE_COLUMNS + TEXT_COLUMNS]
+    conversions = [(col, 'DATE') for col in text_columns if col in DATE_COLUMNS]
+    conversions += [(col, 'DOUBLE PRECISION') for col in find_numeric_columns(conn, table_name, line_items)]
+    if not conversions or dry_run:
+        return conversions
+
+    alterations = []
+    for col, column_type in conversions:
+        if column_type == 'DATE':
+            using = sql.SQL("NULLIF({col}, '')::date").format(col=sql.Identifier(col))
+        else:
+            using = sql.SQL("CASE WHEN {col} ~ {pattern} THEN {col}::double precision END").format(
+                col=sql.Identifier(col), pattern=sql.Literal(NUMERIC_PATTERN))
+        alterations.append(sql.SQL("ALTER COLUMN {col} TYPE {type} USING {using}").format(
+            col=sql.Identifier(col), type=sql.SQL(column_type), using=using))
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("ALTER TABLE {} {};").format(sql.Identifier(table_name), sql.SQL(', ').join(alterations)))
+    # Lets PostgreSQL use an index on asOfDate for date filters
+    if any(column_type == 'DATE' for _, column_type in conversions):
+        cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (\"asOfDate\");").format(
+            sql.Identifier(f"{table_name}_asofdate_idx"), sql.Identifier(table_name)))
+    cursor.close()
+    return conversions
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert TEXT columns of legacy statement tables to DATE / DOUBLE PRECISION in place")
+    parser.add_argument('tickers', nargs='*', help="tickers to convert (default: every ticker in financial_master)")
+    parser.add_argument('--dry-run', action='store_true', help="only report the columns that would be converted")
+    args = parser.parse_args()
+
+    conn = get_database_connection()
+    tickers = args.tickers or get_all_tickers(conn)
+
+    for ticker in tickers:
+        for period_type in ['q', 'a']:
+            for report_type in FUNDAMENTAL_REPORT_TYPES:
+                table_name = f"{ticker}_{period_type}_{report_type}"
+                try:
+                    conversions = convert_table(conn, table_name, dry_run=args.dry_run)
+                    conn.commit()
+                except Exception as e:
+                    print(f"Failed to convert {table_name}: {e}")
+                    conn.rollback()
+                    continue
+                if conversions:
+                    dates = sum(1 for _, column_type in conversions if column_type == 'DATE')
+                    action = "Would convert" if args.dry_run else "Converted"
+                    print(f"{action} {table_name}: {dates} date and {len(conversions) - dates} numeric columns")
+
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# Script to compute the daily SMB, HML, RMW, CMA and MOM factor returns of the whole universe and store them in factor_returns.
+# The factors don't depend on the ticker being modelled, so this runs once a day (before generate_multifactor_models.py)
+# and every per-ticker model just loads the stored series.
+# usage: python generate_factor_returns.py [--years 10] [--start 2015-01-01] [--end 2025-01-01]
+
+import sys
+import time
+import argparse
+import datetime
+from dotenv import load_dotenv
+
+sys.path.append("..")
+from db_interface import DBInterface
+from factor_engine import compute_factor_returns
+
+def generate_factor_returns(db_interface, start_date, end_date) -> int:
+    """Compute the universe factor returns between the dates and upsert them, returning the number of values stored."""
+    print(f"Computing factor returns for {len(db_interface.all_tickers)} tickers from {start_date.date()} to {end_date.date()}")
+    factor_returns = compute_factor_returns(db_interface, start_date, end_date)
+    stored = db_interface.push_factor_returns(factor_returns)
+    print(f"Stored {stored} factor returns over {len(factor_returns)} days")
+    return stored
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute and store the daily universe factor returns")
+    parser.add_argument('--years', type=int, default=10, help="years of history to compute, ending at --end (default 10)")
+    parser.add_argument('--start', help="first date (YYYY-MM-DD), overrides --years")
+    parser.add_argument('--end', help="last date (YYYY-MM-DD, default today)")
+    args = parser.parse_args()
+
+    end_date = datetime.datetime.strptime(args.end, '%Y-%m-%d') if args.end else datetime.datetime.now()
+    if args.start:
+        start_date = datetime.datetime.strptime(args.start, '%Y-%m-%d')
+    else:
+        start_date = end_date - datetime.timedelta(days=365 * args.years)
+
+    db_interface = DBInterface()
+    start = time.time()
+    generate_factor_returns(db_interface, start_date, end_date)
+    print(f"Time elapsed: {round(time.time() - start, 2)} seconds")
+
+if __name__ == '__main__':
+    load_dotenv()
+    main()
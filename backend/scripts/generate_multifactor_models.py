@@ -1,51 +1,255 @@
+# Script to fit the five and six factor models of every ticker over the 5 and 10 year windows and push them to the database
+# --incremental updates the models from the sufficient statistics stored by the previous run (model_statistics), so a
+# nightly refresh only reads the days since then, --rebuild recomputes those statistics from the whole windows
+# --workers fits the per-ticker models on a pool of processes sharing one copy of the price panel (parallel_models.py)
+# Every fit is recorded in the model_runs ledger as it finishes: --resume continues the latest run, skipping the fits it
+# completed, and --retry-failed only redoes the fits of the latest run that failed
+# --enqueue starts a run whose (ticker, window) jobs go to the model_jobs queue instead, any number of --worker processes
+# (on this machine or others using the same database) then claim and fit them, see model_jobs.py
+# usage: python generate_multifactor_models.py [--per-ticker] [--incremental [--rebuild] | --workers [N]] [--resume | --retry-failed]
+#        python generate_multifactor_models.py --enqueue [--retry-failed]
+#        python generate_multifactor_models.py --worker [--run-id N] [--per-ticker] [--incremental [--rebuild]] [--batch-size 16] [--lease 300]
 import sys
 import os
+import time
+import argparse
 import datetime
 from dotenv import load_dotenv
 
 sys.path.append("..")
 from db_interface import DBInterface
 from capm_model import CAPMModel
+from parallel_models import parallel_multifactor_models
+from model_jobs import run_model_jobs
+from generate_factor_returns import generate_factor_returns
 
-# TODO Implement a multiprocessing version of this script to speed up the process as it is currently very slow
-def generate_multifactor_models(ticker_list=None):
+# Days of factor returns recomputed before the last stored one in incremental mode, so the latest month end formation is included
+FACTOR_REFRESH_DAYS = 31
+YEARS = [10, 5]
+MARKET_INDEX = "^GSPC" # S&P 500 index
+MODEL_NAMES = ['Fama-French Five-Factor', 'Fama-French Six-Factor']
+
+def select_run(db_interface, resume=False, retry_failed=False):
+    # Returns (run_id, statuses): a new run, or the latest run and its ledger statuses when resuming or retrying it
+    if resume or retry_failed:
+        run_id = db_interface.latest_model_run()
+        if run_id is not None:
+            print(f"Continuing run {run_id}")
+            return run_id, db_interface.query_model_run(run_id)
+        print("No previous run to continue, starting a new one")
+    run_id = db_interface.start_model_run()
+    print(f"Starting run {run_id}")
+    return run_id, {}
+
+def refresh_factor_returns(db_interface, incremental=False, rebuild=False):
+    # The factors only depend on the universe, so they are computed once for the longest window and every model loads them
+    now = datetime.datetime.now()
+    factor_start = now - datetime.timedelta(days=365 * max(YEARS))
+    if incremental and not rebuild:
+        # Only the factor returns of the last few days have to be computed
+        stored = db_interface.query_factor_returns(start_date=factor_start).dropna(how='all').index
+        if not stored.empty and stored.min() - factor_start <= datetime.timedelta(days=7):
+            factor_start = stored.max().to_pydatetime() - datetime.timedelta(days=FACTOR_REFRESH_DAYS)
+    generate_factor_returns(db_interface, factor_start, now)
+
+def fit_batch(model, db_interface, run_id, tickers, year, model_name, start_date, end_date, incremental=False, rebuild=False) -> dict:
+    # Fits one model over one window for every ticker at once, pushes the results and records them in the ledger
+    # Returns {ticker: error or None}
+    started = time.time()
+    error = "Not enough data for the regression"
+    try:
+        if incremental:
+            results = model.incremental_multifactor_models(tickers, MARKET_INDEX, year, model_name=model_name, end_date=end_date, rebuild=rebuild)
+        else:
+            results = model.multifactor_models(tickers, MARKET_INDEX, start_date, end_date, model_name=model_name)
+    except Exception as e:
+        print(f"Failed to generate {model_name} models for the {year} year window")
+        print(e)
+        results = {}
+        error = str(e)
+    for result in results.values():
+        db_interface.push_multifactor_model_summary(result)
+    # The tickers are fitted together and have no time of their own, so their ledger entries leave the duration empty
+    db_interface.record_model_runs(run_id, [(ticker, year, model_name, 'completed', None, None) if ticker in results else
+                                            (ticker, year, model_name, 'failed', None, error) for ticker in tickers])
+    print(f"{model_name} models pushed for {len(results)} of {len(tickers)} tickers ({year} year window) in {round(time.time() - started, 2)} seconds")
+    return {ticker: None if ticker in results else error for ticker in tickers}
+
+def fit_ticker(model, db_interface, run_id, ticker, year, model_names, start_date, end_date):
+    # Fits the models of one ticker over one window with the per-ticker CAPMModel functions, pushes the results and records
+    # them in the ledger, returns the error of the last model that failed (None when none did)
+    model_functions = {'Fama-French Five-Factor': model.five_factor_model, 'Fama-French Six-Factor': model.six_factor_model}
+    entries = []
+    error = None
+    for model_name in model_names:
+        started = time.time()
+        try:
+            result = model_functions[model_name](ticker, MARKET_INDEX, start_date, end_date)
+            # Push the results to the database
+            if result:
+                db_interface.push_multifactor_model_summary(result)
+            entries.append((ticker, year, model_name, 'completed' if result else 'skipped', time.time() - started, None))
+        except Exception as e:
+            print(f"Failed to generate {model_name} model for {ticker}")
+            print(e)
+            error = str(e)
+            entries.append((ticker, year, model_name, 'failed', time.time() - started, error))
+    db_interface.record_model_runs(run_id, entries)
+    return error
+
+def print_failures(db_interface, run_id):
+    failed_tickers = list(dict.fromkeys(ticker for (ticker, _, _), status in db_interface.query_model_run(run_id).items() if status == 'failed'))
+    if len(failed_tickers) > 0:
+        print(f"Failed to generate multifactor models for the following tickers: {failed_tickers}")
+        print(f"Rerun them with --retry-failed (run {run_id})")
+
+def generate_multifactor_models(ticker_list=None, batch=True, incremental=False, rebuild=False, workers=None, resume=False, retry_failed=False):
     # Generate multifactor models for all tickers and push them to the database
+    # With batch=True every ticker is regressed at once per model and window (CAPMModel.multifactor_models),
+    # otherwise the models are fitted one ticker at a time
+    # With incremental=True the batched models are updated from the stored statistics (CAPMModel.incremental_multifactor_models),
+    # rebuild=True recomputes the statistics from the whole windows first
+    # With workers set (and incremental=False) the per-ticker fits of every window run on that many processes
+    # resume=True continues the latest run without its completed fits, retry_failed=True only redoes its failed ones
     db_interface = DBInterface()
 
     if not ticker_list:
         ticker_list = db_interface.get_all_tickers()
     tickers_complete = 0
-    failed_tickers = []
     tickers_total = len(ticker_list)
-    years = [10, 5]
-    market_index = "^GSPC" # S&P 500 index
     model = CAPMModel(fred_api_key=os.getenv('FRED_API_KEY'), db_interface=db_interface)
+    run_id, statuses = select_run(db_interface, resume, retry_failed)
+
+    def pending(ticker, year, model_name):
+        # Whether the fit still has to be done in this run
+        status = statuses.get((ticker, year, model_name))
+        if retry_failed:
+            return status == 'failed'
+        return status not in ('completed', 'skipped')
+
+    # A continued run already computed the factor returns before its first fit
+    if not statuses:
+        refresh_factor_returns(db_interface, incremental, rebuild)
     print(f"Generating multifactor models for {tickers_total} tickers")
-    for year in years:
-        end_date = datetime.datetime.now()
-        start_date = end_date - datetime.timedelta(days=365 * year)
-        for ticker in ticker_list:
-            # Generate the five and six factor models
-            try:
-                five_factor_result = model.five_factor_model(ticker, market_index, start_date, end_date)
-                six_factor_result = model.six_factor_model(ticker, market_index, start_date, end_date)
-
-                # Push the results to the database
-                for result in [five_factor_result, six_factor_result]:
-                    if result:
-                        db_interface.push_multifactor_model_summary(result)
-            except Exception as e:
-                print(f"Failed to generate multifactor model for {ticker}")
-                print(e)
-                failed_tickers.append(ticker)
-
-            tickers_complete += 1
-            print(f"{round((tickers_complete / tickers_total) * 100, 2)}% complete")
-    if len(failed_tickers) > 0:
-        print(f"Failed to generate multifactor models for the following tickers: {failed_tickers}")
+    now = datetime.datetime.now()
+    if workers and not incremental:
+        # Every window and model is fitted in one pass over the process pool so the panel is only loaded and shared once
+        windows = [(now - datetime.timedelta(days=365 * year), now) for year in YEARS]
+        skip = {(ticker, window, model_name) for ticker in ticker_list for window, year in enumerate(YEARS) for model_name in MODEL_NAMES
+                if not pending(ticker, year, model_name)}
+        pushed = 0
+        for outcomes in parallel_multifactor_models(model, ticker_list, MARKET_INDEX, windows, MODEL_NAMES, workers=workers, skip=skip):
+            entries = []
+            for window, model_name, ticker, result, error, duration in outcomes:
+                if error is not None:
+                    print(f"Failed to generate {model_name} model for {ticker} ({YEARS[window]} year window)")
+                    print(error)
+                    entries.append((ticker, YEARS[window], model_name, 'failed', duration, error))
+                elif result is None:
+                    entries.append((ticker, YEARS[window], model_name, 'skipped', duration, None))
+                else:
+                    db_interface.push_multifactor_model_summary(result)
+                    pushed += 1
+                    entries.append((ticker, YEARS[window], model_name, 'completed', duration, None))
+            db_interface.record_model_runs(run_id, entries)
+        print(f"{pushed} models pushed for {tickers_total} tickers")
+    else:
+        for year in YEARS:
+            end_date = datetime.datetime.now()
+            start_date = end_date - datetime.timedelta(days=365 * year)
+            if batch:
+                for model_name in MODEL_NAMES:
+                    tickers = [ticker for ticker in ticker_list if pending(ticker, year, model_name)]
+                    if tickers:
+                        fit_batch(model, db_interface, run_id, tickers, year, model_name, start_date, end_date, incremental, rebuild)
+            else:
+                for ticker in ticker_list:
+                    # Generate the five and six factor models
+                    model_names = [model_name for model_name in MODEL_NAMES if pending(ticker, year, model_name)]
+                    if model_names:
+                        fit_ticker(model, db_interface, run_id, ticker, year, model_names, start_date, end_date)
+                    tickers_complete += 1
+                    print(f"{round((tickers_complete / tickers_total) * 100, 2)}% complete")
+    print_failures(db_interface, run_id)
+
+def enqueue_multifactor_models(ticker_list=None, retry_failed=False):
+    # Starts a run whose (ticker, window) jobs are fitted by --worker processes, returns its id
+    # With retry_failed=True the failed jobs of the latest queued run are queued again instead
+    db_interface = DBInterface()
+    if retry_failed:
+        run_id = db_interface.latest_model_job_run()
+        if run_id is not None:
+            print(f"Queued {db_interface.requeue_failed_model_jobs(run_id)} failed jobs of run {run_id} again")
+            return run_id
+        print("No previous queued run, starting a new one")
+    if not ticker_list:
+        ticker_list = db_interface.get_all_tickers()
+    run_id = db_interface.start_model_run()
+    refresh_factor_returns(db_interface)
+    # Every job of the run uses the same window end whenever a worker gets to it
+    queued = db_interface.enqueue_model_jobs(run_id, [(ticker, year) for year in YEARS for ticker in ticker_list], datetime.datetime.now())
+    print(f"Queued {queued} jobs for run {run_id}")
+    return run_id
+
+def work_multifactor_models(run_id=None, batch=True, incremental=False, rebuild=False, batch_size=16, lease_seconds=300):
+    # Claims and fits jobs of a queued run (default the latest) until it is done, several workers can run at once
+    db_interface = DBInterface()
+    run_id = run_id or db_interface.latest_model_job_run()
+    if run_id is None:
+        print("No queued run, start one with --enqueue")
+        return
+    model = CAPMModel(fred_api_key=os.getenv('FRED_API_KEY'), db_interface=db_interface)
+
+    def process_jobs(jobs):
+        errors = {}
+        windows = {}
+        for ticker, year, end_date in jobs:
+            windows.setdefault((year, end_date), []).append(ticker)
+        for (year, end_date), tickers in windows.items():
+            # The window ends after the last close of the day the run was queued
+            end_date = datetime.datetime.combine(end_date, datetime.time.max)
+            start_date = end_date - datetime.timedelta(days=365 * year)
+            if batch:
+                for model_name in MODEL_NAMES:
+                    for ticker, error in fit_batch(model, db_interface, run_id, tickers, year, model_name, start_date, end_date, incremental, rebuild).items():
+                        errors[(ticker, year)] = errors.get((ticker, year)) or error
+            else:
+                for ticker in tickers:
+                    errors[(ticker, year)] = fit_ticker(model, db_interface, run_id, ticker, year, MODEL_NAMES, start_date, end_date)
+        return errors
+
+    print(f"Working on run {run_id}")
+    finished = run_model_jobs(db_interface, run_id, process_jobs, batch_size=batch_size, lease_seconds=lease_seconds)
+    print(f"Finished jobs: {finished}, queue: {db_interface.query_model_job_counts(run_id)}")
+    print_failures(db_interface, run_id)
+
 if __name__ == '__main__':
     load_dotenv()
-    import time
+    parser = argparse.ArgumentParser(description="Fit the multifactor models of every ticker and push them to the database")
+    parser.add_argument('--per-ticker', action='store_true', help="fit the models one ticker at a time instead of batched")
+    parser.add_argument('--incremental', action='store_true', help="update the models from the statistics stored by the previous run")
+    parser.add_argument('--rebuild', action='store_true', help="with --incremental, recompute the stored statistics from the whole windows")
+    parser.add_argument('--workers', type=int, nargs='?', const=os.cpu_count(), help="fit the per-ticker models on N processes (default all cores)")
+    continuation = parser.add_mutually_exclusive_group()
+    continuation.add_argument('--resume', action='store_true', help="continue the latest run, skipping the fits it completed")
+    continuation.add_argument('--retry-failed', action='store_true', help="redo the fits of the latest run that failed")
+    queue = parser.add_mutually_exclusive_group()
+    queue.add_argument('--enqueue', action='store_true', help="queue the jobs of a new run for --worker processes")
+    queue.add_argument('--worker', action='store_true', help="fit queued jobs until the run is done")
+    parser.add_argument('--run-id', type=int, help="queued run to work on (default the latest)")
+    parser.add_argument('--batch-size', type=int, default=16, help="jobs claimed at a time by a worker")
+    parser.add_argument('--lease', type=int, default=300, help="seconds a claimed job stays leased without a heartbeat")
+    args = parser.parse_args()
+    # The incremental models are batched from the stored statistics, there are no per-ticker fits for the workers
+    if args.workers and args.incremental:
+        parser.error("--workers can't be combined with --incremental")
     start = time.time()
-    generate_multifactor_models()
-    print(f"Time elapsed: {round(time.time() - start, 2) / 60 / 60} hours")
\ No newline at end of file
+    if args.enqueue:
+        enqueue_multifactor_models(retry_failed=args.retry_failed)
+    elif args.worker:
+        work_multifactor_models(run_id=args.run_id, batch=not args.per_ticker, incremental=args.incremental, rebuild=args.rebuild,
+                                batch_size=args.batch_size, lease_seconds=args.lease)
+    else:
+        generate_multifactor_models(batch=not args.per_ticker, incremental=args.incremental, rebuild=args.rebuild, workers=args.workers,
+                                    resume=args.resume, retry_failed=args.retry_failed)
+    print(f"Time elapsed: {round(time.time() - start, 2) / 60 / 60} hours")
@@ -1,9 +1,16 @@
 # This script migrates the financial data from the CSV files into our PostgreSQL database.
 
-import psycopg2
+import sys
 import os
+import psycopg2
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+# This script is run from the backend directory (where data/ lives), so locate db_interface relative to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from db_interface import create_fundamentals_table, create_data_versions_table, mark_data_changed
 
 def create_master_table(conn):
     """Create a master table to store metadata about each ticker and period."""
@@ -22,31 +29,54 @@ def create_master_table(conn):
     conn.commit()
     cursor.close()
 
-def create_financial_table(table_name, columns, conn):
+# Statement columns with a fixed type, every other column is a line item
+DATE_COLUMNS = ['asOfDate']
+TEXT_COLUMNS = ['symbol', 'periodType', 'currencyCode']
+
+def infer_column_type(column, series) -> str:
+    """Pick the PostgreSQL type of a statement column: DATE for asOfDate, DOUBLE PRECISION for numeric line items, TEXT otherwise."""
+    if column in DATE_COLUMNS:
+        return 'DATE'
+    if column in TEXT_COLUMNS:
+        return 'TEXT'
+    values = series.dropna()
+    if pd.api.types.is_numeric_dtype(series) or pd.to_numeric(values, errors='coerce').notna().all():
+        return 'DOUBLE PRECISION'
+    return 'TEXT'
+
+def to_db_value(value):
+    """Convert a DataFrame cell to a value psycopg2 can adapt, missing values become NULL."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def create_financial_table(table_name, df, conn):
     """Create a table for storing financial data."""
     cursor = conn.cursor()
 
-    # Create the financial data table if it doesn't exist
+    # Create the financial data table if it doesn't exist, with column types inferred from the data
     create_query = f'CREATE TABLE IF NOT EXISTS "{table_name}" ('
-    column_definitions = [f'"{col}" TEXT' for col in columns]  # Default all columns to TEXT
+    column_definitions = [f'"{col}" {infer_column_type(col, df[col])}' for col in df.columns]
     create_query += ', '.join(column_definitions) + ');'
 
     cursor.execute(create_query)
     conn.commit()
     cursor.close()
 
-def add_missing_columns(table_name, columns, conn):
+def add_missing_columns(table_name, df, conn):
     """Add missing columns to the table if they don't exist."""
     cursor = conn.cursor()
 
     # Get existing columns from the table
-    cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}';")
+    cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s;", [table_name])
     existing_columns = {row[0] for row in cursor.fetchall()}
 
     # Identify missing columns and alter the table
-    for column in columns:
+    for column in df.columns:
         if column not in existing_columns:
-            alter_query = f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" TEXT;'
+            alter_query = f'ALTER TABLE "{table_name}" ADD COLUMN "{column}" {infer_column_type(column, df[column])};'
             cursor.execute(alter_query)
     
     conn.commit()
@@ -57,8 +87,8 @@ def insert_financial_data(table_name, df, conn):
     cursor = conn.cursor()
 
     # Ensure table exists and add missing columns if needed
-    create_financial_table(table_name, df.columns, conn)
-    add_missing_columns(table_name, df.columns, conn)
+    create_financial_table(table_name, df, conn)
+    add_missing_columns(table_name, df, conn)
 
     # Generate the insert statement
     columns = ', '.join([f'"{col}"' for col in df.columns])
@@ -71,7 +101,7 @@ def insert_financial_data(table_name, df, conn):
 
     # Insert rows one by one, skipping duplicates
     for _, row in df.iterrows():
-        unique_key_values = tuple(row[col] for col in unique_key_columns)
+        unique_key_values = tuple(to_db_value(row[col]) for col in unique_key_columns)
 
         # Check if the row already exists
         cursor.execute(select_query, unique_key_values)
@@ -80,7 +110,7 @@ def insert_financial_data(table_name, df, conn):
         if not result:
             # Row does not exist, insert it
             insert_query = f'INSERT INTO "{table_name}" ({columns}) VALUES ({values_placeholders});'
-            cursor.execute(insert_query, list(row))
+            cursor.execute(insert_query, [to_db_value(value) for value in row])
 
     conn.commit()
     cursor.close()
@@ -102,46 +132,83 @@ def insert_master_data(ticker, period_type, table_name, conn):
     conn.commit()
     cursor.close()
 
-load_dotenv()
-database_host = os.getenv('DATABASE_HOST')
-database_user = os.getenv('DATABASE_USER')
-database_password = os.getenv('DATABASE_PASSWORD')
-
-# Connect to the database
-conn = psycopg2.connect(
-    host=database_host,
-    database="financials",
-    user=database_user,
-    password=database_password
-)
-
-data_dir = 'data'
-tickers = os.listdir(data_dir)
-
-# Create the master table for managing ticker and period metadata
-create_master_table(conn)
+def insert_fundamentals(ticker, period_type, report_type, df, conn):
+    """Insert a statement DataFrame into the long-format fundamentals table, one row per numeric line item."""
+    cursor = conn.cursor()
+    id_columns = ['asOfDate', 'periodType', 'currencyCode']
+    line_items = df.drop(columns=[col for col in df.columns if col in id_columns + ['symbol']])
+    long_df = pd.concat([df[id_columns], line_items.apply(pd.to_numeric, errors='coerce')], axis=1).melt(
+        id_vars=id_columns, var_name='line_item', value_name='value')
+    # Missing and non-finite values are simply not stored
+    long_df = long_df[np.isfinite(long_df['value'])]
+    long_df = long_df.dropna(subset=['asOfDate', 'periodType'])
+    long_df = long_df.drop_duplicates(subset=['asOfDate', 'periodType', 'line_item'], keep='last')
+
+    values = [
+        (ticker, period_type, report_type, pd.Timestamp(row.asOfDate).date(), row.periodType,
+         None if pd.isna(row.currencyCode) else row.currencyCode, row.line_item, float(row.value))
+        for row in long_df.itertuples(index=False)
+    ]
+    insert_query = """
+    INSERT INTO fundamentals (ticker, period_type, report_type, as_of_date, period_code, currency_code, line_item, value)
+    VALUES %s
+    ON CONFLICT (ticker, report_type, period_type, as_of_date, period_code, line_item) DO UPDATE SET
+        currency_code = EXCLUDED.currency_code,
+        value = EXCLUDED.value;
+    """
+    execute_values(cursor, insert_query, values, page_size=1000)
+    # New data version for the API's ETags, API servers also drop their cached statements for this ticker on commit
+    mark_data_changed(conn, 'fundamentals', ticker)
+    conn.commit()
+    cursor.close()
 
-for ticker in tickers:
-    ticker_dir = os.path.join(data_dir, ticker)
-    
-    # Process both annual 'a' and quarterly 'q' data
-    for period_type in ['a', 'q']:
-        period_dir = os.path.join(ticker_dir, period_type)
+def main():
+    load_dotenv()
+    database_host = os.getenv('DATABASE_HOST')
+    database_user = os.getenv('DATABASE_USER')
+    database_password = os.getenv('DATABASE_PASSWORD')
+
+    # Connect to the database
+    conn = psycopg2.connect(
+        host=database_host,
+        database="financials",
+        user=database_user,
+        password=database_password
+    )
+
+    data_dir = 'data'
+    tickers = os.listdir(data_dir)
+
+    # Create the master table for managing ticker and period metadata
+    create_master_table(conn)
+    # Create the long-format table that DBInterface.query reads statements from
+    create_fundamentals_table(conn)
+    create_data_versions_table(conn)
+
+    for ticker in tickers:
+        ticker_dir = os.path.join(data_dir, ticker)
         
-        if os.path.isdir(period_dir):
-            for filename in os.listdir(period_dir):
-                if filename.endswith('.csv'):
-                    # Generate the table name for this specific financial data
-                    table_name = f"{ticker}_{period_type}_{filename.replace('.csv', '')}"
-                    table_name = table_name.replace('income_statement', 'income')
-                    file_path = os.path.join(period_dir, filename)
-                    df = pd.read_csv(file_path)
-
-                    # Insert metadata into the master table
-                    insert_master_data(ticker, period_type, table_name, conn)
-
-                    # Insert the financial data into the corresponding table
-                    insert_financial_data(table_name, df, conn)
-
-conn.close()
-
+        # Process both annual 'a' and quarterly 'q' data
+        for period_type in ['a', 'q']:
+            period_dir = os.path.join(ticker_dir, period_type)
+            
+            if os.path.isdir(period_dir):
+                for filename in os.listdir(period_dir):
+                    if filename.endswith('.csv'):
+                        # Generate the table name for this specific financial data
+                        report_type = filename.replace('.csv', '').replace('income_statement', 'income')
+                        table_name = f"{ticker}_{period_type}_{report_type}"
+                        file_path = os.path.join(period_dir, filename)
+                        df = pd.read_csv(file_path)
+
+                        # Insert metadata into the master table
+                        insert_master_data(ticker, period_type, table_name, conn)
+
+                        # Insert the financial data into the corresponding table
+                        insert_financial_data(table_name, df, conn)
+                        insert_fundamentals(ticker, period_type, report_type, df, conn)
+
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Script to move the legacy "{ticker}_{period}_{report}" statement tables into the long-format fundamentals table.
+# The unpivot runs inside PostgreSQL, one INSERT ... SELECT per legacy table, so no statement data crosses the wire.
+# The legacy tables are left in place, pass --drop-legacy to drop each one after it has been copied.
+
+import sys
+import argparse
+from psycopg2 import sql
+
+sys.path.append("..")
+from db_interface import FUNDAMENTAL_REPORT_TYPES, create_fundamentals_table, create_data_versions_table, mark_data_changed
+from stock_data_script import get_database_connection, get_all_tickers
+
+# Only plain decimal / scientific notation text is copied, this skips 'NaN', 'inf' and empty strings
+NUMERIC_PATTERN = r'^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$'
+
+def legacy_table_exists(conn, table_name) -> bool:
+    """Check whether a legacy statement table exists."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass(%s);", [f'"{table_name}"'])
+    exists = cursor.fetchone()[0] is not None
+    cursor.close()
+    return exists
+
+def migrate_table(conn, ticker, period_type, report_type) -> int:
+    """Copy one legacy statement table into fundamentals, returning the number of line items written."""
+    table_name = f"{ticker}_{period_type}_{report_type}"
+    if not legacy_table_exists(conn, table_name):
+        return 0
+    cursor = conn.cursor()
+    # to_jsonb turns each legacy row into {column: value}, jsonb_each_text then yields one (line item, value) pair per column
+    insert_query = sql.SQL("""
+        INSERT INTO fundamentals (ticker, period_type, report_type, as_of_date, period_code, currency_code, line_item, value)
+        SELECT DISTINCT ON (as_of_date, period_code, line_item) *
+        FROM (
+            SELECT %s AS ticker, %s AS period_type, %s AS report_type,
+                (legacy.row->>'asOfDate')::date AS as_of_date,
+                legacy.row->>'periodType' AS period_code,
+                legacy.row->>'currencyCode' AS currency_code,
+                item.key AS line_item,
+                item.value::double precision AS value
+            FROM (SELECT to_jsonb(t) AS row FROM {} t) legacy
+            CROSS JOIN LATERAL jsonb_each_text(legacy.row - ARRAY['symbol', 'asOfDate', 'periodType', 'currencyCode']) item
+            WHERE legacy.row->>'asOfDate' IS NOT NULL
+              AND legacy.row->>'periodType' IS NOT NULL
+              AND item.value ~ %s
+        ) items
+        ON CONFLICT (ticker, report_type, period_type, as_of_date, period_code, line_item) DO UPDATE SET
+            currency_code = EXCLUDED.currency_code,
+            value = EXCLUDED.value;
+    """).format(sql.Identifier(table_name))
+    cursor.execute(insert_query, [ticker, period_type, report_type, NUMERIC_PATTERN])
+    rows_written = cursor.rowcount
+    cursor.close()
+    return rows_written
+
+def drop_legacy_table(conn, ticker, period_type, report_type):
+    """Drop a legacy statement table once its data is in fundamentals."""
+    cursor = conn.cursor()
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(f"{ticker}_{period_type}_{report_type}")))
+    cursor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate legacy per-ticker statement tables into the fundamentals table")
+    parser.add_argument('tickers', nargs='*', help="tickers to migrate (default: every ticker in financial_master)")
+    parser.add_argument('--drop-legacy', action='store_true', help="drop each legacy table after it is copied")
+    args = parser.parse_args()
+
+    conn = get_database_connection()
+    create_fundamentals_table(conn)
+    create_data_versions_table(conn)
+    tickers = args.tickers or get_all_tickers(conn)
+
+    for ticker in tickers:
+        try:
+            rows_written = 0
+            for period_type in ['q', 'a']:
+                for report_type in FUNDAMENTAL_REPORT_TYPES:
+                    rows_written += migrate_table(conn, ticker, period_type, report_type)
+                    if args.drop_legacy:
+                        drop_legacy_table(conn, ticker, period_type, report_type)
+            mark_data_changed(conn, 'fundamentals', ticker)
+            # Commit per ticker so an interrupted migration can simply be re-run
+            conn.commit()
+            print(f"Migrated {rows_written} line items for {ticker}")
+        except Exception as e:
+            print(f"Failed to migrate {ticker}: {e}")
+            conn.rollback()
+
+    conn.close()
+
+if __name__ == '__main__':
+    main()
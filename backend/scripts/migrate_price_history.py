@@ -0,0 +1,77 @@
+# Script to move the legacy "{ticker}_1d_price_history" tables into the shared, date-partitioned price_history table.
+# Each legacy table is copied with one server-side INSERT ... SELECT.
+# The legacy tables are left in place, pass --drop-legacy to drop each one after it has been copied.
+
+import argparse
+from psycopg2 import sql
+from stock_data_script import get_database_connection, get_all_tickers, create_price_history_table, create_price_history_partitions
+from db_interface import create_data_versions_table, mark_data_changed
+
+def get_legacy_date_range(conn, table_name):
+    """Return (min date, max date) of a legacy price table, or None if it doesn't exist or is empty."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT to_regclass(%s);", [f'"{table_name}"'])
+    if cursor.fetchone()[0] is None:
+        cursor.close()
+        return None
+    cursor.execute(sql.SQL("SELECT MIN(date), MAX(date) FROM {};").format(sql.Identifier(table_name)))
+    date_range = cursor.fetchone()
+    cursor.close()
+    if date_range[0] is None:
+        return None
+    return date_range
+
+def migrate_ticker(conn, ticker, drop_legacy=False) -> int:
+    """Copy one ticker's legacy price table into price_history, returning the number of rows written."""
+    table_name = f"{ticker}_1d_price_history"
+    date_range = get_legacy_date_range(conn, table_name)
+    if date_range is None:
+        return 0
+    create_price_history_partitions(conn, *date_range)
+    cursor = conn.cursor()
+    insert_query = sql.SQL("""
+        INSERT INTO price_history (ticker, date, open, high, low, close, volume, adj_close)
+        SELECT %s, date, open::double precision, high::double precision, low::double precision,
+            close::double precision, volume, adj_close::double precision
+        FROM {}
+        ON CONFLICT (ticker, date) DO UPDATE SET
+            open = EXCLUDED.open,
+            high = EXCLUDED.high,
+            low = EXCLUDED.low,
+            close = EXCLUDED.close,
+            volume = EXCLUDED.volume,
+            adj_close = EXCLUDED.adj_close;
+    """).format(sql.Identifier(table_name))
+    cursor.execute(insert_query, [ticker])
+    rows_written = cursor.rowcount
+    mark_data_changed(conn, 'price_history', ticker)
+    if drop_legacy:
+        cursor.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(table_name)))
+    cursor.close()
+    return rows_written
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate legacy per-ticker price tables into the price_history table")
+    parser.add_argument('tickers', nargs='*', help="tickers to migrate (default: every ticker in financial_master)")
+    parser.add_argument('--drop-legacy', action='store_true', help="drop each legacy table after it is copied")
+    args = parser.parse_args()
+
+    conn = get_database_connection()
+    create_price_history_table(conn)
+    create_data_versions_table(conn)
+    tickers = args.tickers or get_all_tickers(conn)
+
+    for ticker in tickers:
+        try:
+            rows_written = migrate_ticker(conn, ticker, drop_legacy=args.drop_legacy)
+            # Commit per ticker so an interrupted migration can simply be re-run
+            conn.commit()
+            print(f"Migrated {rows_written} price rows for {ticker}")
+        except Exception as e:
+            print(f"Failed to migrate {ticker}: {e}")
+            conn.rollback()
+
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 # Script to add daily stock price history tables to the PostgreSQL database.
 
+import sys
 import psycopg2
 import os
 import pandas as pd
@@ -8,6 +9,9 @@ from dotenv import load_dotenv
 from datetime import datetime
 from psycopg2.extras import execute_values
 
+sys.path.append("..")
+from db_interface import create_data_versions_table, mark_data_changed, MARKET_INDICES
+
 def get_database_connection():
     """Establish a connection to the PostgreSQL database."""
     load_dotenv()
@@ -34,52 +38,58 @@ def get_all_tickers(conn):
     tickers = [t[0] for t in tickers]
     return tickers
 
-def create_price_history_table(conn, ticker):
-    """Create a price history table for the given ticker if it doesn't exist."""
+def create_price_history_table(conn):
+    """Create the price history table shared by every ticker if it doesn't exist."""
     cursor = conn.cursor()
-    table_name = f"{ticker}_1d_price_history"
-    create_query = f"""
-    CREATE TABLE IF NOT EXISTS "{table_name}" (
-        date DATE PRIMARY KEY,
-        open NUMERIC,
-        high NUMERIC,
-        low NUMERIC,
-        close NUMERIC,
+    # One table for all tickers, range partitioned by date so old years can be detached or moved independently
+    create_query = """
+    CREATE TABLE IF NOT EXISTS price_history (
+        ticker TEXT NOT NULL,
+        date DATE NOT NULL,
+        open DOUBLE PRECISION,
+        high DOUBLE PRECISION,
+        low DOUBLE PRECISION,
+        close DOUBLE PRECISION,
         volume BIGINT,
-        adj_close NUMERIC
-    );
+        adj_close DOUBLE PRECISION,
+        PRIMARY KEY (ticker, date)
+    ) PARTITION BY RANGE (date);
     """
     cursor.execute(create_query)
+    # Covering index for cross-sectional panels (many tickers over a date window) so they are served by one index range scan
+    cursor.execute("CREATE INDEX IF NOT EXISTS price_history_date_ticker_idx ON price_history (date, ticker) INCLUDE (close, adj_close);")
+    conn.commit()
+    cursor.close()
+
+def create_price_history_partitions(conn, start_date, end_date):
+    """Create the yearly partitions of price_history covering start_date through end_date."""
+    cursor = conn.cursor()
+    for year in range(start_date.year, end_date.year + 1):
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS price_history_{year} PARTITION OF price_history
+        FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01');
+        """)
     conn.commit()
     cursor.close()
 
 def get_last_date_in_db(conn, ticker):
     """Get the most recent date for which we have price data in the database."""
     cursor = conn.cursor()
-    table_name = f"{ticker}_1d_price_history"
-    # Check if table exists
-    cursor.execute(f"SELECT to_regclass('{table_name}');")
-    result = cursor.fetchone()
-    if result[0] is None:
-        last_date = None
-    else:
-        # Get the max date from the table
-        cursor.execute(f'SELECT MAX(date) FROM "{table_name}";')
-        result = cursor.fetchone()
-        last_date = result[0]
+    cursor.execute("SELECT MAX(date) FROM price_history WHERE ticker = %s;", (ticker,))
+    last_date = cursor.fetchone()[0]
     cursor.close()
     return last_date
 
 def insert_price_data(conn, ticker, df):
     """Insert price data into the database."""
+    create_price_history_partitions(conn, df.index.min(), df.index.max())
     cursor = conn.cursor()
-    table_name = f"{ticker}_1d_price_history"
 
     # Prepare the insert query with ON CONFLICT to handle duplicates
-    insert_query = f"""
-    INSERT INTO "{table_name}" (date, open, high, low, close, volume, adj_close)
+    insert_query = """
+    INSERT INTO price_history (ticker, date, open, high, low, close, volume, adj_close)
     VALUES %s
-    ON CONFLICT (date) DO UPDATE SET
+    ON CONFLICT (ticker, date) DO UPDATE SET
         open = EXCLUDED.open,
         high = EXCLUDED.high,
         low = EXCLUDED.low,
@@ -92,6 +102,7 @@ def insert_price_data(conn, ticker, df):
     values = []
     for index, row in df.iterrows():
         values.append((
+            ticker,
             index.date(),  # date
             float(row['Open']) if pd.notnull(row['Open']) else None,        # open
             float(row['High']) if pd.notnull(row['High']) else None,        # high
@@ -103,6 +114,8 @@ def insert_price_data(conn, ticker, df):
 
     try:
         execute_values(cursor, insert_query, values)
+        # New version for the API's ETags, committed together with the prices
+        mark_data_changed(conn, 'price_history', ticker)
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -116,8 +129,6 @@ def update_price_history(conn, ticker):
     try:
         # Start a new transaction
         with conn:
-            # Create the table if it doesn't exist
-            create_price_history_table(conn, ticker)
             last_date = get_last_date_in_db(conn, ticker)
 
             # Get price data from yfinance
@@ -144,11 +155,15 @@ def update_price_history(conn, ticker):
         # raise e
 
 def main():
-    """Main function to update price history for all tickers."""
+    """Main function to update price history for all tickers and benchmark indices."""
     # Connect to database
     conn = get_database_connection()
 
-    tickers = get_all_tickers(conn)
+    # The benchmark indices are stored next to the stocks so the models read their market returns without network access
+    tickers = get_all_tickers(conn) + MARKET_INDICES
+    # Create the shared price history table if it doesn't exist
+    create_price_history_table(conn)
+    create_data_versions_table(conn)
 
     # For each ticker, update price history
     for ticker in tickers:
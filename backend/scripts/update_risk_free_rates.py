@@ -0,0 +1,45 @@
+# Script to download risk-free rate series from FRED and store them in the risk_free_rates table.
+# The models read the stored series (RISK_FREE_SERIES, the monthly 3-month Treasury bill rate) instead of calling FRED for
+# every model object, so this runs once a day before generate_multifactor_models.py. FRED_API_KEY has to be set.
+# usage: python update_risk_free_rates.py [--series TB3MS] [--start 1990-01-01]
+
+import sys
+import os
+import time
+import argparse
+from fredapi import Fred
+from dotenv import load_dotenv
+
+sys.path.append("..")
+from db_interface import DBInterface
+from capm_model import RISK_FREE_SERIES
+
+def update_risk_free_rates(db_interface, fred, series, start_date=None) -> int:
+    """Download the observations of a FRED series from start_date (the whole series by default) and upsert them."""
+    observations = fred.get_series(series, observation_start=start_date)
+    stored = db_interface.push_risk_free_rates(series, observations)
+    if stored:
+        print(f"Stored {stored} {series} observations from {observations.dropna().index.min().date()} to {observations.dropna().index.max().date()}")
+    else:
+        print(f"No {series} observations to store")
+    return stored
+
+def main():
+    parser = argparse.ArgumentParser(description="Download and store risk-free rate series from FRED")
+    parser.add_argument('--series', nargs='+', default=[RISK_FREE_SERIES], help=f"FRED series ids (default {RISK_FREE_SERIES})")
+    parser.add_argument('--start', help="first observation date (YYYY-MM-DD, default the whole series)")
+    args = parser.parse_args()
+
+    db_interface = DBInterface()
+    fred = Fred(api_key=os.getenv('FRED_API_KEY'))
+    start = time.time()
+    for series in args.series:
+        try:
+            update_risk_free_rates(db_interface, fred, series, args.start)
+        except Exception as e:
+            print(f"Failed to update {series}: {e}")
+    print(f"Time elapsed: {round(time.time() - start, 2)} seconds")
+
+if __name__ == '__main__':
+    load_dotenv()
+    main()
@@ -0,0 +1,212 @@
+# Script to check the vectorized characteristics engine (characteristics.py) against the per-ticker loops it replaced.
+# For every formation date the size, B/M, profitability and investment of each ticker are computed both ways from the database
+# and compared, the script exits with status 1 if any ticker or value differs.
+# Before that, the engine is checked without the database against the outputs the loops produced on a small hand-made universe
+# (PINNED_CHARACTERISTICS), --pinned runs only that check.
+# --synthetic N times the engine on a generated universe of N tickers instead, without touching the database.
+# usage: python verify_characteristics.py [--dates 2023-06-30 2024-06-30] [--tickers AAPL MSFT] [--pinned] [--synthetic 3000]
+
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+sys.path.append("..")
+from db_interface import DBInterface
+from characteristics import CHARACTERISTICS, build_characteristics, load_characteristics
+
+def latest_statement(db_interface, ticker, date, report_type):
+    """Return the latest non-TTM quarterly statement on or before the date, None if there is none."""
+    statements = db_interface.query(ticker=ticker, period_type='q', report_type=report_type, as_of_date=date, exclude_ttm=True, latest=1)
+    return statements[-1] if statements else None
+
+def reference_characteristics(db_interface, tickers, date) -> dict:
+    """Compute every characteristic one ticker at a time, the way CAPMModel did before the engine."""
+    results = {name: {} for name in CHARACTERISTICS}
+    for ticker in tickers:
+        balance_sheet = latest_statement(db_interface, ticker, date, 'balance_sheet')
+        income_statement = latest_statement(db_interface, ticker, date, 'income')
+        prior_balance_sheet = latest_statement(db_interface, ticker, date - relativedelta(years=1), 'balance_sheet')
+
+        if balance_sheet is not None:
+            shares_outstanding = balance_sheet.get('ShareIssued')
+            total_equity = balance_sheet.get('StockholdersEquity')
+            price_data = db_interface.query_stock_history(ticker=ticker, end_date=date)
+            stock_price = price_data[-1]['close'] if price_data else None
+            if shares_outstanding is not None and total_equity is not None and stock_price is not None \
+                    and shares_outstanding != 0 and stock_price != 0:
+                stock_price = float(stock_price)
+                results['market_cap'][ticker] = shares_outstanding * stock_price
+                results['bm_ratio'][ticker] = total_equity / shares_outstanding / stock_price
+
+        if balance_sheet is not None and income_statement is not None:
+            revenue = income_statement.get('TotalRevenue', np.nan)
+            cogs = income_statement.get('CostOfRevenue', np.nan)
+            sga = income_statement.get('SellingGeneralAndAdministration', np.nan)
+            interest_expense = income_statement.get('InterestExpense', 0.0)
+            total_equity = balance_sheet.get('StockholdersEquity', np.nan)
+            if not (np.isnan(revenue) or np.isnan(cogs) or np.isnan(sga) or np.isnan(total_equity) or total_equity == 0):
+                results['profitability'][ticker] = (revenue - cogs - sga - interest_expense) / total_equity
+
+        if balance_sheet is not None and prior_balance_sheet is not None:
+            total_assets = balance_sheet.get('TotalAssets', np.nan)
+            prior_total_assets = prior_balance_sheet.get('TotalAssets', np.nan)
+            if not (np.isnan(total_assets) or np.isnan(prior_total_assets) or prior_total_assets == 0):
+                results['investment'][ticker] = (total_assets - prior_total_assets) / prior_total_assets
+    return results
+
+def compare(date, reference, characteristics) -> int:
+    """Print every ticker whose characteristic differs between the two implementations, return the number of differences."""
+    if date in characteristics.index.get_level_values('date'):
+        engine = characteristics.xs(date, level='date')
+    else:
+        engine = pd.DataFrame(columns=CHARACTERISTICS, dtype=float)
+    differences = 0
+    for name in CHARACTERISTICS:
+        expected = reference[name]
+        actual = engine[name].dropna().to_dict()
+        for ticker in sorted(set(expected) | set(actual)):
+            if ticker not in expected or ticker not in actual or not np.isclose(expected[ticker], actual[ticker], rtol=1e-12, atol=0):
+                print(f"{date.date()} {name} {ticker}: loop {expected.get(ticker)} engine {actual.get(ticker)}")
+                differences += 1
+        print(f"{date.date()} {name}: {len(expected)} tickers (loop), {len(actual)} tickers (engine)")
+    return differences
+
+def pinned_panel():
+    """Return the statement history, daily closes and formation dates of the hand-made universe of the pinned check."""
+    dates = pd.DatetimeIndex(['2023-06-30', '2024-06-30'], name='date')
+    quarters = pd.date_range('2022-03-31', '2024-09-30', freq='QE')
+    rows = []
+    for i, ticker in enumerate(['AAA', 'BBB', 'CCC', 'DDD', 'EEE']):
+        for q, as_of_date in enumerate(quarters):
+            growth = 1 + 0.02 * q * (i + 1)
+            statements = {
+                'balance_sheet': {'ShareIssued': 1e6 * (i + 1), 'StockholdersEquity': 5e6 * (i + 1) * growth, 'TotalAssets': 2e7 * growth},
+                'income': {'TotalRevenue': 3e6 * growth, 'CostOfRevenue': 1.2e6 * growth, 'SellingGeneralAndAdministration': 4e5 * (i + 1),
+                           'InterestExpense': 5e4 * (i + 1)},
+            }
+            # BBB never reports interest expense, CCC's statements start in 2023 (no investment a year later) and its equity
+            # drops to zero in mid 2024, DDD reports zero shares in mid 2024 and EEE's last two income statements are missing
+            if ticker == 'BBB':
+                del statements['income']['InterestExpense']
+            if ticker == 'CCC' and as_of_date < pd.Timestamp('2023-03-31'):
+                continue
+            if ticker == 'CCC' and as_of_date == pd.Timestamp('2024-06-30'):
+                statements['balance_sheet']['StockholdersEquity'] = 0.0
+            if ticker == 'DDD' and as_of_date == pd.Timestamp('2024-06-30'):
+                statements['balance_sheet']['ShareIssued'] = 0.0
+            if ticker == 'EEE' and as_of_date >= pd.Timestamp('2024-03-31'):
+                del statements['income']
+            for report_type, values in statements.items():
+                rows += [(ticker, report_type, as_of_date, '3M', line_item, value) for line_item, value in values.items()]
+    history = pd.DataFrame(rows, columns=['ticker', 'report_type', 'as_of_date', 'period_code', 'line_item', 'value'])
+    days = pd.bdate_range('2022-01-03', '2024-09-30', name='date')
+    closes = pd.DataFrame({ticker: 10.0 * (i + 1) + 0.01 * np.arange(len(days)) for i, ticker in enumerate(['AAA', 'BBB', 'CCC', 'DDD', 'EEE'])}, index=days)
+    # DDD only trades from July 2023 and EEE's close is missing on the last trading day before the second formation date
+    closes.loc[:'2023-06-30', 'DDD'] = np.nan
+    closes.loc['2024-06-28', 'EEE'] = np.nan
+    return history, closes, dates
+
+# Outputs of reference_characteristics (the per-ticker loops) on pinned_panel, by formation date and characteristic
+PINNED_CHARACTERISTICS = {
+    '2023-06-30': {
+        'market_cap': {'AAA': 13890000.0, 'BBB': 47780000.0, 'CCC': 101670000.0, 'EEE': 269450000.0},
+        'bm_ratio': {'AAA': 0.3959683225341972, 'BBB': 0.25115110925073253, 'CCC': 0.19179699026261435, 'EEE': 0.13917238819818148},
+        'profitability': {'AAA': 0.27818181818181825, 'BBB': 0.11333333333333333, 'CCC': 0.05076923076923077, 'DDD': 0.025714285714285714,
+                          'EEE': 0.012},
+        'investment': {'AAA': 0.0784313725490196, 'BBB': 0.15384615384615385, 'DDD': 0.2962962962962963, 'EEE': 0.36363636363636365},
+    },
+    '2024-06-30': {
+        'market_cap': {'AAA': 16490000.000000002, 'BBB': 52980000.00000001, 'CCC': 109470000.0},
+        'bm_ratio': {'AAA': 0.35779260157671317, 'BBB': 0.25670064175160434, 'CCC': 0.0},
+        'profitability': {'AAA': 0.28372881355932206, 'BBB': 0.12117647058823532, 'DDD': 0.037674418604651164, 'EEE': 0.01705263157894739},
+        'investment': {'AAA': 0.07272727272727272, 'BBB': 0.13333333333333316, 'CCC': 0.18461538461538463, 'DDD': 0.22857142857142856,
+                       'EEE': 0.26666666666666666},
+    },
+}
+
+def run_pinned() -> int:
+    """Compare the engine with the pinned loop outputs on the hand-made universe, return the number of differences."""
+    history, closes, dates = pinned_panel()
+    # The close of each ticker's last trading day on or before every date, like DBInterface.query_price_snapshots
+    prices = closes.reindex(dates, method='pad')
+    characteristics = build_characteristics(history, prices, dates)
+    differences = 0
+    for date in dates:
+        differences += compare(date, PINNED_CHARACTERISTICS[date.strftime('%Y-%m-%d')], characteristics)
+    return differences
+
+def synthetic_history(num_tickers, dates, seed=0) -> pd.DataFrame:
+    """Generate quarterly balance sheet and income statements covering the formation dates and the year before them."""
+    rng = np.random.default_rng(seed)
+    quarters = pd.date_range(dates.min() - relativedelta(years=2), dates.max(), freq='QE')
+    tickers = [f"T{i:05d}" for i in range(num_tickers)]
+    frames = []
+    for report_type, line_items in [('balance_sheet', ['ShareIssued', 'StockholdersEquity', 'TotalAssets']),
+                                    ('income', ['TotalRevenue', 'CostOfRevenue', 'SellingGeneralAndAdministration', 'InterestExpense'])]:
+        index = pd.MultiIndex.from_product([tickers, quarters, line_items], names=['ticker', 'as_of_date', 'line_item'])
+        frame = index.to_frame(index=False)
+        frame['report_type'] = report_type
+        frame['period_code'] = '3M'
+        frame['value'] = rng.lognormal(20, 1, len(frame))
+        # Drop a few line items so the missing value paths are exercised
+        frames.append(frame[rng.random(len(frame)) > 0.02])
+    return pd.concat(frames, ignore_index=True)[['ticker', 'report_type', 'as_of_date', 'period_code', 'line_item', 'value']]
+
+def run_synthetic(num_tickers, dates):
+    history = synthetic_history(num_tickers, dates)
+    tickers = sorted(history['ticker'].unique())
+    prices = pd.DataFrame(np.random.default_rng(1).lognormal(4, 0.5, (len(dates), len(tickers))), index=dates, columns=tickers)
+    start = time.perf_counter()
+    characteristics = build_characteristics(history, prices, dates)
+    elapsed = time.perf_counter() - start
+    print(f"{num_tickers} tickers, {len(dates)} formation dates, {len(history)} statement values: {elapsed:.3f}s")
+    print(characteristics.notna().groupby(level='date').sum())
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the vectorized characteristics engine with the per-ticker loops")
+    parser.add_argument('--dates', nargs='+', help="formation dates (default: June 30 of each of the last three years)")
+    parser.add_argument('--tickers', nargs='+', help="tickers to compare (default: every ticker)")
+    parser.add_argument('--pinned', action='store_true', help="only compare the engine with the pinned loop outputs, without the database")
+    parser.add_argument('--synthetic', type=int, help="time the engine on this many generated tickers instead of comparing with the database")
+    args = parser.parse_args()
+
+    if args.dates:
+        dates = pd.DatetimeIndex(pd.to_datetime(args.dates), name='date')
+    else:
+        year = pd.Timestamp.today().year
+        dates = pd.DatetimeIndex([pd.Timestamp(year - i, 6, 30) for i in range(3, 0, -1)], name='date')
+
+    if args.synthetic:
+        run_synthetic(args.synthetic, dates)
+        return
+
+    differences = run_pinned()
+    if args.pinned or differences:
+        print(f"{differences} differences from the pinned loop outputs" if differences else "No differences from the pinned loop outputs")
+        sys.exit(1 if differences else 0)
+
+    db_interface = DBInterface()
+    tickers = args.tickers or db_interface.all_tickers
+
+    start = time.perf_counter()
+    characteristics = load_characteristics(db_interface, dates, tickers=tickers)
+    engine_time = time.perf_counter() - start
+
+    loop_time = 0.0
+    for date in dates:
+        start = time.perf_counter()
+        reference = reference_characteristics(db_interface, tickers, date)
+        loop_time += time.perf_counter() - start
+        differences += compare(date, reference, characteristics)
+
+    print(f"Loop: {loop_time:.2f}s, engine: {engine_time:.2f}s for {len(tickers)} tickers and {len(dates)} formation dates")
+    if differences:
+        print(f"{differences} differences found")
+        sys.exit(1)
+    print("No differences found")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Script to check the model_jobs queue (model_jobs.py) against the configured PostgreSQL database, e.g. a local instance.
+# A throwaway run of synthetic jobs is queued and several worker processes claim them at once with a dummy fit. One of them
+# dies right after its first claim and another one spends more than two leases on its first batch, kept alive by heartbeats.
+# The script checks that every job is completed exactly once, that the dead worker's jobs were reclaimed once its lease
+# expired, and exits with status 1 otherwise. The run's jobs are deleted afterwards.
+# usage: python verify_model_queue.py [--jobs 200] [--workers 4] [--lease 3]
+
+import sys
+import os
+import time
+import argparse
+import datetime
+import multiprocessing
+from collections import Counter
+
+sys.path.append("..")
+from db_interface import DBInterface
+from model_jobs import run_model_jobs
+
+def queue_worker(run_id, name, lease_seconds, processed, behaviour='normal'):
+    """Work on the run with a dummy fit, a 'crash' worker exits without finishing anything after its first claim and a 'slow' one
+    holds its first batch for more than two leases."""
+    db_interface = DBInterface()
+    batches = []
+
+    def process_jobs(jobs):
+        if behaviour == 'crash':
+            os._exit(1)
+        if behaviour == 'slow' and not batches:
+            time.sleep(lease_seconds * 2.5)
+        batches.append(jobs)
+        time.sleep(0.01 * len(jobs))
+        processed.extend([(ticker, num_years) for ticker, num_years, _ in jobs])
+        return {(ticker, num_years): None for ticker, num_years, _ in jobs}
+
+    run_model_jobs(db_interface, run_id, process_jobs, worker=name, batch_size=8, lease_seconds=lease_seconds, poll_interval=0.5)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the model_jobs queue with concurrent workers")
+    parser.add_argument('--jobs', type=int, default=200, help="number of synthetic jobs")
+    parser.add_argument('--workers', type=int, default=4, help="number of worker processes, one of them dies")
+    parser.add_argument('--lease', type=int, default=3, help="lease in seconds")
+    args = parser.parse_args()
+
+    db_interface = DBInterface()
+    run_id = db_interface.start_model_run()
+    jobs = [(f"QUEUE_TEST_{i:05d}", years) for i in range(args.jobs // 2) for years in (10, 5)]
+    db_interface.enqueue_model_jobs(run_id, jobs, datetime.date.today())
+    print(f"Queued {len(jobs)} jobs for run {run_id}")
+
+    start = time.time()
+    with multiprocessing.Manager() as manager:
+        processed = manager.list()
+        # The crashing worker starts first so it certainly claims a batch
+        crashed = multiprocessing.Process(target=queue_worker, args=(run_id, 'crashing-worker', args.lease, processed, 'crash'))
+        crashed.start()
+        crashed.join()
+        workers = [multiprocessing.Process(target=queue_worker, args=(run_id, f"worker-{i}", args.lease, processed, 'slow' if i == 0 else 'normal'))
+                   for i in range(args.workers - 1)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        processed = Counter(processed)
+    elapsed = time.time() - start
+
+    with db_interface.pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT ticker, num_years, status, attempts, worker FROM model_jobs WHERE run_id = %s", (run_id,))
+        rows = cursor.fetchall()
+        cursor.execute("DELETE FROM model_jobs WHERE run_id = %s", (run_id,))
+        conn.commit()
+        cursor.close()
+
+    statuses = Counter(status for _, _, status, _, _ in rows)
+    reclaimed = [row for row in rows if row[3] > 1]
+    duplicates = [job for job, count in processed.items() if count > 1]
+    missing = [job for job in jobs if job not in processed]
+    print(f"{len(rows)} jobs in {elapsed:.1f}s: {dict(statuses)}")
+    print(f"Per worker: {dict(Counter(worker for _, _, _, _, worker in rows))}")
+    print(f"Reclaimed after the crash: {len(reclaimed)}, processed twice: {len(duplicates)}, never processed: {len(missing)}")
+    if statuses != Counter({'completed': len(jobs)}) or duplicates or missing or not reclaimed:
+        print("Queue check failed")
+        sys.exit(1)
+    print("Queue check passed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Script to check that the process pool of parallel_models.py fits the same models as the per-ticker CAPMModel functions.
+# A small synthetic universe (prices of a few tickers listed and delisted at different dates, an index, a risk-free series and
+# factor returns) is generated in memory, the five and six factor models of every ticker are fitted over two windows both with
+# parallel_multifactor_models and with five_factor_model / six_factor_model, and every result has to agree.
+# The database isn't used, the script exits with status 1 on any difference.
+# usage: python verify_parallel_models.py [--tickers 12] [--workers 2]
+
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append("..")
+from capm_model import CAPMModel, MODEL_FACTORS
+from parallel_models import parallel_multifactor_models
+from factor_engine import FACTORS
+
+MODEL_NAMES = ['Fama-French Five-Factor', 'Fama-French Six-Factor']
+MARKET_INDEX = '^GSPC'
+
+def dates_between(start_date, end_date):
+    """Return the slice of the dates from start_date to end_date (None for no bound), both included."""
+    return slice(None if start_date is None else pd.Timestamp(start_date), None if end_date is None else pd.Timestamp(end_date))
+
+class SyntheticPrices:
+    """The price, risk-free rate and factor queries of DBInterface used by the models, answered from generated series."""
+
+    def __init__(self, num_tickers, seed=0):
+        rng = np.random.default_rng(seed)
+        dates = pd.bdate_range('2021-01-01', '2023-12-29')
+        self.factor_returns = pd.DataFrame(rng.normal(0, 0.005, (len(dates), len(FACTORS))), index=dates, columns=FACTORS)
+        market_returns = rng.normal(0.0004, 0.01, len(dates))
+        self.market = pd.Series(4000 * np.cumprod(1 + market_returns), index=dates)
+        self.risk_free_rates = pd.Series(rng.uniform(0.5, 5, 36), index=pd.date_range('2021-01-01', periods=36, freq='MS'))
+        prices = {}
+        for i in range(num_tickers):
+            loadings = rng.normal(0, 0.5, len(FACTORS))
+            returns = 0.0002 + 1.1 * market_returns + self.factor_returns.to_numpy() @ loadings + rng.normal(0, 0.01, len(dates))
+            close = pd.Series(50 * np.cumprod(1 + returns), index=dates)
+            # Some tickers are listed late, delisted early or miss a few days
+            close.iloc[:int(rng.integers(0, 200)) * (i % 3 == 1)] = np.nan
+            close.iloc[len(dates) - int(rng.integers(0, 150)) * (i % 4 == 2):] = np.nan
+            close.iloc[rng.integers(0, len(dates), 5)] = np.nan
+            prices[f"T{i}"] = close
+        self.prices = pd.DataFrame(prices)
+
+    def query_stock_history_arrays(self, ticker, start_date=None, end_date=None, **kwargs):
+        return pd.DataFrame({'close': self.prices[ticker].loc[dates_between(start_date, end_date)].dropna()})
+
+    def query_market_index(self, market_index, start_date=None, end_date=None, **kwargs):
+        return self.market.loc[dates_between(start_date, end_date)].rename(market_index)
+
+    def export_price_panel(self, tickers=None, start_date=None, end_date=None, **kwargs):
+        return self.prices[tickers].loc[dates_between(start_date, end_date)].dropna(how='all')
+
+    def query_risk_free_rates(self, series, start_date=None, end_date=None):
+        return self.risk_free_rates.rename(series)
+
+    def query_factor_returns(self, start_date=None, end_date=None, factors=None):
+        return self.factor_returns.loc[start_date:end_date, factors or FACTORS]
+
+def differences(expected, actual) -> list:
+    """Names of the results entries that differ between two results dicts of one model."""
+    if expected is None or actual is None:
+        return [] if expected is None and actual is None else ['results']
+    names = []
+    for name in ['betas', 'p_values', 'factor_means']:
+        if not expected[name].index.equals(actual[name].index) or not np.allclose(expected[name], actual[name], rtol=1e-9, atol=1e-12):
+            names.append(name)
+    for name in ['expected_return', 'risk_free_rate', 'average_market_return']:
+        if not np.isclose(expected[name], actual[name], rtol=1e-9, atol=1e-15):
+            names.append(name)
+    return names
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the process pool fits against the per-ticker models")
+    parser.add_argument('--tickers', type=int, default=12, help="synthetic tickers (default 12)")
+    parser.add_argument('--workers', type=int, default=2, help="worker processes (default 2)")
+    args = parser.parse_args()
+
+    model = CAPMModel(fred_api_key=None, db_interface=SyntheticPrices(args.tickers))
+    tickers = list(model.db_interface.prices.columns)
+    windows = [(pd.Timestamp('2021-03-01'), pd.Timestamp('2023-11-30')), (pd.Timestamp('2022-06-15'), pd.Timestamp('2023-11-30'))]
+    model_functions = {'Fama-French Five-Factor': model.five_factor_model, 'Fama-French Six-Factor': model.six_factor_model}
+    failures = 0
+    fits = 0
+    for outcomes in parallel_multifactor_models(model, tickers, MARKET_INDEX, windows, MODEL_NAMES, workers=args.workers, chunk_size=3):
+        for window, model_name, ticker, result, error, _ in outcomes:
+            start_date, end_date = windows[window]
+            expected = model_functions[model_name](ticker, MARKET_INDEX, start_date, end_date)
+            different = [f"error {error}"] if error is not None else differences(expected, result)
+            if different:
+                print(f"{ticker} {model_name} ({start_date.date()} to {end_date.date()}): {', '.join(different)} differ")
+                failures += 1
+            fits += 1
+    print(f"{fits} fits of {len(tickers)} tickers compared, {failures} differ from the per-ticker models")
+    sys.exit(1 if failures or fits != len(tickers) * len(windows) * len(MODEL_NAMES) else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Script to check that concurrent rolling betas requests of api_server.py don't interfere when the data versions change.
+# Many threads call compute_rolling_betas at once for a few tickers, each with one of several made-up versions tuples, so new
+# models are created and old ones dropped while other requests are still using them. Every result has to equal the betas
+# computed for the same ticker one request at a time, the script exits with status 1 on any error or difference.
+# Then one request is held while it loads its prices and requests with newer versions run (enough of them to drop its model),
+# it has to finish with the same betas once released.
+# Needs the prices of the tickers and the market index (and the factor returns for multifactor models) in the database.
+# usage: python verify_rolling_betas.py [--tickers AAPL MSFT] [--model CAPM] [--requests 200] [--threads 16] [--versions 8]
+
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append("..")
+from api_server import compute_rolling_betas, db_interface, ROLLING_BETA_MODELS, ROLLING_BETA_MODELS_KEPT
+
+def main():
+    parser = argparse.ArgumentParser(description="Check concurrent rolling betas requests with changing data versions")
+    parser.add_argument('--tickers', nargs='+', help="tickers to compute (default the first 4 stored tickers)")
+    parser.add_argument('--model', default='CAPM', choices=list(ROLLING_BETA_MODELS.values()), help="model name (default CAPM)")
+    parser.add_argument('--market-index', default='^GSPC', help="market index (default ^GSPC)")
+    parser.add_argument('--years', type=int, default=2, help="years of betas (default 2)")
+    parser.add_argument('--requests', type=int, default=200, help="concurrent requests (default 200)")
+    parser.add_argument('--threads', type=int, default=16, help="threads (default 16)")
+    parser.add_argument('--versions', type=int, default=8, help="distinct versions tuples the requests cycle through (default 8)")
+    args = parser.parse_args()
+
+    tickers = args.tickers or db_interface.all_tickers[:4]
+    def request(i):
+        ticker = tickers[i % len(tickers)]
+        versions = (i % args.versions, 0, 0)
+        return ticker, compute_rolling_betas(ticker, args.market_index, args.years, args.model, 60, None, versions)
+
+    expected = {ticker: compute_rolling_betas(ticker, args.market_index, args.years, args.model, 60, None, (-1, 0, 0)) for ticker in tickers}
+    # Switch threads as often as possible so requests interleave inside the model's methods
+    sys.setswitchinterval(1e-6)
+    start = time.time()
+    failures = 0
+    with ThreadPoolExecutor(args.threads) as executor:
+        futures = [executor.submit(request, i) for i in range(args.requests)]
+        for i, future in enumerate(futures):
+            try:
+                ticker, rows = future.result()
+            except Exception as e:
+                print(f"Request {i} failed: {e!r}")
+                failures += 1
+                continue
+            if rows != expected[ticker]:
+                print(f"Request {i} ({ticker}): {len(rows)} rows differ from the {len(expected[ticker])} rows of the serial request")
+                failures += 1
+    print(f"{args.requests} requests for {len(tickers)} tickers, {failures} failures, {round(time.time() - start, 2)} seconds")
+
+    # The held request waits inside query_stock_history_arrays until the newer requests are done
+    held = threading.Event()
+    release = threading.Event()
+    query_stock_history_arrays = db_interface.query_stock_history_arrays
+    def held_query(*a, **kw):
+        if threading.current_thread().name == 'held':
+            held.set()
+            release.wait()
+        return query_stock_history_arrays(*a, **kw)
+    db_interface.query_stock_history_arrays = held_query
+    outcome = {}
+    def held_request():
+        try:
+            outcome['rows'] = compute_rolling_betas(tickers[0], args.market_index, args.years, args.model, 60, None, ('held', 0, 0))
+        except Exception as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=held_request, name='held')
+    thread.start()
+    held.wait()
+    for i in range(ROLLING_BETA_MODELS_KEPT + 1):
+        compute_rolling_betas(tickers[0], args.market_index, args.years, args.model, 60, None, ('newer', i, 0))
+    release.set()
+    thread.join()
+    db_interface.query_stock_history_arrays = query_stock_history_arrays
+    if 'error' in outcome or outcome['rows'] != expected[tickers[0]]:
+        print(f"Held request: {outcome.get('error', 'betas differ from the serial request')!r}")
+        failures += 1
+    else:
+        print("Held request: same betas after its model was replaced")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()